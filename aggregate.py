@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""This module aggregates the log files of many assassins (see Logger in
+assassin.py), e.g. of all jobs of a project, into one index, so questions
+like "how many calculations timed out last week and how much walltime did
+they take" are answered without grepping tens of thousands of files.
+
+Only the lines that matter for such questions are indexed as events: the
+start of a calculation, its end (finished, timed out or crashed), kills,
+requeues, warnings and errors. The events are stored column by column in a
+numpy .npz file, together with the inode, size and modification time of
+every log file. Indexing again only parses what is new: unchanged files
+are skipped, files that grew are parsed from where the last run stopped
+(logs are only appended to) and only replaced or truncated files are
+parsed again from the start. Files are parsed in parallel by a pool of
+processes.
+
+Every start of a calculation begins a run (several runs may append to the
+same log file, e.g. after a requeue). The summary counts the runs per
+outcome and sums up their walltime (from the start to the last event of
+the run) and the time they sat idle before they were killed (the timeout,
+as given in the message).
+
+Example:
+    python aggregate.py index /scratch/project -i project.npz
+    python aggregate.py summary -i project.npz --since 7d
+"""
+
+import numpy as np
+import os
+import re
+import sys
+import time
+import json
+import fnmatch
+import argparse
+
+from collections import OrderedDict
+from datetime import datetime
+
+
+#--- event kinds ---
+# The first prefix that a message starts with decides the kind of the event.
+START = 0
+FINISHED = 1
+TIMEOUT = 2
+CRASHED = 3
+KILLED = 4
+REQUEUED = 5
+WARNING = 6
+ERROR = 7
+
+kind_names = [
+    "start", "finished", "timeout", "crashed", "killed", "requeued",
+    "warning", "error"
+]
+
+message_kinds = [
+    ("Running command", START),
+    ("Calculation finished", FINISHED),
+    ("Calculation timed out", TIMEOUT),
+    ("Calculation crashed", CRASHED),
+    ("Killing job", KILLED),
+    ("Restart files found", REQUEUED),
+    ("An unexpected error occurred", ERROR)
+]
+
+# the outcomes of a run
+outcomes = [FINISHED, TIMEOUT, CRASHED]
+#---
+
+# the lines that are indexed: important infos, warnings, errors and the
+# unexpected errors (which are logged as ordinary infos)
+line_pattern = re.compile(
+    r"^\[([#wX]| (?=\] .{22}An unexpected error occurred))\] " \
+    r"(\d{4}-\d\d-\d\d), (\d\d):(\d\d):(\d\d): (.*)$",
+    re.MULTILINE
+)
+
+minutes_pattern = re.compile(r"(\d+(?:\.\d*)?) minutes")
+
+
+def classify(marker, message):
+    """The kind of the event of a log line (None if it is not indexed) and
+    the idle time (in s) given in the message (nan if none)"""
+
+    for prefix, kind in message_kinds:
+        if message.startswith(prefix):
+            break
+    else:
+        if marker == "w":
+            kind = WARNING
+        elif marker == "X":
+            kind = ERROR
+        else:
+            return None, np.nan
+
+    idle = np.nan
+    if kind in (TIMEOUT, CRASHED):
+        match = minutes_pattern.search(message)
+        if match:
+            idle = float(match.group(1)) * 60
+
+    return kind, idle
+
+
+def parse_log(path, offset=0):
+    """Parse the log file from offset on. Returns the stat of the file and
+    the times, kinds and idle times of the events as lists. Only complete
+    lines are parsed, the returned stat's size is replaced by the offset
+    after the last complete line."""
+
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        f.seek(offset)
+        data = f.read()
+
+    # a line that is still being written is parsed next time
+    end = data.rfind(b"\n") + 1
+    text = data[:end].decode(errors="replace")
+
+    times, kinds, idles = [], [], []
+
+    # midnight (local time) of every date in the file
+    midnights = {}
+
+    for match in line_pattern.finditer(text):
+        marker, date, hours, minutes, seconds, message = match.groups()
+
+        kind, idle = classify(marker, message)
+        if kind is None:
+            continue
+
+        midnight = midnights.get(date)
+        if midnight is None:
+            midnight = midnights[date] = time.mktime(
+                datetime.strptime(date, "%Y-%m-%d").timetuple()
+            )
+
+        times.append(
+            midnight + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        )
+        kinds.append(kind)
+        idles.append(idle)
+
+    return (stat.st_ino, offset + end, stat.st_mtime), times, kinds, idles
+
+
+def _parse_task(task):
+    """Parse one (path, offset) in a worker, errors are returned"""
+    path, offset = task
+    try:
+        return parse_log(path, offset)
+    except (IOError, OSError) as ex:
+        return ex
+
+
+def find_logs(roots, pattern="assassin.log"):
+    """All files below roots whose name matches pattern, as dict path ->
+    (inode, size, modification time)"""
+
+    found = {}
+    stack = list(roots)
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except (IOError, OSError):
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    stat = entry.stat()
+                    found[os.path.abspath(entry.path)] = \
+                        (stat.st_ino, stat.st_size, stat.st_mtime)
+            except (IOError, OSError):
+                continue
+
+    return found
+
+
+class LogIndex(object):
+    """The events of many assassin logs, stored column by column.
+
+    files_* are the columns of the indexed files (path, inode, size that
+    has been parsed and modification time), events_* the columns of the
+    events (index of the file, time, kind and idle time), ordered by file
+    and by line within a file."""
+
+    file_columns = OrderedDict([
+        ("path", str),
+        ("inode", np.uint64),
+        ("size", np.int64),
+        ("mtime", np.float64)
+    ])
+
+    event_columns = OrderedDict([
+        ("file", np.int32),
+        ("time", np.float64),
+        ("kind", np.int8),
+        ("idle", np.float32)
+    ])
+
+    def __init__(self, files=None, events=None):
+        """Args:
+            files: dict column name -> array (see file_columns).
+            events: dict column name -> array (see event_columns).
+        """
+
+        self.files = files or dict(
+            (name, np.array([], dtype=dtype)) \
+                for name, dtype in self.file_columns.items()
+        )
+        self.events = events or dict(
+            (name, np.array([], dtype=dtype)) \
+                for name, dtype in self.event_columns.items()
+        )
+
+        # statistics of the last update
+        self.n_parsed = 0
+        self.n_appended = 0
+        self.n_skipped = 0
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                dict((name, data["files_" + name]) \
+                    for name in cls.file_columns),
+                dict((name, data["events_" + name]) \
+                    for name in cls.event_columns)
+            )
+
+    def save(self, path):
+        """Write the index (via a temporary file, so readers never see a
+        half written index)"""
+
+        arrays = {}
+        for name in self.file_columns:
+            arrays["files_" + name] = self.files[name]
+        for name in self.event_columns:
+            arrays["events_" + name] = self.events[name]
+
+        path_tmp = path + ".tmp"
+        with open(path_tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path_tmp, path)
+
+    def __len__(self):
+        return len(self.events["time"])
+
+    def update(self, logs, processes=None, chunksize=64):
+        """Index the logs (dict path -> (inode, size, mtime), see
+        find_logs) in a pool of processes. Files that were indexed before
+        are skipped if they did not change, parsed from where the last
+        update stopped if they grew and parsed again otherwise. Files that
+        no longer exist are kept."""
+
+        known = dict(
+            (path, i) for i, path in enumerate(self.files["path"].tolist())
+        )
+
+        #--- decide what to parse ---
+        tasks, reparsed = [], set()
+        self.n_skipped = 0
+        for path, (inode, size, mtime) in logs.items():
+            i = known.get(path)
+            if i is None:
+                tasks.append((path, 0))
+                continue
+
+            offset = int(self.files["size"][i])
+            if int(self.files["inode"][i]) == inode and size >= offset:
+                if size == offset and self.files["mtime"][i] == mtime:
+                    self.n_skipped += 1
+                else:
+                    tasks.append((path, offset))
+            else:
+                tasks.append((path, 0))
+                reparsed.add(i)
+        #---
+
+        #--- parse ---
+        if processes == 1 or len(tasks) < 2:
+            results = [_parse_task(task) for task in tasks]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(processes) as pool:
+                results = list(pool.map(_parse_task, tasks, chunksize=chunksize))
+        #---
+
+        #--- merge ---
+        paths = self.files["path"].tolist()
+        inodes = self.files["inode"].tolist()
+        sizes = self.files["size"].tolist()
+        mtimes = self.files["mtime"].tolist()
+
+        # events of replaced files are dropped
+        keep = ~np.isin(self.events["file"], list(reparsed))
+        new_events = dict(
+            (name, [column[keep]]) for name, column in self.events.items()
+        )
+
+        self.n_parsed, self.n_appended = 0, 0
+        for (path, offset), result in zip(tasks, results):
+            if isinstance(result, Exception):
+                continue
+
+            (inode, size, mtime), times, kinds, idles = result
+
+            i = known.get(path)
+            if i is None:
+                i = len(paths)
+                paths.append(path)
+                inodes.append(inode)
+                sizes.append(size)
+                mtimes.append(mtime)
+            else:
+                inodes[i], sizes[i], mtimes[i] = inode, size, mtime
+
+            if offset > 0:
+                self.n_appended += 1
+            else:
+                self.n_parsed += 1
+
+            new_events["file"].append(np.full(len(times), i, dtype=np.int32))
+            new_events["time"].append(np.array(times, dtype=np.float64))
+            new_events["kind"].append(np.array(kinds, dtype=np.int8))
+            new_events["idle"].append(np.array(idles, dtype=np.float32))
+
+        self.files = {
+            "path": np.array(paths, dtype=str),
+            "inode": np.array(inodes, dtype=np.uint64),
+            "size": np.array(sizes, dtype=np.int64),
+            "mtime": np.array(mtimes, dtype=np.float64)
+        }
+
+        events = dict(
+            (name, np.concatenate(columns).astype(
+                self.event_columns[name], copy=False
+            )) for name, columns in new_events.items()
+        )
+
+        # appended events belong after the older ones of their file (the
+        # order of the lines is kept, even if the clock jumped)
+        order = np.argsort(events["file"], kind="stable")
+        self.events = dict(
+            (name, column[order]) for name, column in events.items()
+        )
+        #---
+
+    def runs(self):
+        """The runs of the calculations (a run begins with the start of a
+        calculation in a log file) as dict of arrays: file, time_start,
+        time_end (of the last event), outcome (the kind of the last
+        finished, timeout or crashed event, -1 if there is none) and idle
+        (the idle time given with the outcome, nan if none)."""
+
+        file = self.events["file"]
+        kind = self.events["kind"]
+        event_time = self.events["time"]
+
+        if len(file) == 0:
+            return {
+                "file": np.array([], dtype=np.int32),
+                "time_start": np.array([]),
+                "time_end": np.array([]),
+                "outcome": np.array([], dtype=np.int8),
+                "idle": np.array([], dtype=np.float32)
+            }
+
+        # a new run begins at every start and in every new file
+        begins = (kind == START)
+        begins[0] = True
+        begins[1:] |= file[1:] != file[:-1]
+        run = np.cumsum(begins) - 1
+        n_runs = run[-1] + 1
+        first = np.flatnonzero(begins)
+
+        time_end = np.full(n_runs, -np.inf)
+        np.maximum.at(time_end, run, event_time)
+
+        # the last outcome of every run (events are in order of time)
+        outcome = np.full(n_runs, -1, dtype=np.int8)
+        idle = np.full(n_runs, np.nan, dtype=np.float32)
+        is_outcome = np.isin(kind, outcomes)
+        outcome[run[is_outcome]] = kind[is_outcome]
+        idle[run[is_outcome]] = self.events["idle"][is_outcome]
+
+        return {
+            "file": file[first],
+            "time_start": event_time[first],
+            "time_end": time_end,
+            "outcome": outcome,
+            "idle": idle
+        }
+
+    def summary(self, since=None, until=None):
+        """Count the runs per outcome that ended between since and until
+        (epoch, None for no limit) and sum up their walltime and idle time
+        (in hours). Returns a list of dicts, one per outcome (runs without
+        outcome are counted as 'running')."""
+
+        runs = self.runs()
+
+        selected = np.ones(len(runs["outcome"]), dtype=bool)
+        if not since is None:
+            selected &= runs["time_end"] >= since
+        if not until is None:
+            selected &= runs["time_end"] < until
+
+        walltime = (runs["time_end"] - runs["time_start"]) / 3600.0
+        idle = np.nan_to_num(runs["idle"]) / 3600.0
+
+        rows = []
+        for outcome in outcomes + [-1]:
+            mask = selected & (runs["outcome"] == outcome)
+            rows.append(OrderedDict([
+                ("outcome", kind_names[outcome] if outcome >= 0 \
+                    else "running"),
+                ("runs", int(mask.sum())),
+                ("walltime_hours", float(walltime[mask].sum())),
+                ("idle_hours", float(idle[mask].sum())),
+                ("files", int(np.unique(runs["file"][mask]).size))
+            ]))
+
+        return rows
+
+    def count(self, since=None, until=None):
+        """Number of events per kind between since and until"""
+
+        mask = np.ones(len(self), dtype=bool)
+        if not since is None:
+            mask &= self.events["time"] >= since
+        if not until is None:
+            mask &= self.events["time"] < until
+
+        counts = np.bincount(
+            self.events["kind"][mask].astype(np.int64),
+            minlength=len(kind_names)
+        )
+        return OrderedDict(zip(kind_names, counts.tolist()))
+
+
+def parse_time(value, time_now=None):
+    """A point in time given as date (YYYY-MM-DD[, HH:MM:SS]) or as age
+    (e.g. 7d, 12h or 30m ago), as epoch"""
+
+    time_now = time.time() if time_now is None else time_now
+
+    match = re.match(r"^(\d+(?:\.\d*)?)([dhm])$", value)
+    if match:
+        unit = {"d": 86400, "h": 3600, "m": 60}[match.group(2)]
+        return time_now - float(match.group(1)) * unit
+
+    for fmt in ("%Y-%m-%d, %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            pass
+
+    raise ValueError("Unknown time: " + value)
+
+
+def index_main(args):
+
+    time_start = time.perf_counter()
+
+    if os.path.exists(args.index):
+        index = LogIndex.load(args.index)
+    else:
+        index = LogIndex()
+
+    logs = find_logs(args.roots, args.pattern)
+    index.update(logs, processes=args.processes)
+    index.save(args.index)
+
+    print("{0} log files found: {1} parsed, {2} appended to, {3} " \
+        "unchanged. {4} events in {5} files indexed ({6:.1f} s).".format(
+        len(logs), index.n_parsed, index.n_appended, index.n_skipped,
+        len(index), len(index.files["path"]),
+        time.perf_counter() - time_start
+    ))
+
+
+def summary_main(args):
+
+    index = LogIndex.load(args.index)
+
+    since = None if args.since is None else parse_time(args.since)
+    until = None if args.until is None else parse_time(args.until)
+
+    rows = index.summary(since, until)
+    counts = index.count(since, until)
+
+    if args.json:
+        print(json.dumps({"runs": rows, "events": counts}, indent=2))
+        return
+
+    print("{0:>10} {1:>8} {2:>8} {3:>16} {4:>12}".format(
+        "outcome", "runs", "files", "walltime [h]", "idle [h]"
+    ))
+    for row in rows:
+        print("{0:>10} {1:>8d} {2:>8d} {3:>16.1f} {4:>12.1f}".format(
+            row["outcome"], row["runs"], row["files"],
+            row["walltime_hours"], row["idle_hours"]
+        ))
+    print("events: " + ", ".join(
+        "{0} {1}".format(n, kind) for kind, n in counts.items()
+    ))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="aggregate.py",
+        description="Indexes the logs of many assassins and summarizes " + \
+            "the outcomes of their calculations."
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    index_parser = subparsers.add_parser(
+        "index",
+        help="Index (or update the index of) all logs below the given " + \
+            "folders."
+    )
+    index_parser.add_argument(
+        'roots',
+        nargs='+',
+        help="Folders that are searched for logs.",
+        metavar='folder'
+    )
+    index_parser.add_argument(
+        '-p', '--pattern',
+        help="Name pattern of the log files (default assassin.log).",
+        default="assassin.log",
+        dest="pattern"
+    )
+    index_parser.add_argument(
+        '-j', '--processes',
+        help="Number of processes that parse logs (default: one per core).",
+        default=None,
+        type=int,
+        dest="processes"
+    )
+
+    summary_parser = subparsers.add_parser(
+        "summary",
+        help="Summarize the outcomes of the indexed calculations."
+    )
+    summary_parser.add_argument(
+        '--since',
+        help="Only runs that ended after this time (YYYY-MM-DD[, " + \
+            "HH:MM:SS] or an age like 7d, 12h).",
+        default=None,
+        dest="since"
+    )
+    summary_parser.add_argument(
+        '--until',
+        help="Only runs that ended before this time.",
+        default=None,
+        dest="until"
+    )
+    summary_parser.add_argument(
+        '--json',
+        help="Print the summary as json.",
+        action="store_true",
+        dest="json"
+    )
+
+    for subparser in (index_parser, summary_parser):
+        subparser.add_argument(
+            '-i', '--index',
+            help="The index file (default assassin_logs.npz).",
+            default="assassin_logs.npz",
+            dest="index"
+        )
+
+    args = parser.parse_args()
+
+    if args.command == "index":
+        index_main(args)
+    elif args.command == "summary":
+        summary_main(args)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -7,23 +7,42 @@ When executed as a script, the assassin will assume the start command to be
 by the default arguments of the assassin's constructor. Email notifications
 are disabled by default as well.
 
+This module is the core watchdog. The subsystems around it are found in 
+assassin_detectors.py (the checks run while lurking), assassin_agents.py 
+(the agents on the nodes of multi-node calculations), assassin_kills.py 
+(the coordination of the kills of many assassins) and assassin_daemon.py 
+(a daemon that watches all jobs on a node).
+
 Author:
     - Johannes Cartus, TU Graz, 07.06.2019
 """
 
-import numpy as np
 import subprocess as sp
 import os, sys
+import re
 import glob 
-
-from functools import reduce
+import json
+import struct
+import bisect
+import signal
+import atexit
+import random
+import zlib
+import fcntl
+import mmap
+import math
+import types
+
+from functools import reduce, wraps
+from collections import namedtuple, deque, OrderedDict
+from array import array
 
 from datetime import datetime
 import time
-import smtplib
-from email.message import EmailMessage
 
-import argparse
+# Thousands of assassins may start at once on a shared file system, so only 
+# the modules needed to launch and watch the calculation are imported here. 
+# Mail and argument parsing modules are imported where they are used.
 
 class DeadCalculation(RuntimeError):
     pass
@@ -31,10 +50,26 @@ class DeadCalculation(RuntimeError):
 class CalculationTimeout(DeadCalculation):
     pass
 
+class CalculationIdle(CalculationTimeout):
+    """Raise this if the processes of the calculation have not used any 
+    cpu time for a long time (e.g. because of a deadlock)"""
+    pass
+
+class CalculationNodeStalled(CalculationTimeout):
+    """Raise this if the ranks of the calculation on one node have not used
+    any cpu time for a long time, while the rest may still be running (see 
+    NodeAgentDetector)"""
+    pass
+
 class CalculationCrashed(DeadCalculation):
     """Raise this if the calculation exited badly"""
     pass 
 
+class CalculationNodeLost(CalculationCrashed):
+    """Raise this if a node of the calculation stopped reporting (e.g. 
+    because it hangs or went down, see NodeAgentDetector)"""
+    pass
+
 class CalculationCrashFoundByProcessHandle(CalculationCrashed):
     """This exception should be thrown if process.poll returns 
     a return code other than 0."""
@@ -45,11 +80,32 @@ class CalculationCrashFoundByErrorFile(CalculationCrashed):
     are found in the error file """
     pass
 
+class CalculationCrashFoundByOutfile(CalculationCrashed):
+    """Raise this if a crash signature of the code (see CodeProfile) is 
+    found in the main outfile"""
+    pass
+
 class CalculationCrashMainOutfileMissing(CalculationCrashed):
     """Raise this if the main outfile is not found and the calculation this 
     killed"""
     pass
 
+class CalculationRepeatingOutput(CalculationCrashed):
+    """Raise this if the calculation only repeats the same block of lines 
+    in its outfile (so the outfile is updated, but nothing happens)"""
+    pass
+
+class CalculationRanksStalled(CalculationTimeout):
+    """Raise this if the outfiles of some ranks (see RankProgressTracker) 
+    have not been updated for a long time, while others still are"""
+    pass
+
+class CalculationRunawayOutput(CalculationCrashed):
+    """Raise this if the outfiles grow so fast that the calculation is 
+    probably stuck in a loop printing the same messages or would fill the
+    disk (or quota) before the job ends"""
+    pass
+
 
 
 
@@ -91,290 +147,3178 @@ class Logger(object):
                 marker + timestamp + ": " + msg + os.linesep
             )
 
-class EMailHandler(object):
-    """This class serves as an interface from the assassin to mailing.
-    
-    Attributes:
-     - sender_address: the addres that will be listed as sender for mails sent.
-     - recipient_address: the mail address the mail should be sent to.
-     - subject_prefix: a string that is added at the front of the subject line
-       to help the receiver to identify the purpose of the mail.
-    """
+class Clock(object):
+    """This class is the assassin's interface to time. All time measurements 
+    and all waiting of the assassin go through an instance of this class, so 
+    it can be exchanged by a simulated clock (e.g. for testing)."""
 
-    _default_logger = Logger
+    def time_now(self):
+        """Current time in s"""
+        return datetime.now().timestamp()
 
-    def __init__(self, 
-        sender_address, 
-        recipient_address,
-        subject_prefix=None,
-        logger=None
-    ):
+    def sleep(self, seconds):
+        """Wait for the given number of seconds"""
+        time.sleep(seconds)
 
-        self.sender_address = sender_address
-        self.recipient_address = recipient_address
-        self.subject_prefix = "" if subject_prefix is None else subject_prefix
+class FileSystem(object):
+    """This class is the assassin's interface to the file system. Every 
+    access of the assassin to the outfiles goes through an instance of this 
+    class, so it can be exchanged by a simulated file system (e.g. for 
+    testing)."""
 
-        # if no logger is specified use the default
-        self._logger = self._default_logger if logger is None else logger
-            
-    def _log(self, msg, level=0):
-        msg = "[Mailer] " + msg
-        self._logger.log(msg=msg, level=level)
+    def stat(self, path):
+        return os.stat(path)
 
-    def send_email(self, subject, message):
-        """Send an email notification to user."""
-        msg = EmailMessage()
-        msg.set_content(message)
-        msg['From'] = self.sender_address
-        msg['To'] = self.recipient_address
-        msg['Subject'] = self.subject_prefix + subject
+    def open(self, path, mode="r"):
+        return open(path, mode)
 
-        self._log("Sending mail to " + self.recipient_address + ": " + subject)
+    def glob(self, pattern):
+        return glob.glob(pattern)
 
-        try:       
-            s = smtplib.SMTP('localhost')
-            s.send_message(msg)
-            s.quit()
+    def statvfs(self, path):
+        return os.statvfs(path)
 
-        except ConnectionRefusedError as ex:
-            self._log("Could not set up connection to localhost! " + str(ex), 3)
+ResourceSample = namedtuple(
+    "ResourceSample", 
+    ["cpu_time", "rss", "n_processes"]
+)
 
-        except Exception as ex:
-            self._log("Un unexpected error occured! " + str(ex), 3)
+class ResourceSampler(object):
+    """Samples the resource usage of a process and all of its descendants 
+    from the proc file system (Linux only).
     
+    A sample contains the cpu time (user + system, in s) and the resident 
+    memory (in bytes) summed up over the whole process tree, and the 
+    number of processes in it.
+    """
 
-class SlurmAssassin(object):
-
-    _logger = Logger
-    _default_email_handler = EMailHandler
+    proc_path = "/proc"
 
-    def __init__(self, 
-        timeout=15,
-        polling_period=5,
-        out_file_name="aims.out",
-        err_file_name="aims.err",
-        email=None
-    ):
+    def __init__(self, max_age=0):
         """Args:
-            timeout: time after which a non-responsive calculation is assumed 
-                to be dead (in minutes!).
-            polling_period: period in which sanity of calculation is checked
-                (also in minutes).
-            out_file_name: name of file to which the calculation must keep
-                writing to be regarded as sane. If "Have a nice day" apears
-                in this file, the calculation is assumed to have finished.
-                The phrase that is checked for can be altered in the 
-                attribute end_of_calculation_string
-            err_file_name: Optionall an error file can be given. This 
-                file will be periodically checked for vsc error messages. 
-                If critical messages are found, the calculation is aborted 
-                (even is time out is not reached yet).
-            email: The email address, that potential notifications (e.g. if
-                a calculation crashes) shall be sent. E.g. 'name@dummy.lol'.
-                Mail will have the prefix '[Slurm-Assassin]' and the sender
-                address noreply@assassin.vsc.info.
+            max_age: a scan of the proc file system is reused for this 
+                many seconds, so several assassins (e.g. in the 
+                AssassinDaemon) can share it.
         """
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
 
-        # store timeout and polling period in seconds 
-        self.timeout = timeout * 60
-
-        # period in which outfiles are checked in seconds
-        self.polling_period_outfiles = polling_period * 60
+        self.max_age = max_age
+        self._last_scan = None
 
-        # period in which calculation process is checked in seconds
-        self.polling_period_process_handle = min([
-            30, 
-            self.polling_period_outfiles / 10
-        ])
+    def _read(self, pid):
+        """Returns the command name of the process and the fields of 
+        /proc/<pid>/stat that follow it"""
+        
+        with open(os.path.join(self.proc_path, str(pid), "stat"), "r") as f:
+            stat = f.read()
 
-        #--- note names of out and error file ---
-        self.out_file_name = out_file_name
-        self.err_file_name = err_file_name
-        #---
+        # the command name may contain spaces and brackets
+        end = stat.rindex(")")
+        return stat[stat.index("(") + 1:end], stat[end + 2:].split()
 
-        # mail address to which notifications should be sent
-        if not email is None:
-            self._email_handler = self._default_email_handler(
-                sender_address="noreply@assassin.vsc.info",
-                recipient_address=email,
-                subject_prefix="[Slurm-Assassin] "
-            )
-        else:
-            self._email_handler = None
+    def read_stat(self, pid):
+        """Returns the fields of /proc/<pid>/stat that follow the command 
+        name, i.e. field n of proc(5) is at index n - 3."""
+        return self._read(pid)[1]
 
-        # start time of job
-        self.time_calculation_start = self.time_now()
+    def _scan(self):
+        """Returns the stat fields of all processes (dict pid -> fields) 
+        and their children (dict pid -> list of pids)"""
 
-        # the time the output files were last updated
-        self.time_last_update_out = self.time_calculation_start
-        self.time_last_update_err = self.time_calculation_start
+        if not self._last_scan is None and \
+            time.monotonic() - self._last_scan[0] <= self.max_age:
+            return self._last_scan[1], self._last_scan[2]
 
-        # initialize handle for aims
-        self._calculation_process = None
+        stats, children, names = {}, {}, {}
+        for entry in os.listdir(self.proc_path):
+            if not entry.isdigit():
+                continue
 
-        # if this string apears in out file the calculation must be finished
-        self.end_of_calculation_string = "Have a nice day"
+            try:
+                name, fields = self._read(entry)
+            except (IOError, OSError, ValueError):
+                # process has ended in the meantime
+                continue
+            
+            pid = int(entry)
+            stats[pid] = fields
+            names[pid] = name
+            children.setdefault(int(fields[1]), []).append(pid)
 
-    @property
-    def out_file_name(self):
+        self._last_scan = (time.monotonic(), stats, children, names)
 
-        # if wild cards are specified, we must dynamically generate the list
-        if self._wild_cards_in_out_files:
-            return reduce(lambda x,y: x + glob.glob(y), self._out_file_name, [])
-        else:
-            return self._out_file_name
+        return stats, children
 
-    @out_file_name.setter
-    def out_file_name(self, value):
+    def find(self, executables):
+        """Returns the state (e.g. 'R' or 'D'), cpu time (in s) and 
+        resident memory (in bytes) of the processes of the current user 
+        whose command name starts with one of executables, as dict 
+        pid -> (state, cpu time, rss)."""
 
-        # check if a list of files is given.    
-        if isinstance(value, list):
-            self._out_file_name = value
+        stats, _ = self._scan()
+        names = self._last_scan[3]
 
-            # if wild cards are specified, we must dynamically generate the list
-            self._wild_cards_in_out_files = np.any([("*" in f) for f in value])
-                
-        else:
-            self._out_file_name = [value]
-            self._wild_cards_in_out_files = "*" in value
+        found = {}
+        for pid, fields in stats.items():
+            if not any(names[pid].startswith(e) for e in executables):
+                continue
 
-    @staticmethod
-    def time_now():
-        """Current time in s"""
-        return datetime.now().timestamp()
+            try:
+                if os.stat(os.path.join(self.proc_path, str(pid))).st_uid \
+                    != os.getuid():
+                    continue
+            except OSError:
+                continue
+
+            found[pid] = (
+                fields[0],
+                (int(fields[11]) + int(fields[12])) / float(self._clock_ticks),
+                int(fields[21]) * self._page_size
+            )
 
-    def get_job_id(self):
-        """Get the id of current slurm job as string"""
-        try:    
-            return os.environ["SLURM_JOB_ID"]
-        except Exception as ex:
-            self.send_email_notification_assassin_error(ex)
-            raise ex
+        return found
 
-    @staticmethod
-    def get_job_name():
-        """Get the jobname of current slurm job if available"""
-        try:
-            return os.environ["SLURM_JOB_NAME"]
-        except KeyError:
-            return "Unknown"
+    def process_tree(self, root_pid):
+        """Returns a dict pid -> stat fields for root_pid and all its 
+        descendants"""
 
-    def time_last_modified(self, file):
-        """Gets the time of last modification (in seconds since ??)"""
+        stats, children = self._scan()
 
-        try: 
-            return os.stat(file).st_mtime
+        tree, queue = {}, [root_pid]
+        while queue:
+            pid = queue.pop()
+            if pid in stats:
+                tree[pid] = stats[pid]
+                queue += children.get(pid, [])
 
-        except FileNotFoundError:
-            
-            # if the missing file was the main file, we have a problem!
-            if file == self.out_file_name[0]:
-                msg = "Main outfile " + file + " not found!"
-                self.log(msg, 3)
-                raise CalculationCrashMainOutfileMissing(msg)
+        return tree
 
-            else:
-                self.log("Outfile " + file + " not found!", 2)
-                return 0
+    def sample(self, root_pid):
+        """Sample the process tree of root_pid. Returns None if it could not
+        be found."""
 
-    def start_calculation_process(self, 
-        command=["mpirun", "aims.x"], 
-        *args, 
-        **kwargs
-    ):
-        """Run a subprocess executing the command to be governed by the 
-        assassin. This will probably be the aims calculation."""
+        try:
+            tree = self.process_tree(root_pid)
+        except (IOError, OSError):
+            return None
         
-        self.log("Running command: " + " ".join(command), 1)
-        self._calculation_process = sp.Popen(command, *args, **kwargs)
+        if not tree:
+            return None
 
-    def terminate_calculation_process(self):
-        """Stop the goverened subprocess."""
-        self.log("Attempting to terminating child process.")
-        self._calculation_process.terminate()
-        self.log("Finished terminating child process.")
+        ticks = sum(int(f[11]) + int(f[12]) for f in tree.values())
+        pages = sum(int(f[21]) for f in tree.values())
 
-    def log(self, msg, level=0):
-        """Write message to log file. There are several levels available 
-        to distinct between more or less important log messages:
-        
-        level should be bettween 0 and 3:
-            - 0 ordinary info
-            - 1 important info
-            - 2 warning
-            - 3 error
+        return ResourceSample(
+            cpu_time=ticks / float(self._clock_ticks),
+            rss=pages * self._page_size,
+            n_processes=len(tree)
+        )
+
+class TraceRecorder(object):
+    """Records every observation of the assassin (modification times and 
+    sizes of the outfiles, the status of the calculation process, resource
+    samples and the result of the finish check) to a compact binary trace, 
+    that can be replayed offline (see replay.py), e.g. to find out which 
+    timeout and polling period would have been suitable for past jobs.
+
+    Layout of a trace file: the magic bytes, the length of a json encoded 
+    header (unsigned int) and the header itself, followed by records of 
+    fixed size (see record_format). A record of kind FILE_NAME assigns an 
+    index to a file name, the (utf-8 encoded, zero padded) name is stored in 
+    the value field of the record and the slots of the following 
+    records.
+    """
+
+    magic = b"SATRACE1"
+
+    # kind, index, time, value a, value b
+    record_format = "<BHddd"
+    record_size = struct.calcsize(record_format)
+
+    #--- kinds of records ---
+    # index: file index, a: number of slots the name occupies 
+    FILE_NAME = 0 
+    # index: file index, a: mtime (0 if missing), b: size in bytes (-1 if 
+    # missing)
+    OUTFILE = 1
+    # a: return code (nan while running)
+    PROCESS = 2
+    # index: number of processes, a: cpu time in s, b: resident memory in 
+    # bytes
+    RESOURCES = 3
+    # a: 1 if end of calculation string was found, else 0
+    FINISHED = 4
+    #---
+
+    def __init__(self, path, header):
+        """Args:
+            path: the file the trace is written to (will be overwritten).
+            header: a json serializable dict with information on the job.
         """
 
-        self._logger.log(msg=msg, level=level)
+        self._record = struct.Struct(self.record_format)
+        self._file_indices = {}
 
-    def send_email(self, subject, message):
-        self._email_handler.send_email(subject=subject, message=message)
+        header = json.dumps(header).encode()
 
-    def send_email_notification_assassin_error(self, exception=None):
-        """Used to send to user an error warning, in case e.g. an exception
-        that cannot be handled occurres"""
+        self._file = open(path, "wb")
+        self._file.write(self.magic + struct.pack("<I", len(header)) + header)
 
-        if not self._email_handler is None:
-            msg = "Dear VSC3 user, " + os.linesep
-            msg += "while tending to your calculation '" +  \
-                self.get_job_name() + "' (job id: " + str(self.get_job_id()) + \
-                    ") an unexpected error occurred. Please manually check " + \
-                        "the situation on vsc immediately!!!"  + os.linesep
-            
-            if not exception is None:
-                msg += "The following error occurred: " + str(exception) + \
-                    os.linesep
+    def _write(self, kind, index, t, a=0.0, b=0.0):
+        self._file.write(self._record.pack(kind, index, t, a, b))
 
-            msg += os.linesep + "Best Regards," + os.linesep
-            msg += "Your favorite Slurm-Assassin"
+    def _file_index(self, t, name):
+        """Index of file name. Unknown names are registered in the trace."""
 
+        try:
+            return self._file_indices[name]
+        except KeyError:
+            index = len(self._file_indices)
+            self._file_indices[name] = index
 
-            self.send_email(
-                subject="Unexpected Assassin-Error, USER ACTION REQUIRED!",
-                message=msg
-            )
+            encoded = name.encode()
+            n_slots = -(-len(encoded) // self.record_size)
+            self._write(self.FILE_NAME, index, t, n_slots)
+            self._file.write(encoded.ljust(n_slots * self.record_size, b"\0"))
 
+            return index
 
-    def send_email_notification_crashed(
-        self, 
-        exception=None, 
-        job_cancelled=True
-    ):
-        """If the user specified a notification email address, 
-        send a notification mail that the job crashed."""
+    def record_outfile(self, t, name, mtime, size):
+        self._write(self.OUTFILE, self._file_index(t, name), t, mtime, size)
 
-        if not self._email_handler is None:
-            msg = "Dear VSC3 user, " + os.linesep
-            msg += "your calculation '" +  self.get_job_name() + \
-                "' has crashed." 
-                        
-            if job_cancelled:
-                msg += "The corresponding job '" + \
-                        str(self.get_job_id()) + "' was thus cancelled." + \
-                            os.linesep
-            else:
-                msg += "Please check the corresponding job '" + \
-                    str(self.get_job_id()) + "'." + os.linesep
+    def record_process(self, t, return_code):
+        self._write(
+            self.PROCESS, 0, t, 
+            float("nan") if return_code is None else return_code
+        )
 
-            if not exception is None:
-                msg += "The following error occurred: " + str(exception) + \
-                    os.linesep
+    def record_resources(self, t, sample):
+        self._write(
+            self.RESOURCES, sample.n_processes, t, sample.cpu_time, sample.rss
+        )
 
-            msg += os.linesep + "Best Regards," + os.linesep
-            msg += "Your favorite Slurm-Assassin"
+    def record_finished(self, t, is_finished):
+        self._write(self.FINISHED, 0, t, float(is_finished))
 
+    def flush(self):
+        self._file.flush()
 
-            self.send_email(
-                subject="Calculation Crashed",
-                message=msg
-            )
+    def close(self):
+        self._file.close()
 
-    def send_email_notification_timeout(self, job_cancelled=True):
-        """If the user specified a notification email address, 
-        send a notification mail that the job timed out."""
+class ShadowLedger(object):
+    """Collects the decisions of an assassin running in shadow mode, i.e.
+    every kill (kill_job) and termination (terminate_calculation_process) 
+    the assassin would have carried out, and writes a machine-readable 
+    (json) summary of them at the end of the job."""
 
-        if not self._email_handler is None:
-            msg = "Dear VSC3 user, " + os.linesep
+    def __init__(self, path):
+        """Args:
+            path: the file the summary is written to.
+        """
+        self.path = path
+        self.decisions = []
+
+        # why the assassin decided to act (attached to recorded decisions)
+        self.reason = None
+
+    def record(self, t, action):
+        """Note that the assassin would have carried out action at time t"""
+        self.decisions.append({
+            "time": t,
+            "action": action,
+            "reason": self.reason
+        })
+
+    @property
+    def time_last_decision(self):
+        return self.decisions[-1]["time"] if self.decisions else None
+
+    def summarize(self, 
+        time_start, 
+        time_end, 
+        time_last_update, 
+        cores, 
+        succeeded,
+        **kwargs
+    ):
+        """Evaluate the recorded decisions at the end of the job. A 
+        decision counts as recovered, if the outfiles were updated 
+        afterwards or the calculation succeeded in the end. The core hours
+        a kill would have saved are the ones spent between the decision and
+        the end of the job. All kwargs are added to the summary."""
+
+        for decision in self.decisions:
+            decision["recovered"] = \
+                succeeded or time_last_update > decision["time"]
+            decision["core_hours_saved"] = \
+                (time_end - decision["time"]) * cores / 3600.0
+
+        kills = [d for d in self.decisions if d["action"] == "kill_job"]
+        first = kills[0] if kills else None
+
+        summary = {
+            "time_start": time_start,
+            "time_end": time_end,
+            "time_last_update": time_last_update,
+            "cores": cores,
+            "core_hours_used": (time_end - time_start) * cores / 3600.0,
+            "succeeded": succeeded,
+            "would_have_killed": not first is None,
+            "time_kill": None if first is None else first["time"],
+            "core_hours_saved": 0.0 if first is None \
+                else first["core_hours_saved"],
+            "recovered": None if first is None else first["recovered"],
+            "decisions": self.decisions
+        }
+        summary.update(kwargs)
+
+        return summary
+
+    def write(self, summary):
+        with open(self.path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+class EventLog(object):
+    """Writes the events of an assassin (start, polls, verdicts, kills, ...)
+    as json lines with a stable schema, so tools can take them in without
+    parsing the messages of the log file. Every line is an object with the
+    keys (in this order):
+
+     - v: the version of the schema (schema_version),
+     - type: the kind of event (one of event_types),
+     - job_id: the id of the job (a string),
+     - detector: the name of the detector that observed the event (null
+       if it did not come from a detector),
+     - time: the wall time of the event (in s, as given by the assassin's
+       clock),
+     - monotonic: time.monotonic() when the event was written, to order
+       events and measure intervals independent of changes of the clock,
+     - values: an object with the measured values, depending on the type.
+
+    The lines are collected in a buffer of buffer_size bytes before they
+    are written. Events of the types in essential_types are written right
+    away, so the last (possibly incomplete) line is always a routine one.
+    The log is appended to (e.g. by the assassin of a requeued job) and
+    capped at max_bytes, independent of the log file: routine events that
+    would exceed the cap are dropped (and counted in n_dropped), essential
+    ones are always written.
+    """
+
+    schema_version = 1
+
+    event_types = [
+        "start", "poll", "ranks_lagging", "subcalculations", "verdict", 
+        "kill", "error", "end"
+    ]
+
+    # few per job, never dropped
+    essential_types = ("start", "verdict", "kill", "error", "end")
+
+    def __init__(self, path, job_id, max_bytes=16 * 1024**2,
+        buffer_size=64 * 1024):
+        """Args:
+            path: the file the events are appended to.
+            job_id: the job id all events are labelled with.
+            max_bytes: the largest size the file may grow to (None for no
+                limit).
+            buffer_size: the size of the write buffer in bytes.
+        """
+
+        self.path = path
+        self.job_id = str(job_id)
+        self.max_bytes = max_bytes
+
+        self._file = open(path, "ab", buffering=buffer_size)
+        self.size = self._file.tell()
+
+        self.n_written = 0
+        self.n_dropped = 0
+
+    def write(self, kind, t, detector=None, values=None):
+        """Write an event of type kind that happened at (wall) time t"""
+
+        if not kind in self.event_types:
+            raise ValueError("Unknown event type: " + str(kind))
+
+        line = (json.dumps(OrderedDict([
+            ("v", self.schema_version),
+            ("type", kind),
+            ("job_id", self.job_id),
+            ("detector", detector),
+            ("time", t),
+            ("monotonic", time.monotonic()),
+            ("values", values or {})
+        ]), separators=(",", ":")) + "\n").encode()
+
+        essential = kind in self.essential_types
+        if not essential and not self.max_bytes is None and \
+            self.size + len(line) > self.max_bytes:
+            self.n_dropped += 1
+            return
+
+        self._file.write(line)
+        self.size += len(line)
+        self.n_written += 1
+
+        if essential:
+            self._file.flush()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class OutputGrowthGuard(object):
+    """Watches how fast the outfiles grow. The total size of the outfiles 
+    (as seen by the assassin at every poll) is kept in a ring buffer, from 
+    which the growth rate over the last polls is computed. The guard 
+    raises CalculationRunawayOutput if
+     - the growth rate exceeds max_growth_rate, or
+     - the output would fill the free space of the file system or the 
+       output quota before the job ends (at the current growth rate).
+    """
+
+    def __init__(self, 
+        max_growth_rate=None, 
+        quota=None, 
+        check_free_space=True,
+        window=5, 
+        time_end=None,
+        horizon=None
+    ):
+        """Args:
+            max_growth_rate: maximum growth rate of the outfiles (in 
+                bytes/s, None for no limit).
+            quota: maximum total size of the outfiles (in bytes, None for 
+                no limit).
+            check_free_space: whether the free space of the file system 
+                of the main outfile is taken into account.
+            window: number of polls over which the growth rate is computed 
+                (no verdict is given before there are this many).
+            time_end: the time the job ends (epoch, e.g. from 
+                SLURM_JOB_END_TIME). 
+            horizon: if the end of the job is not known, the time (in s) 
+                for which the headroom must last (None to not project).
+        """
+
+        self.max_growth_rate = max_growth_rate
+        self.quota = quota
+        self.check_free_space = check_free_space
+        self.time_end = time_end
+        self.horizon = horizon
+
+        # (time, total size of the outfiles) at the last polls
+        self.samples = deque(maxlen=max(2, window))
+
+    @staticmethod
+    def job_end_time(environ=None):
+        """The end time of the slurm job (None if unknown)"""
+        environ = os.environ if environ is None else environ
+        try:
+            return float(environ["SLURM_JOB_END_TIME"])
+        except (KeyError, ValueError):
+            return None
+
+    def add(self, t, size):
+        self.samples.append((t, size))
+
+    @property
+    def growth_rate(self):
+        """Growth rate (in bytes/s) over the samples in the ring buffer 
+        (None if the buffer is not filled yet)"""
+
+        if len(self.samples) < self.samples.maxlen:
+            return None
+
+        (t_first, size_first), (t_last, size_last) = \
+            self.samples[0], self.samples[-1]
+        if t_last <= t_first:
+            return None
+
+        return (size_last - size_first) / float(t_last - t_first)
+
+    def headroom(self, file_system, path):
+        """Bytes the outfiles may still grow (None if unlimited)"""
+
+        headroom = []
+
+        if not self.quota is None and self.samples:
+            headroom.append(self.quota - self.samples[-1][1])
+
+        if self.check_free_space:
+            try:
+                stat = file_system.statvfs(os.path.dirname(path) or ".")
+                headroom.append(stat.f_bavail * stat.f_frsize)
+            except (IOError, OSError, AttributeError):
+                pass
+
+        return min(headroom) if headroom else None
+
+    def check(self, time_now, size, file_system, path):
+        """Add a sample and raise CalculationRunawayOutput if the growth is
+        out of bounds"""
+
+        self.add(time_now, size)
+
+        rate = self.growth_rate
+        if rate is None:
+            return
+
+        if not self.max_growth_rate is None and rate > self.max_growth_rate:
+            raise CalculationRunawayOutput(
+                "Outfiles grow by {0:.3g} MB/s (limit {1:.3g} MB/s).".format(
+                    rate / 1e6, self.max_growth_rate / 1e6
+                )
+            )
+
+        headroom = self.headroom(file_system, path)
+        if headroom is None:
+            return
+
+        if headroom <= 0:
+            raise CalculationRunawayOutput(
+                "No space left for the outfiles (quota or disk full)."
+            )
+
+        if not self.time_end is None:
+            time_remaining = self.time_end - time_now
+        else:
+            time_remaining = self.horizon
+
+        if rate > 0 and not time_remaining is None and \
+            headroom / rate < time_remaining:
+            raise CalculationRunawayOutput(
+                "Outfiles grow by {0:.3g} MB/s and would exhaust the " \
+                "remaining {1:.3g} MB in {2:.0f} s, before the job " \
+                "ends.".format(rate / 1e6, headroom / 1e6, headroom / rate)
+            )
+
+
+class RepetitionDetector(object):
+    """Detects output that has become a repeating cycle of lines, e.g. a 
+    calculation stuck in a loop that prints the same block of messages. 
+    Such a calculation keeps its outfile fresh, so it never times out.
+
+    The detector is fed with the bytes appended to the main outfile. Every
+    complete line is hashed and compared with the lines 1 to max_period 
+    lines before it: for every period p it is counted for how many lines 
+    in a row line i equals line i - p. If this run is at least 
+    min_repeats * p lines long, the output repeats with period p. Only 
+    the hashes of the last max_period lines are kept (with their 
+    positions, so a line is only compared with its earlier occurrences), 
+    so memory does not grow with the outfile.
+
+    Output that could not be fed (see skip) does not break a cycle that 
+    was found, as long as the output after it continues the cycle.
+    """
+
+    def __init__(self, 
+        duration, 
+        max_period=64, 
+        min_repeats=3, 
+        ignore_numbers=False,
+        max_line_length=4096
+    ):
+        """Args:
+            duration: time (in s) the output must have been repeating 
+                before the calculation is considered stuck.
+            max_period: the longest cycle (in lines) that is detected.
+            min_repeats: how often a cycle must be repeated to be noticed.
+            ignore_numbers: whether lines that only differ in numbers 
+                (e.g. an iteration counter) count as the same.
+            max_line_length: only this many bytes of a line are hashed.
+        """
+
+        self.duration = duration
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.ignore_numbers = ignore_numbers
+        self.max_line_length = max_line_length
+
+        self.reset()
+
+    def reset(self):
+
+        # hashes of the last max_period lines and hash -> their positions
+        self._hashes = deque()
+        self._positions = {}
+
+        # period -> number of lines in a row that equal the line one 
+        # period before (only periods with a run are kept). Once a cycle is
+        # found only its period is followed until it breaks.
+        self._runs = {}
+        self._period = None
+
+        self._partial_line = b""
+        self.n_lines = 0
+
+        # whether output was skipped before the next line
+        self._skipped = False
+
+        # the cycle found at the last check (period, first line) and since
+        # when it has been seen
+        self._cycle = None
+        self.time_repeating_since = None
+
+    def _hash(self, line):
+        line = line[:self.max_line_length].rstrip()
+        if self.ignore_numbers:
+            line = re.sub(rb"[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?", b"#", line)
+        return zlib.crc32(line)
+
+    def feed(self, data):
+        """Add bytes appended to the outfile"""
+
+        lines = (self._partial_line + data).split(b"\n")
+
+        # the last line may not be complete yet
+        self._partial_line = lines.pop()[:self.max_line_length]
+
+        for line in lines:
+            h = self._hash(line)
+
+            if self._skipped:
+                self._skipped = False
+                self._continue_cycle(h)
+
+            self._add(h)
+
+    def skip(self):
+        """Some output was not fed (e.g. because the outfile grew by more 
+        than could be read at one poll). The output fed next must start at 
+        the beginning of a line. A cycle that was found is kept if that 
+        output continues it, otherwise the detector starts over."""
+
+        if self._period is None:
+            self.reset()
+        else:
+            self._partial_line = b""
+            self._skipped = True
+
+    def _continue_cycle(self, h):
+        """Align the current cycle with h, the first line after skipped 
+        output: if h is a line of the cycle, the lines of the cycle before 
+        it are added, as if they had been fed."""
+
+        period = self._period
+        if period is None:
+            return
+
+        distances = [
+            self.n_lines - j for j in self._positions.get(h, ()) \
+                if self.n_lines - j <= period
+        ]
+        if distances:
+            for _ in range(period - max(distances)):
+                self._add(self._hashes[-period])
+
+    def _add(self, h):
+        """Add the line with hash h"""
+
+        i = self.n_lines
+
+        period = self._period
+        if not period is None and self._hashes[-period] == h:
+            # the cycle goes on, no need to look at other periods
+            self._runs[period] += 1
+
+        else:
+            # continue the runs of the periods at which the line was seen
+            self._runs = dict(
+                (i - j, self._runs.get(i - j, 0) + 1) \
+                    for j in self._positions.get(h, ())
+            )
+            self._period = self._shortest_period()
+            if not self._period is None:
+                self._runs = {self._period: self._runs[self._period]}
+
+        #--- move the window ---
+        if len(self._hashes) == self.max_period:
+            oldest = self._hashes.popleft()
+            positions = self._positions[oldest]
+            positions.popleft()
+            if not positions:
+                del self._positions[oldest]
+
+        self._hashes.append(h)
+        self._positions.setdefault(h, deque()).append(i)
+        #---
+
+        self.n_lines += 1
+
+    def _shortest_period(self):
+        periods = [
+            p for p, run in self._runs.items() if run >= self.min_repeats * p
+        ]
+        return min(periods) if periods else None
+
+    @property
+    def period(self):
+        """Shortest period (in lines) with which the output currently 
+        repeats (None if it does not)"""
+        return self._period
+
+    def is_stuck(self, time_now):
+        """Whether the output has been repeating for longer than duration. 
+        To be called after new output was fed (once per poll)."""
+
+        period = self.period
+        if period is None:
+            self._cycle, self.time_repeating_since = None, None
+            return False
+
+        # a cycle that was broken and started again is a new one
+        cycle = (period, self.n_lines - self._runs[period])
+        if cycle != self._cycle:
+            self._cycle, self.time_repeating_since = cycle, time_now
+
+        return time_now - self.time_repeating_since > self.duration
+
+
+class RankProgressTracker(object):
+    """Tracks the progress of every outfile (e.g. the per-rank outfiles 
+    matched by the wild cards of out_file_name), so a few live ranks can 
+    not hide many dead ones. The time of the last update and the size of 
+    every file are kept in compact arrays, indexed by path, so tracking 
+    10k files per poll is cheap.
+
+    A rank (i.e. its file)
+     - is stalled if it was not updated for stall_timeout,
+     - lags behind if it was not updated for more than factor times the 
+       median time since the last update of all files (and more than 
+       min_lag).
+    check raises CalculationRanksStalled if at least max_stalled ranks 
+    are stalled, ranks that lag behind are only reported.
+    """
+
+    def __init__(self, stall_timeout, max_stalled=1, factor=10, min_lag=60):
+        """Args:
+            stall_timeout: time (in s) without update after which a rank 
+                is stalled.
+            max_stalled: the number of stalled ranks (int), or the fraction
+                of all ranks (float up to 1), at which the calculation is 
+                regarded dead.
+            factor: a rank lags behind if its time since the last update 
+                exceeds the median by this factor.
+            min_lag: ranks whose last update is more recent than this (in 
+                s) never lag behind.
+        """
+
+        self.stall_timeout = stall_timeout
+        self.max_stalled = max_stalled
+        self.factor = factor
+        self.min_lag = min_lag
+
+        # path -> slot in the arrays
+        self._index = {}
+        self.paths = []
+        self.times_last_update = array("d")
+        self.sizes = array("q")
+
+        # number of the update in which the file was last matched
+        self._seen = array("L")
+        self.n_updates = 0
+
+        self.stalled = []
+        self.lagging = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def update(self, paths, modification_times, sizes, time_start):
+        """Update the files with the modification times and sizes seen at a
+        poll. Modification times before time_start (the start of the 
+        calculation) count as time_start. Files that are no longer matched
+        are dropped."""
+
+        self.n_updates += 1
+        n_updates = self.n_updates
+
+        index = self._index
+        times, current_sizes, seen = \
+            self.times_last_update, self.sizes, self._seen
+
+        for path, time_modified, size in zip(paths, modification_times, sizes):
+            time_modified = max(time_modified, time_start)
+
+            i = index.get(path)
+            if i is None:
+                index[path] = len(self.paths)
+                self.paths.append(path)
+                times.append(time_modified)
+                current_sizes.append(size)
+                seen.append(n_updates)
+                continue
+
+            seen[i] = n_updates
+            if time_modified > times[i] or size != current_sizes[i]:
+                times[i] = max(time_modified, times[i])
+                current_sizes[i] = size
+
+        if len(paths) < len(self.paths):
+            self._drop_unseen()
+
+    def _drop_unseen(self):
+        keep = [i for i, n in enumerate(self._seen) if n == self.n_updates]
+
+        self.paths = [self.paths[i] for i in keep]
+        self.times_last_update = array(
+            "d", (self.times_last_update[i] for i in keep)
+        )
+        self.sizes = array("q", (self.sizes[i] for i in keep))
+        self._seen = array("L", (self._seen[i] for i in keep))
+        self._index = dict((path, i) for i, path in enumerate(self.paths))
+
+    @property
+    def stalled_threshold(self):
+        """The number of stalled ranks at which the calculation is dead"""
+        if isinstance(self.max_stalled, float) and self.max_stalled <= 1:
+            return max(1, int(math.ceil(self.max_stalled * len(self))))
+        return max(1, int(self.max_stalled))
+
+    def check(self, time_now):
+        """Find the stalled and lagging ranks (the indices are kept in 
+        stalled and lagging). Raises CalculationRanksStalled if too many 
+        are stalled."""
+
+        self.stalled, self.lagging = [], []
+
+        # with a single file, the timeout of the assassin is the same
+        if len(self) < 2:
+            return
+
+        ages = [time_now - t for t in self.times_last_update]
+        median = sorted(ages)[len(ages) // 2]
+        lag = max(self.factor * median, self.min_lag)
+
+        for i, age in enumerate(ages):
+            if age > self.stall_timeout:
+                self.stalled.append(i)
+            elif age > lag:
+                self.lagging.append(i)
+
+        if len(self.stalled) >= self.stalled_threshold:
+            raise CalculationRanksStalled(
+                "{0} of {1} ranks have not written for more than {2:.0f} " \
+                "minutes: {3}.".format(
+                    len(self.stalled), 
+                    len(self), 
+                    self.stall_timeout / 60, 
+                    self.describe(self.stalled)
+                )
+            )
+
+    def describe(self, indices, n_max=5):
+        """The paths of (at most n_max of) the ranks with indices"""
+        names = [self.paths[i] for i in indices[:n_max]]
+        if len(indices) > n_max:
+            names.append("...")
+        return ", ".join(names)
+
+
+class Subcalculation(object):
+    """The state of a sub-calculation as seen by the SubcalculationTracker"""
+
+    __slots__ = [
+        "path", "inode", "offset", "tail", "size", "time_last_update",
+        "state"
+    ]
+
+    def __init__(self, path, time_start):
+        self.path = path
+
+        # the outfile is searched for the finish markers from offset, tail
+        # is the end of the last search (for markers cut off by it)
+        self.inode = None
+        self.offset = 0
+        self.tail = b""
+
+        self.size = 0
+        self.time_last_update = time_start
+        self.state = SubcalculationTracker.RUNNING
+
+
+class SubcalculationTracker(object):
+    """Tracks every outfile matched by the wild cards of out_file_name
+    (e.g. */aims.out of a driver that runs many calculations, each in a
+    directory of its own) as a sub-calculation of its own. A
+    sub-calculation is
+     - finished once a finish marker of the code (see OutputMatcher) was
+       found in its outfile,
+     - stalled if it has not finished and its outfile was not updated for
+       timeout,
+     - running otherwise.
+
+    At every scan the outfiles of the sub-calculations that have not
+    finished are stat'ed and the output appended since the last scan is
+    searched for the finish markers. Each outfile is handled by one of
+    n_threads threads, as on a parallel file system most of the time is
+    spent waiting for the metadata and object servers. Finished
+    sub-calculations are not looked at again.
+    """
+
+    RUNNING, FINISHED, STALLED = "running", "finished", "stalled"
+    states = [RUNNING, FINISHED, STALLED]
+
+    def __init__(self, timeout, n_expected=None, n_threads=8,
+        chunk_size=1024**2):
+        """Args:
+            timeout: time (in s) without update after which a
+                sub-calculation is stalled.
+            n_expected: the number of sub-calculations that have to finish
+                for the whole calculation to be finished (None if that is
+                only known from its process).
+            n_threads: the number of threads the outfiles are scanned by.
+            chunk_size: the outfiles are read in chunks of this many bytes.
+        """
+
+        self.timeout = timeout
+        self.n_expected = n_expected
+        self.n_threads = n_threads
+        self.chunk_size = chunk_size
+
+        # path -> Subcalculation, in the order they were found
+        self.subcalculations = OrderedDict()
+
+        self._executor = None
+
+    def __len__(self):
+        return len(self.subcalculations)
+
+    def count(self):
+        """The number of sub-calculations in each state, as dict"""
+        counts = dict((state, 0) for state in self.states)
+        for subcalculation in self.subcalculations.values():
+            counts[subcalculation.state] += 1
+        return counts
+
+    def paths(self, state):
+        return [
+            s.path for s in self.subcalculations.values() if s.state == state
+        ]
+
+    @property
+    def is_finished(self):
+        """Whether the expected number of sub-calculations has finished"""
+        return not self.n_expected is None and \
+            self.count()[self.FINISHED] >= self.n_expected
+
+    @property
+    def time_last_update(self):
+        """The most recent update of any outfile (None if there is none)"""
+        if not self.subcalculations:
+            return None
+        return max(s.time_last_update for s in self.subcalculations.values())
+
+    @staticmethod
+    def _scan_file(file_system, matcher, path, inode, offset, tail,
+        chunk_size):
+        """Stat the outfile path and search it from offset for the finish
+        markers (runs in a worker thread). Returns the stat (None if the
+        file is missing), whether a marker was found, the new offset and
+        tail."""
+
+        try:
+            stat = file_system.stat(path)
+        except FileNotFoundError:
+            return None, False, offset, tail
+
+        # file was replaced or truncated, search it from the start
+        if getattr(stat, "st_ino", None) != inode or stat.st_size < offset:
+            offset, tail = 0, b""
+
+        if stat.st_size == offset:
+            return stat, False, offset, tail
+
+        overlap = matcher.overlap
+        with file_system.open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                offset += len(chunk)
+
+                data = tail + chunk
+                if matcher.find_finish(data):
+                    return stat, True, offset, b""
+                tail = data[-overlap:] if overlap > 0 else b""
+
+        return stat, False, offset, tail
+
+    def scan(self, paths, matcher, file_system, time_now, time_start):
+        """Scan the outfiles of the sub-calculations at paths (new ones are
+        added) and update their states. Modification times before
+        time_start (the start of the calculation) count as time_start.
+        Sub-calculations that are no longer matched are dropped, unless
+        they have finished."""
+
+        subcalculations = self.subcalculations
+        for path in paths:
+            if not path in subcalculations:
+                subcalculations[path] = Subcalculation(path, time_start)
+
+        matched = set(paths)
+        for path in list(subcalculations):
+            if not path in matched and \
+                subcalculations[path].state != self.FINISHED:
+                del subcalculations[path]
+
+        pending = [
+            s for s in subcalculations.values() if s.state != self.FINISHED
+        ]
+        if not pending:
+            return
+
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self.n_threads)
+
+        results = self._executor.map(
+            lambda s: self._scan_file(
+                file_system, matcher, s.path, s.inode, s.offset, s.tail,
+                self.chunk_size
+            ),
+            pending
+        )
+
+        for subcalculation, (stat, is_finished, offset, tail) in \
+            zip(pending, results):
+
+            if not stat is None:
+                subcalculation.inode = getattr(stat, "st_ino", None)
+                subcalculation.offset = offset
+                subcalculation.tail = tail
+                subcalculation.size = stat.st_size
+                subcalculation.time_last_update = max(
+                    subcalculation.time_last_update, stat.st_mtime
+                )
+
+            if is_finished:
+                subcalculation.state = self.FINISHED
+            elif time_now - subcalculation.time_last_update > self.timeout:
+                subcalculation.state = self.STALLED
+            else:
+                subcalculation.state = self.RUNNING
+
+    def describe(self, paths, n_max=5):
+        """(At most n_max of) paths"""
+        names = paths[:n_max]
+        if len(paths) > n_max:
+            names.append("...")
+        return ", ".join(names)
+
+    def close(self):
+        if not self._executor is None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class StateSnapshot(object):
+    """Saves the state of an assassin (see SlurmAssassin.get_state) to a 
+    json file from time to time, so an assassin that is restarted (e.g. 
+    after its job was requeued) can resume where the last one stopped 
+    instead of re-reading the outfiles from the start. The file is 
+    replaced atomically, so a killed assassin never leaves a torn 
+    snapshot behind."""
+
+    version = 1
+
+    def __init__(self, path, period=60):
+        """Args:
+            path: the file the state is saved to.
+            period: minimum time (in s) between two snapshots.
+        """
+        self.path = path
+        self.period = period
+        self.time_last_save = None
+
+    def is_due(self, time_now):
+        return self.time_last_save is None or \
+            time_now - self.time_last_save >= self.period
+
+    def save(self, state, time_now):
+        state = dict(state, version=self.version, time_saved=time_now)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(self.path + ".tmp", self.path)
+        self.time_last_save = time_now
+
+    def load(self, job_id=None):
+        """The saved state (None if there is none or it is unreadable). 
+        The state is only resumed by the job that saved it (job_id, which a
+        requeued job keeps). The state of another job (e.g. an earlier one 
+        in the same folder) is removed."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if not isinstance(state, dict) or \
+            state.get("version") != self.version:
+            return None
+
+        if state.get("job_id") != job_id:
+            self.remove()
+            return None
+
+        return state
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class PollProfiler(object):
+    """Measures how long the assassin's polling cycle and each of the checks 
+    it calls take. Latencies are counted in histograms with fixed 
+    (logarithmic) buckets, so recording a call costs only two timer reads 
+    and a bisection. Optionally every n-th polling cycle is also profiled 
+    with cProfile.
+
+    The summary can be dumped to a stats file or to the log, e.g. at exit 
+    or when the assassin receives SIGUSR2 (see install_dump_handlers).
+    """
+
+    # upper bounds of the histogram buckets in s: 1 us ... 100 s, 
+    # two buckets per decade. The last bucket collects everything above.
+    bucket_bounds = [10**(exponent / 2.0) for exponent in range(-12, 5)]
+
+    def __init__(self, stats_file=None, profile_every=None):
+        """Args:
+            stats_file: file the summary is written to by dump. If None the
+                summary is logged.
+            profile_every: if given, every profile_every-th polling cycle 
+                is profiled with cProfile.
+        """
+
+        self.stats_file = stats_file
+        self.profile_every = profile_every
+
+        # name -> [bucket counts, number of calls, total time, max time]
+        self._histograms = {}
+
+        self._n_cycles = 0
+        self._cprofile = None
+        self._cprofile_stats = None
+
+    def add(self, name, latency):
+        """Record that name took latency seconds"""
+        try:
+            histogram = self._histograms[name]
+        except KeyError:
+            histogram = [[0] * (len(self.bucket_bounds) + 1), 0, 0.0, 0.0]
+            self._histograms[name] = histogram
+
+        histogram[0][bisect.bisect_left(self.bucket_bounds, latency)] += 1
+        histogram[1] += 1
+        histogram[2] += latency
+        if latency > histogram[3]:
+            histogram[3] = latency
+
+    def histogram(self, name):
+        """Returns the bucket counts of name (see bucket_bounds)"""
+        return list(self._histograms[name][0])
+
+    def count(self, name):
+        return self._histograms[name][1] if name in self._histograms else 0
+
+    def begin_cycle(self):
+        """Called at the start of each polling cycle"""
+        self._n_cycles += 1
+
+        if self.profile_every and self._n_cycles % self.profile_every == 0:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def end_cycle(self):
+        """Called at the end of each polling cycle"""
+        if not self._cprofile is None:
+            self._cprofile.disable()
+
+            import pstats
+            if self._cprofile_stats is None:
+                self._cprofile_stats = pstats.Stats(self._cprofile)
+            else:
+                self._cprofile_stats.add(self._cprofile)
+
+            self._cprofile = None
+
+    def _percentile(self, histogram, fraction):
+        """Upper bucket bound below which fraction of the calls lie"""
+        counts, n = histogram[0], histogram[1]
+        total = 0
+        for bound, count in zip(self.bucket_bounds + [float("inf")], counts):
+            total += count
+            if total >= fraction * n:
+                return bound
+        return float("inf")
+
+    def summary(self, top=15):
+        """Returns the summary of all measurements as list of lines"""
+
+        lines = [
+            "Profile of {0} polling cycles (latencies in ms, p50/p99 are " \
+                "bucket bounds):".format(self._n_cycles),
+            "{0:>24} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+                "check", "calls", "total", "mean", "p50", "p99", "max"
+            )
+        ]
+
+        for name in sorted(self._histograms):
+            histogram = self._histograms[name]
+            lines.append(
+                "{0:>24} {1:>8d} {2:>10.3f} {3:>10.3f} {4:>10.3g} {5:>10.3g} " \
+                    "{6:>10.3f}".format(
+                    name,
+                    histogram[1],
+                    histogram[2] * 1e3,
+                    histogram[2] / histogram[1] * 1e3,
+                    self._percentile(histogram, 0.5) * 1e3,
+                    self._percentile(histogram, 0.99) * 1e3,
+                    histogram[3] * 1e3
+                )
+            )
+
+        if not self._cprofile_stats is None:
+            import io
+            stream = io.StringIO()
+            self._cprofile_stats.stream = stream
+            self._cprofile_stats.sort_stats("cumulative").print_stats(top)
+            lines.append("cProfile of sampled polling cycles:")
+            lines += [l for l in stream.getvalue().splitlines() if l.strip()]
+
+        return lines
+
+    def dump(self, log=None):
+        """Write the summary to the stats file or (if there is none) pass 
+        each line to log"""
+
+        lines = self.summary()
+
+        if not self.stats_file is None:
+            with open(self.stats_file, "w") as f:
+                f.write(os.linesep.join(lines) + os.linesep)
+        elif not log is None:
+            for line in lines:
+                log(line)
+
+    def install_dump_handlers(self, log=None):
+        """Dump the summary at exit and whenever SIGUSR2 is received"""
+
+        atexit.register(self.dump, log)
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.dump(log))
+
+
+def profiled(name):
+    """Decorator for methods of the assassin: if the assassin has a 
+    profiler, the latency of every call is recorded under name."""
+
+    def decorator(method):
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+
+            profiler = self._profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.add(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+class MetricsExporter(object):
+    """Publishes the live state of an assassin in the Prometheus text 
+    format, either as textfile (for the textfile collector of the node 
+    exporter, replaced atomically on every update) or served via http on 
+    a local port or unix socket (or both).
+
+    All metrics carry the label job_id. Exported are the time since the last
+    outfile update, the duration of the last polling cycle, the size and 
+    growth rate of the outfiles, the number of iterations of the 
+    calculation, the progress of the ranks and sub-calculations, cpu time, 
+    memory and number of processes of the calculation's process tree and 
+    the assassin's current verdict.
+    """
+
+    prefix = "slurm_assassin_"
+
+    verdicts = ["running", "finished", "crashed", "timeout"]
+
+    def __init__(self, job_id, textfile=None, port=None, unix_socket=None):
+        """Args:
+            job_id: the job id all metrics are labelled with.
+            textfile: path of the textfile that is written on every update.
+            port: if given, the metrics are served on localhost:port.
+            unix_socket: if given, the metrics are served on this socket.
+        """
+
+        self.job_id = str(job_id)
+        self.textfile = textfile
+
+        self._text = ""
+
+        # for the growth rate of the outfiles
+        self._last_size = None
+
+        self._servers = []
+        if not port is None:
+            self._serve(("127.0.0.1", port), unix=False)
+        if not unix_socket is None:
+            self._serve(unix_socket, unix=True)
+
+    def _serve(self, address, unix):
+        """Serve the latest metrics via http in a background thread"""
+
+        import threading
+        import socketserver
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = exporter._text.encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        if unix:
+            if os.path.exists(address):
+                os.remove(address)
+
+            class Server(socketserver.UnixStreamServer):
+                # http.server expects a (host, port) tuple as client address
+                def get_request(self):
+                    request, _ = self.socket.accept()
+                    return request, ("local", 0)
+        else:
+            Server = HTTPServer
+
+        server = Server(address, Handler)
+        thread = threading.Thread(
+            target=server.serve_forever, 
+            kwargs={"poll_interval": 0.1}
+        )
+        thread.daemon = True
+        thread.start()
+
+        self._servers.append(server)
+
+    @property
+    def port(self):
+        """Port of the http server (None if not serving on a port)"""
+        for server in self._servers:
+            if isinstance(server.server_address, tuple):
+                return server.server_address[1]
+        return None
+
+    def _line(self, name, value, **labels):
+        labels["job_id"] = self.job_id
+        return "{0}{1}{{{2}}} {3}".format(
+            self.prefix,
+            name,
+            ",".join(
+                '{0}="{1}"'.format(k, labels[k]) for k in sorted(labels)
+            ),
+            repr(float(value))
+        )
+
+    def render(self, assassin):
+        """Returns the current metrics of assassin as text"""
+
+        now = assassin.time_now()
+        lines = []
+
+        def gauge(name, help, value, **labels):
+            lines.append("# HELP " + self.prefix + name + " " + help)
+            lines.append("# TYPE " + self.prefix + name + " gauge")
+            lines.append(self._line(name, value, **labels))
+
+        gauge(
+            "seconds_since_last_outfile_update",
+            "Time since the outfiles were last updated.",
+            now - assassin.time_last_update_out
+        )
+        gauge(
+            "timeout_seconds",
+            "Time without outfile updates after which the calculation " + \
+                "is regarded dead.",
+            assassin.timeout
+        )
+        gauge(
+            "last_poll_duration_seconds",
+            "Wall time the last polling cycle took.",
+            assassin.last_poll_duration
+        )
+
+        #--- outfiles ---
+        size = sum(assassin.outfile_sizes.values())
+        if self._last_size is None or now <= self._last_size[0]:
+            growth = 0.0
+        else:
+            growth = (size - self._last_size[1]) / (now - self._last_size[0])
+        self._last_size = (now, size)
+
+        gauge("outfile_bytes", "Total size of the outfiles.", size)
+        gauge(
+            "outfile_growth_bytes_per_second",
+            "Growth rate of the outfiles since the last update.",
+            growth
+        )
+        gauge(
+            "iterations",
+            "Iterations of the calculation seen in the main outfile.",
+            assassin.n_iterations
+        )
+
+        tracker = assassin._rank_tracker
+        if not tracker is None:
+            gauge("ranks", "Number of tracked outfiles of ranks.", len(tracker))
+            gauge(
+                "ranks_stalled", 
+                "Ranks whose outfile was not updated for the timeout.",
+                len(tracker.stalled)
+            )
+            gauge(
+                "ranks_lagging", 
+                "Ranks whose outfile lags behind the median.",
+                len(tracker.lagging)
+            )
+
+        tracker = assassin._subcalculation_tracker
+        if not tracker is None:
+            lines.append("# HELP " + self.prefix + "subcalculations " + \
+                "Number of sub-calculations by state.")
+            lines.append("# TYPE " + self.prefix + "subcalculations gauge")
+            counts = tracker.count()
+            for state in tracker.states:
+                lines.append(self._line(
+                    "subcalculations", counts[state], state=state
+                ))
+        #---
+
+        #--- process tree ---
+        sample = assassin.last_resource_sample
+        if not sample is None:
+            gauge(
+                "process_cpu_seconds",
+                "Cpu time used by the calculation's process tree.",
+                sample.cpu_time
+            )
+            gauge(
+                "process_resident_memory_bytes",
+                "Resident memory of the calculation's process tree.",
+                sample.rss
+            )
+            gauge(
+                "processes",
+                "Number of processes in the calculation's process tree.",
+                sample.n_processes
+            )
+        #---
+
+        #--- verdict ---
+        lines.append(
+            "# HELP " + self.prefix + "verdict Current verdict of the assassin."
+        )
+        lines.append("# TYPE " + self.prefix + "verdict gauge")
+        for verdict in self.verdicts:
+            lines.append(self._line(
+                "verdict", 
+                float(verdict == assassin.verdict), 
+                verdict=verdict
+            ))
+        #---
+
+        return "\n".join(lines) + "\n"
+
+    def update(self, assassin):
+        """Render the metrics of assassin and publish them"""
+
+        self._text = self.render(assassin)
+
+        if not self.textfile is None:
+            # write to a temporary file first, so the collector never reads
+            # a partially written file.
+            tmp = self.textfile + ".tmp." + str(os.getpid())
+            with open(tmp, "w") as f:
+                f.write(self._text)
+            os.replace(tmp, self.textfile)
+
+    def close(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+class StatusSegment(object):
+    """A small shared memory segment (a file in /dev/shm) in which an 
+    assassin publishes its current state, so external tools on the node can
+    check on it without touching the (parallel) file system. 
+
+    The segment has a fixed layout (see header_format and payload_format). 
+    Writer and readers synchronize via a seqlock: the writer increments the
+    sequence number before and after writing the payload, a reader retries 
+    if the sequence number was odd (write in progress) or has changed while
+    it was reading.
+    """
+
+    default_directory = "/dev/shm"
+    prefix = "slurm_assassin."
+
+    magic = b"SAST"
+    version = 1
+
+    # magic, version, total size, sequence number
+    header_format = "<4sHHQ"
+
+    # job id, pid of the assassin, phase, verdict, start time, time of
+    # this update, time of the last poll, time of the last outfile update,
+    # timeout, polling period, number of polls, number of process handle 
+    # checks, total size of the outfiles
+    payload_format = "<32siBBxxddddddQQQ"
+
+    # new phases are appended, so older readers keep their indices
+    phases = [
+        "starting", "watching", "polling", "killing", "ended", "collecting"
+    ]
+    verdicts = ["running", "finished", "crashed", "timeout"]
+
+    fields = [
+        "job_id", "pid", "phase", "verdict", "time_start", "time_updated",
+        "time_last_poll", "time_last_update_out", "timeout", 
+        "polling_period", "n_polls", "n_process_checks", "outfile_bytes"
+    ]
+
+    def __init__(self, job_id, directory=None):
+        """Creates the segment for job_id in directory (default: /dev/shm)"""
+
+        self.path = os.path.join(
+            self.default_directory if directory is None else directory,
+            self.prefix + str(job_id)
+        )
+        self.job_id = str(job_id)
+
+        self._header = struct.Struct(self.header_format)
+        self._payload = struct.Struct(self.payload_format)
+        self._size = self._header.size + self._payload.size
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, self._size)
+            self._map = mmap.mmap(fd, self._size)
+        finally:
+            os.close(fd)
+
+        self._sequence = 0
+        self._header.pack_into(
+            self._map, 0, self.magic, self.version, self._size, self._sequence
+        )
+
+    def write(self, assassin, phase):
+        """Publish the state of assassin (nothing happens once the segment
+        is closed)"""
+
+        if self._map is None:
+            return
+
+        sequence_offset = struct.calcsize("<4sHH")
+
+        # odd: write in progress
+        self._sequence += 1
+        struct.pack_into("<Q", self._map, sequence_offset, self._sequence)
+
+        self._payload.pack_into(
+            self._map, 
+            self._header.size,
+            self.job_id.encode()[:32],
+            os.getpid(),
+            self.phases.index(phase),
+            self.verdicts.index(assassin.verdict),
+            assassin.time_calculation_start,
+            assassin.time_now(),
+            assassin.time_last_poll,
+            assassin.time_last_update_out,
+            assassin.timeout,
+            assassin.polling_period_outfiles,
+            assassin.n_polls,
+            assassin.n_process_checks,
+            sum(assassin.outfile_sizes.values())
+        )
+
+        # even: consistent again
+        self._sequence += 1
+        struct.pack_into("<Q", self._map, sequence_offset, self._sequence)
+
+    def close(self, remove=True):
+        if self._map is None:
+            return
+
+        self._map.close()
+        self._map = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def install_cleanup_handlers(self):
+        """Remove the segment at exit and when SIGTERM is received (scancel 
+        sends it before killing the job step), so no stale segments are 
+        left behind in /dev/shm."""
+
+        atexit.register(self.close)
+
+        # the assassin may still publish its state while it unwinds, the 
+        # segment is closed by the assassin or at exit
+        def handle_sigterm(signum, frame):
+            raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    @classmethod
+    def read(cls, path, max_tries=100):
+        """Read the state from the segment at path. Returns a dict (see 
+        fields) or None if the segment is invalid or no consistent state 
+        could be read in max_tries attempts."""
+
+        header = struct.Struct(cls.header_format)
+        payload = struct.Struct(cls.payload_format)
+
+        try:
+            with open(path, "rb") as f:
+                segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            if len(segment) < header.size + payload.size:
+                return None
+
+            for _ in range(max_tries):
+                magic, version, size, sequence = header.unpack_from(segment, 0)
+                if magic != cls.magic or version != cls.version:
+                    return None
+                if sequence % 2 == 1:
+                    continue
+
+                values = payload.unpack_from(segment, header.size)
+
+                if header.unpack_from(segment, 0)[3] == sequence:
+                    break
+            else:
+                return None
+        finally:
+            segment.close()
+
+        state = dict(zip(cls.fields, values))
+        state["job_id"] = state["job_id"].rstrip(b"\0").decode()
+        state["phase"] = cls.phases[state["phase"]]
+        state["verdict"] = cls.verdicts[state["verdict"]]
+
+        return state
+
+    @classmethod
+    def read_all(cls, directory=None):
+        """Read all segments in directory (default: /dev/shm). Returns a list
+        of (path, state) tuples."""
+
+        directory = cls.default_directory if directory is None else directory
+        
+        states = []
+        for name in sorted(os.listdir(directory)):
+            if name.startswith(cls.prefix):
+                path = os.path.join(directory, name)
+                states.append((path, cls.read(path)))
+
+        return states
+
+class PollScheduler(object):
+    """Decides when the assassin polls its outfiles. 
+
+    Without phase and jitter the outfiles are polled at the first check of 
+    the process handle after more than a polling period has passed since 
+    the last poll. Assassins that are started at the same time (e.g. the 
+    tasks of an array job) would then all hit the metadata servers at the 
+    same moments. To spread the load, a scheduler can be staggered:
+     - phase: the first poll is brought forward by this fraction of half 
+       the polling period (see job_phase for a phase derived from the job 
+       id). It is never delayed, so a stall in the first polling period is
+       not detected later than without staggering, and the calculation 
+       has at least half a polling period to create its outfiles.
+     - jitter: every following interval is drawn uniformly from 
+       polling_period * [1 - jitter, 1 + jitter].
+    A staggered assassin wakes up exactly when a poll is due, so a stall 
+    is detected at most timeout + polling_period * (1 + jitter) after the 
+    last update.
+    """
+
+    # the golden ratio spreads consecutive array tasks evenly over the period
+    _golden_ratio = (5 ** 0.5 - 1) / 2
+
+    def __init__(self, polling_period, phase=0.0, jitter=0.0, seed=None):
+        """Args:
+            polling_period: the mean time between two polls (in s).
+            phase: fraction of half the polling period (in [0, 1)) by 
+                which the first poll is brought forward.
+            jitter: maximum relative deviation of the intervals between 
+                polls from the polling period (in [0, 1)).
+            seed: seed of the random jitter (so it is reproducible).
+        """
+
+        if not 0 <= phase < 1 or not 0 <= jitter < 1:
+            raise ValueError("Phase and jitter must be in [0, 1).")
+
+        self.polling_period = polling_period
+        self.phase = phase
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+        # the time to wait after the last poll
+        self.interval = polling_period * (1 - phase / 2.0)
+
+    @classmethod
+    def job_phase(cls, job_id, array_task_id=None):
+        """A phase in [0, 1) that is derived deterministically from the job 
+        id. The tasks of an array job (job_id is then the id of the array 
+        job) get phases that are spread evenly over the period."""
+
+        phase = zlib.crc32(str(job_id).encode()) / 2.0**32
+        if not array_task_id is None:
+            phase += int(array_task_id) * cls._golden_ratio
+        return phase % 1
+
+    @classmethod
+    def for_job(cls, 
+        polling_period, 
+        job_id, 
+        array_job_id=None, 
+        array_task_id=None, 
+        jitter=0.1
+    ):
+        """A staggered scheduler for the given job (the phase is derived
+        from the array job and task id for tasks of an array job)"""
+
+        if not array_job_id is None:
+            phase = cls.job_phase(array_job_id, array_task_id)
+        else:
+            phase = cls.job_phase(job_id)
+
+        return cls(polling_period, phase=phase, jitter=jitter, seed=job_id)
+
+    @classmethod
+    def from_environment(cls, polling_period, jitter=0.1, environ=None):
+        """A staggered scheduler for the current slurm job (unstaggered if 
+        not run in a slurm job)"""
+
+        environ = os.environ if environ is None else environ
+
+        if not "SLURM_JOB_ID" in environ:
+            return cls(polling_period)
+
+        return cls.for_job(
+            polling_period, 
+            environ["SLURM_JOB_ID"],
+            array_job_id=environ.get("SLURM_ARRAY_JOB_ID"),
+            array_task_id=environ.get("SLURM_ARRAY_TASK_ID"),
+            jitter=jitter
+        )
+
+    @property
+    def staggered(self):
+        return self.phase > 0 or self.jitter > 0
+
+    def time_until_due(self, time_now, time_last_poll):
+        """Time (in s) until the next poll is due"""
+        return time_last_poll + self.interval - time_now
+
+    def is_due(self, time_now, time_last_poll):
+        if self.staggered:
+            # polls are scheduled to the exact time, allow for rounding
+            return self.time_until_due(time_now, time_last_poll) <= 1e-6
+        else:
+            return abs(time_last_poll - time_now) > self.interval
+
+    def sleep_time(self, time_now, time_last_poll, period_process_handle):
+        """How long to sleep before the next check"""
+        if self.staggered:
+            return max(0, min(
+                period_process_handle, 
+                self.time_until_due(time_now, time_last_poll)
+            ))
+        return period_process_handle
+
+    def polled(self):
+        """To be called after every poll, draws the next interval"""
+        self.interval = self.polling_period * \
+            (1 + self._random.uniform(-self.jitter, self.jitter))
+
+
+class RequeuePolicy(object):
+    """Decides whether a dead calculation is requeued (via scontrol 
+    requeue) instead of cancelled: this is done if it left restart files 
+    (e.g. checkpoints) behind and the job was not requeued too often 
+    already. 
+
+    The number of requeues is taken from a state file (a json dict 
+    job id -> requeues) if one is given, otherwise from the environment 
+    variable SLURM_RESTART_COUNT that slurm sets in requeued jobs.
+    """
+
+    def __init__(self, 
+        restart_files, 
+        max_requeues=3, 
+        state_file=None, 
+        scontrol_command=["scontrol"]
+    ):
+        """Args:
+            restart_files: a (list of) glob pattern(s) of restart files.
+            max_requeues: how often a job may be requeued.
+            state_file: the file in which the requeues are counted.
+            scontrol_command: the command used to requeue the job.
+        """
+
+        if isinstance(restart_files, str):
+            restart_files = [restart_files]
+
+        self.restart_files = list(restart_files)
+        self.max_requeues = max_requeues
+        self.state_file = state_file
+        self.scontrol_command = list(scontrol_command)
+
+    def find_restart_files(self, file_system):
+        """All restart files that exist"""
+        return sorted(set(
+            path for pattern in self.restart_files \
+                for path in file_system.glob(pattern)
+        ))
+
+    def _read_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def requeue_count(self, job_id):
+        """How often the job was requeued so far"""
+
+        if not self.state_file is None:
+            return int(self._read_state().get(str(job_id), 0))
+
+        try:
+            return int(os.environ.get("SLURM_RESTART_COUNT", 0))
+        except ValueError:
+            return 0
+
+    def should_requeue(self, job_id, file_system):
+        return self.requeue_count(job_id) < self.max_requeues and \
+            len(self.find_restart_files(file_system)) > 0
+
+    def requeue(self, job_id):
+        """Requeue the job. Returns whether scontrol succeeded."""
+
+        result = sp.run(
+            self.scontrol_command + ["requeue", str(job_id)],
+            stdout=sp.PIPE,
+            stderr=sp.PIPE
+        )
+        if result.returncode != 0:
+            return False
+
+        if not self.state_file is None:
+            state = self._read_state()
+            state[str(job_id)] = int(state.get(str(job_id), 0)) + 1
+            with open(self.state_file + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(self.state_file + ".tmp", self.state_file)
+
+        return True
+
+
+class DiagnosticBundle(object):
+    """Collects the evidence of a dead calculation right before its job is 
+    cancelled (afterwards it is gone) into one compressed tar archive:
+     - summary.txt: verdict, reason, outfiles and what the processes of 
+       the calculation are waiting for (this text is also mailed),
+     - proc/<pid>/: stat, status, wchan and the open file descriptors of 
+       every process in the calculation's process tree,
+     - tails/: the last tail_size bytes of every outfile and the error file,
+     - resources.json: the resource samples taken while lurking.
+
+    Every item is collected in a thread of its own, as reading /proc or an
+    outfile on a hanging file system may block for good. Whatever is not
+    collected within 70% of the deadline is left out (the rest is kept for 
+    writing the archive), so the kill is never delayed by more than 
+    deadline seconds. Items are 
+    added in the above order until max_size bytes (uncompressed) are 
+    reached.
+    """
+
+    def __init__(self, 
+        path, 
+        deadline=5, 
+        max_size=16 * 1024**2, 
+        tail_size=64 * 1024,
+        max_processes=64
+    ):
+        """Args:
+            path: the archive (.tar.gz) the bundle is written to.
+            deadline: time (in s) after which the collection is given up.
+            max_size: maximum size of the bundle (uncompressed, in bytes).
+            tail_size: number of bytes collected from the end of each file.
+            max_processes: maximum number of processes collected.
+        """
+        self.path = path
+        self.deadline = deadline
+        self.max_size = max_size
+        self.tail_size = tail_size
+        self.max_processes = max_processes
+
+    @staticmethod
+    def default_path(outfile, job_id):
+        """The bundle is kept next to the main outfile"""
+        return os.path.join(
+            os.path.dirname(os.path.abspath(outfile)),
+            "slurm_assassin_diagnostics_{0}.tar.gz".format(job_id)
+        )
+
+    @staticmethod
+    def _run(tasks, time_end):
+        """Run the functions of tasks (dict name -> function) concurrently.
+        Returns a dict name -> result of the ones done before time_end (the 
+        error message if they failed)."""
+
+        import threading
+
+        results = {}
+        lock = threading.Lock()
+
+        def work(name, function):
+            try:
+                result = function()
+            except Exception as ex:
+                result = ("Could not be collected: " + str(ex)).encode()
+            with lock:
+                results[name] = result
+
+        threads = []
+        for name, function in tasks.items():
+            thread = threading.Thread(target=work, args=(name, function))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(max(0, time_end - time.monotonic()))
+
+        with lock:
+            return dict(results)
+
+    def _tail(self, file_system, path):
+        with file_system.open(path, "rb") as f:
+            f.seek(0, 2)
+            f.seek(max(0, f.tell() - self.tail_size))
+            return f.read()
+
+    @staticmethod
+    def _process(pid):
+        """The files of /proc/<pid> that show what the process is doing"""
+
+        base = os.path.join(ResourceSampler.proc_path, str(pid))
+
+        files = {}
+        for name in ["stat", "status", "wchan"]:
+            with open(os.path.join(base, name), "rb") as f:
+                files[name] = f.read()
+
+        fds = []
+        for fd in sorted(os.listdir(os.path.join(base, "fd")), key=int):
+            try:
+                fds.append(fd + " -> " + \
+                    os.readlink(os.path.join(base, "fd", fd)))
+            except OSError:
+                pass
+        files["fds"] = ("\n".join(fds) + "\n").encode()
+
+        return files
+
+    @staticmethod
+    def _field(status, key):
+        """A field of /proc/<pid>/status"""
+        for line in status.decode(errors="replace").splitlines():
+            if line.startswith(key + ":"):
+                return line.split(":", 1)[1].strip()
+        return "?"
+
+    def collect(self, assassin, reason=None):
+        """Collect the bundle of the calculation watched by assassin and 
+        write it. Returns the summary."""
+
+        # leave some of the time for writing the archive
+        time_end = time.monotonic() + self.deadline
+        time_collected = time_end - 0.3 * self.deadline
+        file_system = assassin._file_system
+
+        #--- files and process tree ---
+        try:
+            outfiles = list(assassin.out_file_name)
+        except Exception:
+            outfiles = []
+        tailed = outfiles + [assassin.err_file_name] \
+            if not assassin.err_file_name is None else outfiles
+
+        tasks = OrderedDict()
+        for path in tailed:
+            tasks["tails/" + path.lstrip("/")] = \
+                lambda path=path: self._tail(file_system, path)
+
+        tasks["resources.json"] = lambda: json.dumps([
+            dict(time=t, **sample._asdict()) \
+                for t, sample in assassin.resource_history
+        ], indent=1).encode()
+
+        pid = getattr(assassin._calculation_process, "pid", None)
+        if not pid is None:
+            tasks["pids"] = lambda: sorted(
+                ResourceSampler().process_tree(pid)
+            )[:self.max_processes]
+
+        results = self._run(tasks, time_collected)
+        #---
+
+        #--- what the processes are doing ---
+        pids = results.pop("pids", [])
+        if not isinstance(pids, list):
+            pids = []
+        processes = self._run(
+            OrderedDict(
+                (p, lambda p=p: self._process(p)) for p in pids
+            ), 
+            time_collected
+        )
+        #---
+
+        #--- members in order of importance, up to max_size ---
+        members, left_out = [], []
+        for p in pids:
+            if isinstance(processes.get(p), dict):
+                for name, data in sorted(processes[p].items()):
+                    members.append(("proc/{0}/{1}".format(p, name), data))
+            else:
+                left_out.append("proc/{0}".format(p))
+
+        for name in tasks:
+            if name in results:
+                members.append((name, results[name]))
+            elif name != "pids":
+                left_out.append(name)
+
+        budget = self.max_size - 64 * 1024 # for the summary
+        kept = []
+        for name, data in members:
+            if len(data) > budget:
+                if budget <= 0 or not name.startswith("tails/"):
+                    left_out.append(name)
+                    continue
+                data = data[-budget:]
+            budget -= len(data)
+            kept.append((name, data))
+        #---
+
+        #--- summary ---
+        lines = [
+            "Diagnostics of job {0} ({1}), collected {2}".format(
+                assassin.get_job_id(), 
+                assassin.get_job_name(),
+                datetime.now().strftime("%Y-%m-%d, %H:%M:%S")
+            ),
+            "Verdict: " + str(assassin.verdict)
+        ]
+        if not reason is None:
+            lines.append("Reason: " + str(reason))
+        lines.append("Last outfile update: {0:.1f} minutes ago".format(
+            (assassin.time_now() - assassin.time_last_update_out) / 60
+        ))
+        for path in outfiles:
+            if path in assassin.outfile_sizes:
+                lines.append("Outfile {0}: {1} bytes".format(
+                    path, assassin.outfile_sizes[path]
+                ))
+        if assassin.n_iterations:
+            lines.append("Iterations seen: {0}".format(assassin.n_iterations))
+
+        if pids:
+            lines.append("Processes (pid, state, waiting in, name):")
+        for p in pids:
+            if isinstance(processes.get(p), dict):
+                lines.append("  {0} {1} {2} {3}".format(
+                    p,
+                    self._field(processes[p]["status"], "State"),
+                    processes[p]["wchan"].decode(errors="replace") or "-",
+                    self._field(processes[p]["status"], "Name")
+                ))
+
+        tail = results.get("tails/" + outfiles[0].lstrip("/")) \
+            if outfiles else None
+        if isinstance(tail, bytes):
+            lines.append("Last lines of " + outfiles[0] + ":")
+            lines += ["  " + l for l in \
+                tail.decode(errors="replace").splitlines()[-10:]]
+
+        if left_out:
+            lines.append("Left out (deadline or size): " + ", ".join(
+                str(n) for n in left_out
+            ))
+        #---
+
+        #--- write the archive ---
+        summary = "\n".join(lines) + "\n"
+        kept.insert(0, ("summary.txt", summary.encode()))
+
+        written = self._run(
+            {"write": lambda: self._write(kept)}, time_end
+        ).get("write", b"The deadline has passed.")
+        if written is True:
+            summary += "Full bundle: " + self.path + "\n"
+        else:
+            summary += "The bundle could not be written to " + self.path + \
+                " (" + written.decode(errors="replace") + ")\n"
+        #---
+
+        return summary
+
+    def _write(self, members):
+        """Write the members (list of (name, bytes)) as tar.gz"""
+
+        import io
+        import tarfile
+
+        prefix = os.path.basename(self.path).split(".")[0]
+
+        path_tmp = self.path + ".tmp"
+        with tarfile.open(path_tmp, "w:gz") as tar:
+            for name, data in members:
+                info = tarfile.TarInfo(prefix + "/" + name.lstrip("/"))
+                info.size = len(data)
+                info.mtime = time.time()
+                tar.addfile(info, io.BytesIO(data))
+        os.replace(path_tmp, self.path)
+
+        return True
+
+
+class OutputPump(object):
+    """Copies what the calculation writes to a pipe (its stdout or stderr) 
+    to a file in a background thread, and keeps the copied bytes for the 
+    checks of the assassin (see SlurmAssassin's capture_output), so the 
+    outfile never has to be stat'ed or read again.
+
+    The pump reads up to buffer_size bytes at a time and writes them right
+    away, so a fast writer gets few large writes. The
+    bytes are only kept for the checks up to max_pending bytes; if the 
+    checks fall behind, the oldest are dropped (and counted in n_skipped),
+    the calculation is never slowed down.
+    """
+
+    buffer_size = 1024**2
+
+    # the size the pipe is enlarged to (Linux only)
+    pipe_size = 1024**2
+
+    # the checks search what is pending while holding the interpreter lock,
+    # so it is kept small (a check takes some ms), otherwise the pump could
+    # not empty the pipe in time for a writer at several 100 MB/s
+    max_pending = 4 * 1024**2
+
+    F_SETPIPE_SZ = 1031
+
+    def __init__(self, pipe, path, time_now=time.time):
+        """Args:
+            pipe: the (readable) pipe, e.g. Popen.stdout.
+            path: the file the output is appended to.
+            time_now: function that returns the current time.
+        """
+
+        import threading
+
+        self.path = path
+        self._pipe = pipe
+        self._time_now = time_now
+
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._n_pending = 0
+        self._gap = False
+
+        self.n_bytes = 0
+        self.n_skipped = 0
+        self.time_last_data = time_now()
+        self.error = None
+
+        # the file is created right away, like by a shell redirection
+        self._file = open(path, "ab", buffering=0)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+
+        fd = self._pipe.fileno()
+        try:
+            fcntl.fcntl(fd, self.F_SETPIPE_SZ, self.pipe_size)
+        except (OSError, ValueError):
+            pass
+
+        try:
+            with self._file:
+                while True:
+                    # a read returns everything that is in the pipe (up to
+                    # buffer_size), so a fast writer gets few large writes
+                    data = os.read(fd, self.buffer_size)
+                    if not data:
+                        break
+                    self._file.write(data)
+                    self._keep(data)
+
+        except Exception as ex:
+            self.error = ex
+
+    def _keep(self, data):
+        """Keep data for the checks"""
+        with self._lock:
+            self._pending.append(data)
+            self._n_pending += len(data)
+            self.n_bytes += len(data)
+            self.time_last_data = self._time_now()
+
+            # drop the oldest bytes, the newest are the most interesting
+            while self._n_pending > self.max_pending:
+                excess = self._n_pending - self.max_pending
+                oldest = self._pending[0]
+                if len(oldest) <= excess:
+                    self._pending.popleft()
+                    dropped = len(oldest)
+                else:
+                    self._pending[0] = oldest[excess:]
+                    dropped = excess
+                self._n_pending -= dropped
+                self.n_skipped += dropped
+                self._gap = True
+
+    def take(self):
+        """Returns the bytes that arrived since the last call and whether 
+        some bytes before them were dropped"""
+        with self._lock:
+            data = b"".join(self._pending)
+            gap = self._gap
+            self._pending.clear()
+            self._n_pending = 0
+            self._gap = False
+        return data, gap
+
+    @property
+    def finished(self):
+        """Whether the pipe was closed and everything is written"""
+        return not self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """Wait until everything is written (at most timeout seconds)"""
+        self._thread.join(timeout)
+        return self.finished
+
+
+#--- code profiles ---
+# The conventions of the codes that are run with the assassin: how they are
+# started, where they write and what they write when they finish, crash or
+# make progress.
+
+class CodeProfile(object):
+    """The outfiles and markers of a simulation code"""
+
+    def __init__(self, 
+        name, 
+        executables, 
+        out_files, 
+        err_file=None,
+        finish_markers=(), 
+        crash_signatures=(), 
+        iteration_markers=(),
+        stdout_is_outfile=True
+    ):
+        """Args:
+            name: name of the code, as used for --code-profile.
+            executables: beginnings of the names of the code's executables
+                (e.g. 'vasp' for vasp_std), used to detect the code from 
+                the command.
+            out_files: list of the default outfiles (main outfile first).
+            err_file: the default error file.
+            finish_markers: strings of which one appears in the main 
+                outfile when the calculation has finished properly.
+            crash_signatures: regular expressions of messages in the main 
+                outfile that mean the calculation has crashed.
+            iteration_markers: regular expressions of messages that are 
+                written once per iteration (e.g. scf cycle), to count the
+                progress of the calculation.
+            stdout_is_outfile: whether the main outfile is the stdout of 
+                the code (redirected by the job script). If not, the code 
+                writes it itself and the output can not be captured.
+
+        The expressions should start with a literal character (so the 
+        combined matcher can skip to candidates quickly) and not match 
+        more than OutputMatcher.max_match_length bytes.
+        """
+
+        self.name = name
+        self.executables = list(executables)
+        self.out_files = list(out_files)
+        self.err_file = err_file
+        self.finish_markers = list(finish_markers)
+        self.crash_signatures = list(crash_signatures)
+        self.iteration_markers = list(iteration_markers)
+        self.stdout_is_outfile = stdout_is_outfile
+
+    def matches(self, command):
+        """Whether the command (list of strings) runs this code"""
+        for word in command:
+            executable = os.path.basename(word).lower()
+            if any(executable.startswith(e) for e in self.executables):
+                return True
+        return False
+
+
+code_profiles = OrderedDict()
+
+def register_code_profile(profile):
+    """Make a CodeProfile available by its name (and for detection)"""
+    code_profiles[profile.name] = profile
+    return profile
+
+def detect_code_profile(command):
+    """The registered profile of the code run by command (None if the code
+    is not known)"""
+    for profile in code_profiles.values():
+        if profile.matches(command):
+            return profile
+    return None
+
+# messages of the fortran runtime and mpi, the same for all codes
+common_crash_signatures = [
+    r"forrtl: severe",
+    r"MPI_ABORT was invoked"
+]
+
+register_code_profile(CodeProfile(
+    "aims",
+    executables=["aims"],
+    out_files=["aims.out"],
+    err_file="aims.err",
+    finish_markers=["Have a nice day"],
+    crash_signatures=common_crash_signatures,
+    iteration_markers=[r"Begin self-consistency iteration #"]
+))
+
+register_code_profile(CodeProfile(
+    "vasp",
+    executables=["vasp"],
+    out_files=["OUTCAR", "OSZICAR"],
+    err_file="vasp.err",
+    finish_markers=[
+        "General timing and accounting informations for this job"
+    ],
+    crash_signatures=common_crash_signatures + [
+        r"VERY BAD NEWS! internal error",
+        r"ZBRENT: fatal error"
+    ],
+    iteration_markers=[r"Iteration +\d+\( *\d+\)"],
+    stdout_is_outfile=False
+))
+
+register_code_profile(CodeProfile(
+    "cp2k",
+    executables=["cp2k"],
+    out_files=["cp2k.out"],
+    err_file="cp2k.err",
+    finish_markers=["PROGRAM ENDED AT"],
+    crash_signatures=common_crash_signatures + [r"\[ABORT\]"],
+    iteration_markers=[r"\*\*\* SCF run converged", r"OPTIMIZATION STEP:"]
+))
+
+register_code_profile(CodeProfile(
+    "qe",
+    executables=["pw.x", "ph.x", "cp.x", "neb.x", "pp.x"],
+    out_files=["espresso.out"],
+    err_file="espresso.err",
+    finish_markers=["JOB DONE."],
+    crash_signatures=common_crash_signatures + [r"Error in routine"],
+    iteration_markers=[r"iteration # *\d+"]
+))
+
+register_code_profile(CodeProfile(
+    "orca",
+    executables=["orca"],
+    out_files=["orca.out"],
+    err_file="orca.err",
+    finish_markers=["****ORCA TERMINATED NORMALLY****"],
+    crash_signatures=common_crash_signatures + [
+        r"ORCA finished by error termination"
+    ],
+    iteration_markers=[r"GEOMETRY OPTIMIZATION CYCLE"]
+))
+
+
+class OutputMatcher(object):
+    """Finds the finish markers, crash signatures and iteration markers of 
+    a code in its output. All of them are compiled into a single regular 
+    expression, so new output is searched in one pass however many 
+    markers there are. Only the few candidate matches are then classified.
+    """
+
+    FINISH, CRASH, ITERATION = "finish", "crash", "iteration"
+
+    # matches are assumed to be at most this long (in bytes), output is 
+    # searched with an overlap of this length to the previous search
+    max_match_length = 64
+
+    def __init__(self, finish_markers, crash_signatures=(), iteration_markers=()):
+        """Args:
+            finish_markers: list of strings (matched literally).
+            crash_signatures, iteration_markers: lists of regular 
+                expressions.
+        """
+
+        self.finish_markers = list(finish_markers)
+
+        expressions = [(self.FINISH, re.escape(m)) for m in finish_markers]
+        expressions += [(self.CRASH, e) for e in crash_signatures]
+        expressions += [(self.ITERATION, e) for e in iteration_markers]
+
+        self._patterns = [
+            (kind, re.compile(e.encode())) for kind, e in expressions
+        ]
+        self._combined = re.compile(
+            b"|".join(b"(?:" + e.encode() + b")" for _, e in expressions)
+        )
+
+        # to look for the end only (no need to classify)
+        self._finish = re.compile(b"|".join(
+            re.escape(m).encode() for m in finish_markers
+        ))
+
+        self.overlap = max(
+            [len(m.encode()) for m in finish_markers] + \
+                ([self.max_match_length] if len(expressions) > \
+                    len(finish_markers) else [])
+        ) - 1
+
+    @classmethod
+    def for_profile(cls, profile, end_of_calculation_string=None):
+        """The matcher for a CodeProfile. If end_of_calculation_string is 
+        given, it is used as (additional) finish marker."""
+        
+        finish_markers = list(profile.finish_markers)
+        if not end_of_calculation_string is None:
+            if end_of_calculation_string in finish_markers:
+                finish_markers.remove(end_of_calculation_string)
+            finish_markers.insert(0, end_of_calculation_string)
+
+        return cls(
+            finish_markers, 
+            profile.crash_signatures, 
+            profile.iteration_markers
+        )
+
+    def finditer(self, data, start=0, end=None):
+        """Yields (kind, match) for all markers in data[start:end]. data 
+        may be bytes or any other buffer (e.g. an mmap)."""
+
+        end = len(data) if end is None else end
+        for candidate in self._combined.finditer(data, start, end):
+            for kind, pattern in self._patterns:
+                match = pattern.match(data, candidate.start(), end)
+                if not match is None:
+                    yield kind, match
+                    break
+
+    def find_finish(self, data, start=0, end=None):
+        """Whether there is a finish marker in data[start:end]"""
+        end = len(data) if end is None else end
+        return not self._finish.search(data, start, end) is None
+#---
+
+
+class EMailHandler(object):
+    """This class serves as an interface from the assassin to mailing.
+    
+    Attributes:
+     - sender_address: the addres that will be listed as sender for mails sent.
+     - recipient_address: the mail address the mail should be sent to.
+     - subject_prefix: a string that is added at the front of the subject line
+       to help the receiver to identify the purpose of the mail.
+    """
+
+    _default_logger = Logger
+
+    def __init__(self, 
+        sender_address, 
+        recipient_address,
+        subject_prefix=None,
+        logger=None
+    ):
+
+        self.sender_address = sender_address
+        self.recipient_address = recipient_address
+        self.subject_prefix = "" if subject_prefix is None else subject_prefix
+
+        # if no logger is specified use the default
+        self._logger = self._default_logger if logger is None else logger
+            
+    def _log(self, msg, level=0):
+        msg = "[Mailer] " + msg
+        self._logger.log(msg=msg, level=level)
+
+    def build_message(self, subject, message):
+        """Returns the mail with the given subject and text"""
+        from email.message import EmailMessage
+
+        msg = EmailMessage()
+        msg.set_content(message)
+        msg['From'] = self.sender_address
+        msg['To'] = self.recipient_address
+        msg['Subject'] = self.subject_prefix + subject
+        return msg
+
+    def send_email(self, subject, message):
+        """Send an email notification to user."""
+        msg = self.build_message(subject, message)
+
+        self._log("Sending mail to " + self.recipient_address + ": " + subject)
+
+        try:       
+            import smtplib
+            s = smtplib.SMTP('localhost')
+            s.send_message(msg)
+            s.quit()
+
+        except ConnectionRefusedError as ex:
+            self._log("Could not set up connection to localhost! " + str(ex), 3)
+
+        except Exception as ex:
+            self._log("Un unexpected error occured! " + str(ex), 3)
+    
+
+class SlurmAssassin(object):
+
+    _logger = Logger
+    _default_email_handler = EMailHandler
+    _default_clock = Clock
+    _default_file_system = FileSystem
+
+    # used to spawn the calculation process (same signature as Popen)
+    _process_factory = sp.Popen
+
+    # used to cancel the job (the job id is appended)
+    _scancel_command = ["scancel"]
+
+    def __init__(self, 
+        timeout=15,
+        polling_period=5,
+        out_file_name="aims.out",
+        err_file_name="aims.err",
+        email=None,
+        clock=None,
+        file_system=None,
+        trace_file=None,
+        shadow_file=None,
+        profiler=None,
+        metrics_exporter=None,
+        status_segment=None,
+        poll_scheduler=None,
+        kill_coordinator=None,
+        requeue_policy=None,
+        state_file=None,
+        output_guard=None,
+        repetition_detector=None,
+        rank_tracker=None,
+        subcalculation_tracker=None,
+        detectors=None,
+        code_profile=None,
+        diagnostic_bundle=None,
+        capture_output=False,
+        event_log=None
+    ):
+        """Args:
+            timeout: time after which a non-responsive calculation is assumed 
+                to be dead (in minutes!).
+            polling_period: period in which sanity of calculation is checked
+                (also in minutes).
+            out_file_name: name of file to which the calculation must keep
+                writing to be regarded as sane. If "Have a nice day" apears
+                in this file, the calculation is assumed to have finished.
+                The phrase that is checked for can be altered in the 
+                attribute end_of_calculation_string
+            err_file_name: Optionall an error file can be given. This 
+                file will be periodically checked for vsc error messages. 
+                If critical messages are found, the calculation is aborted 
+                (even is time out is not reached yet).
+            email: The email address, that potential notifications (e.g. if
+                a calculation crashes) shall be sent. E.g. 'name@dummy.lol'.
+                Mail will have the prefix '[Slurm-Assassin]' and the sender
+                address noreply@assassin.vsc.info.
+            clock: The clock used for time measurements and waiting. If 
+                None, an instance of _default_clock (wall time) is used.
+            file_system: The interface used to access the outfiles. If None, 
+                an instance of _default_file_system (the real file system)
+                is used.
+            trace_file: If given, every observation of the assassin is 
+                recorded to this file (see TraceRecorder).
+            shadow_file: If given, the assassin runs in shadow mode: kills 
+                and terminations are only recorded (see ShadowLedger), a 
+                summary is written to this file at the end of the job.
+            profiler: A PollProfiler that records the latencies of the 
+                polling cycle and its checks (None to disable profiling).
+            metrics_exporter: A MetricsExporter that publishes the state of
+                the assassin after every polling cycle.
+            status_segment: A StatusSegment in which the assassin publishes
+                its state (phase, counters, ...) for tools on the node.
+            poll_scheduler: The PollScheduler that decides when the 
+                outfiles are polled. If None, they are polled every polling
+                period (without phase or jitter).
+            kill_coordinator: A KillCoordinator (see assassin_kills.py) 
+                that batches the kill with those of other assassins. If 
+                None, the job is cancelled right away by _scancel_command.
+            requeue_policy: A RequeuePolicy. If given, a timed out or 
+                crashed calculation that left restart files behind is 
+                requeued instead of cancelled.
+            state_file: If given, the state of the assassin is saved to 
+                this file from time to time (see StateSnapshot) and 
+                resumed from it if it exists.
+            output_guard: An OutputGrowthGuard that is checked at every 
+                poll (None to not watch the growth of the outfiles).
+            repetition_detector: A RepetitionDetector that is fed with the
+                output appended to the main outfile and checked at every 
+                poll (None to not look for repeating output).
+            rank_tracker: A RankProgressTracker that is updated with every
+                outfile at every poll (None to only watch the most recent 
+                update of all outfiles).
+            subcalculation_tracker: A SubcalculationTracker. If given, 
+                every outfile matched by wild cards is a sub-calculation of
+                its own, that is searched for the finish markers. The 
+                timeout only applies to the sub-calculations that have not
+                finished and the main outfile is not searched. Can not be 
+                combined with a rank_tracker.
+            detectors: A list of additional Detectors (see 
+                assassin_detectors.py), that run after the checks of the 
+                process handle and the outfiles.
+            code_profile: The CodeProfile (or its name) of the code that is
+                run, its markers are looked for in the main outfile. If
+                None, the profile of aims is used. The outfile names are 
+                not taken from the profile (see main).
+            diagnostic_bundle: A DiagnosticBundle that is collected before
+                a dead calculation is killed (None to not collect any).
+            capture_output: If True, the stdout of the calculation is piped
+                through the assassin into the main outfile (and its stderr
+                into the error file, if there is one), see OutputPump. The
+                output is checked as it arrives, the captured files are 
+                not stat'ed or read.
+            event_log: An EventLog the events of the assassin (start, 
+                polls, verdicts, kills, ...) are written to, besides the 
+                messages in the log file.
+        """
+
+        # finished sub-calculations would count as stalled ranks
+        if not rank_tracker is None and not subcalculation_tracker is None:
+            raise ValueError(
+                "A rank tracker can not be combined with a " + \
+                    "sub-calculation tracker."
+            )
+
+        self._profiler = profiler
+        self._kill_coordinator = kill_coordinator
+        self._requeue_policy = requeue_policy
+        self._output_guard = output_guard
+        self._repetition_detector = repetition_detector
+        self._rank_tracker = rank_tracker
+        self._subcalculation_tracker = subcalculation_tracker
+        self._metrics_exporter = metrics_exporter
+        self._status_segment = status_segment
+        self._diagnostic_bundle = diagnostic_bundle
+        self._event_log = event_log
+
+        # path -> OutputPump of the captured outfiles
+        self.capture_output = capture_output
+        self._pumps = {}
+
+        # the end of the captured output, for markers that were cut off
+        self._captured_tail = b""
+
+        #--- set up interfaces to time and file system ---
+        self._clock = self._default_clock() if clock is None else clock
+        self._file_system = self._default_file_system() \
+            if file_system is None else file_system
+        #---
+
+        # store timeout and polling period in seconds 
+        self.timeout = timeout * 60
+
+        # period in which outfiles are checked in seconds
+        self.polling_period_outfiles = polling_period * 60
+
+        # period in which calculation process is checked in seconds
+        self.polling_period_process_handle = min([
+            30, 
+            self.polling_period_outfiles / 10
+        ])
+
+        if poll_scheduler is None:
+            poll_scheduler = PollScheduler(self.polling_period_outfiles)
+        self._poll_scheduler = poll_scheduler
+
+        #--- note names of out and error file ---
+        self.out_file_name = out_file_name
+        self.err_file_name = err_file_name
+        #---
+
+        # mail address to which notifications should be sent
+        if not email is None:
+            self._email_handler = self._default_email_handler(
+                sender_address="noreply@assassin.vsc.info",
+                recipient_address=email,
+                subject_prefix="[Slurm-Assassin] "
+            )
+        else:
+            self._email_handler = None
+
+        # start time of job
+        self.time_calculation_start = self.time_now()
+
+        # the time the output files were last updated
+        self.time_last_update_out = self.time_calculation_start
+        self.time_last_update_err = self.time_calculation_start
+
+        # initialize handle for aims
+        self._calculation_process = None
+
+        #--- markers in the main outfile ---
+        if code_profile is None:
+            code_profile = "aims"
+        if not isinstance(code_profile, CodeProfile):
+            code_profile = code_profiles[code_profile]
+        self.code_profile = code_profile
+
+        # if this string apears in out file the calculation must be finished
+        self.end_of_calculation_string = code_profile.finish_markers[0]
+        self._output_matcher = None
+
+        # first line with a crash signature found in the main outfile
+        self.crash_signature = None
+
+        self.n_iterations = 0
+        self.time_last_iteration = None
+        #---
+
+        # samples cpu/memory usage of the calculation (created on demand)
+        self._resource_sampler = None
+        self.last_resource_sample = None
+
+        # (time, sample) of the last samples, for the diagnostics
+        self.resource_history = deque(maxlen=720)
+
+        # summary of the DiagnosticBundle (once it was collected)
+        self.diagnostic_summary = None
+
+        #--- state of the calculation as seen at the last poll ---
+        # running, finished, crashed or timeout
+        self.verdict = "running"
+
+        # outfile name -> size in bytes
+        self.outfile_sizes = {}
+
+        # outfile name -> (inode, offset up to which it was searched for the
+        # end of calculation string)
+        self.scan_offsets = {}
+        self.scan_chunk_size = 1024**2
+
+        # if more than a chunk is left to search (e.g. at the first poll of
+        # an existing outfile), the outfile is mapped and searched 
+        # backwards from its end, up to this many bytes.
+        self.backward_search_window = 64 * 1024**2
+
+        self.n_resumes = 0
+
+        self.last_poll_duration = 0.0
+
+        self.time_last_poll = self.time_calculation_start
+        self.n_polls = 0
+        self.n_process_checks = 0
+        #---
+
+        #--- set up recording of observations ---
+        if not trace_file is None:
+            self._trace_recorder = TraceRecorder(
+                trace_file,
+                header={
+                    "job_id": os.environ.get("SLURM_JOB_ID"),
+                    "job_name": self.get_job_name(),
+                    "cores": self.get_number_of_cores(),
+                    "time_start": self.time_calculation_start,
+                    "timeout": self.timeout,
+                    "polling_period": self.polling_period_outfiles,
+                    "out_file_name": self._out_file_name,
+                    "end_of_calculation_string": \
+                        self.end_of_calculation_string
+                }
+            )
+        else:
+            self._trace_recorder = None
+        #---
+
+        # in shadow mode decisions are recorded instead of carried out
+        if not shadow_file is None:
+            self._shadow_ledger = ShadowLedger(shadow_file)
+        else:
+            self._shadow_ledger = None
+
+        # the checks run while lurking, process handle and outfiles first
+        from assassin_detectors import DetectorScheduler
+        from assassin_detectors import ProcessHandleDetector, OutfileDetector
+
+        self._detector_scheduler = DetectorScheduler(
+            [ProcessHandleDetector(), OutfileDetector()] + list(detectors or []),
+            tick=self.polling_period_process_handle
+        )
+        self._detector_scheduler.reset(self.time_calculation_start)
+
+        # resume the state of a previous assassin of the calculation
+        if not state_file is None:
+            self._state_snapshot = StateSnapshot(state_file)
+            state = self._state_snapshot.load(
+                job_id=os.environ.get("SLURM_JOB_ID")
+            )
+            if not state is None:
+                self.set_state(state)
+        else:
+            self._state_snapshot = None
+
+    @property
+    def out_file_name(self):
+
+        # if wild cards are specified, we must dynamically generate the list
+        if self._wild_cards_in_out_files:
+            return self._glob_out_files()
+        else:
+            return self._out_file_name
+
+    @profiled("glob")
+    def _glob_out_files(self):
+        return reduce(
+            lambda x,y: x + self._file_system.glob(y), 
+            self._out_file_name, 
+            []
+        )
+
+    @out_file_name.setter
+    def out_file_name(self, value):
+
+        # check if a list of files is given.    
+        if isinstance(value, list):
+            self._out_file_name = value
+
+            # if wild cards are specified, we must dynamically generate the list
+            self._wild_cards_in_out_files = any(("*" in f) for f in value)
+                
+        else:
+            self._out_file_name = [value]
+            self._wild_cards_in_out_files = "*" in value
+
+    def time_now(self):
+        """Current time in s (as given by the assassin's clock)"""
+        return self._clock.time_now()
+
+    def get_job_id(self):
+        """Get the id of current slurm job as string"""
+        try:    
+            return os.environ["SLURM_JOB_ID"]
+        except Exception as ex:
+            self.send_email_notification_assassin_error(ex)
+            raise ex
+
+    def get_array_job(self):
+        """Get the array job id and task id of the current slurm job as 
+        strings (None, None if it is not part of a job array)"""
+        return (
+            os.environ.get("SLURM_ARRAY_JOB_ID"), 
+            os.environ.get("SLURM_ARRAY_TASK_ID")
+        )
+
+    def get_kill_target(self):
+        """The job id to pass to scancel, array_job_task for tasks of an 
+        array job (so kills of many tasks can be merged)"""
+        array_job_id, array_task_id = self.get_array_job()
+        if array_job_id is None or array_task_id is None:
+            return str(self.get_job_id())
+        return str(array_job_id) + "_" + str(array_task_id)
+
+    @staticmethod
+    def get_job_name():
+        """Get the jobname of current slurm job if available"""
+        try:
+            return os.environ["SLURM_JOB_NAME"]
+        except KeyError:
+            return "Unknown"
+
+    @staticmethod
+    def get_number_of_cores():
+        """Get the number of cores allocated to the current slurm job (1 if 
+        unknown)"""
+        try:
+            return int(os.environ.get("SLURM_CPUS_ON_NODE", 1)) * \
+                int(os.environ.get("SLURM_NNODES", 1))
+        except ValueError:
+            return 1
+
+    @profiled("time_last_modified")
+    def time_last_modified(self, file):
+        """Gets the time of last modification (in seconds since ??)"""
+
+        # captured output arrives through the pipe, no need to ask the 
+        # file system
+        if file in self._pumps:
+            pump = self._pumps[file]
+            self.outfile_sizes[file] = pump.n_bytes
+
+            if not self._trace_recorder is None:
+                self._trace_recorder.record_outfile(
+                    self.time_now(), file, pump.time_last_data, pump.n_bytes
+                )
+
+            return pump.time_last_data
+
+        try: 
+            stat = self._file_system.stat(file)
+            self.outfile_sizes[file] = stat.st_size
+
+            if not self._trace_recorder is None:
+                self._trace_recorder.record_outfile(
+                    self.time_now(), file, stat.st_mtime, stat.st_size
+                )
+
+            return stat.st_mtime
+
+        except FileNotFoundError:
+
+            self.outfile_sizes.pop(file, None)
+
+            if not self._trace_recorder is None:
+                self._trace_recorder.record_outfile(self.time_now(), file, 0, -1)
+            
+            # if the missing file was the main file, we have a problem!
+            if file == self.out_file_name[0]:
+                msg = "Main outfile " + file + " not found!"
+                self.log(msg, 3)
+                raise CalculationCrashMainOutfileMissing(msg)
+
+            else:
+                self.log("Outfile " + file + " not found!", 2)
+                return 0
+
+    def start_calculation_process(self, 
+        command=["mpirun", "aims.x"], 
+        *args, 
+        **kwargs
+    ):
+        """Run a subprocess executing the command to be governed by the 
+        assassin. This will probably be the aims calculation."""
+        
+        self.log("Running command: " + " ".join(command), 1)
+
+        if self.capture_output:
+            if self._wild_cards_in_out_files:
+                raise ValueError(
+                    "The output can only be captured to a main outfile " + \
+                        "without wild cards."
+                )
+            if not self.code_profile.stdout_is_outfile:
+                raise ValueError(
+                    "The output of " + self.code_profile.name + " can " + \
+                        "not be captured, its main outfile is not its stdout."
+                )
+            kwargs.setdefault("stdout", sp.PIPE)
+            if not self.err_file_name is None:
+                kwargs.setdefault("stderr", sp.PIPE)
+
+        self._calculation_process = \
+            self._process_factory(command, *args, **kwargs)
+
+        #--- start copying the captured output ---
+        for pipe, path in [
+            (getattr(self._calculation_process, "stdout", None), 
+                self._out_file_name[0]),
+            (getattr(self._calculation_process, "stderr", None), 
+                self.err_file_name)
+        ]:
+            if self.capture_output and not pipe is None:
+                self._pumps[path] = OutputPump(pipe, path, self.time_now)
+        #---
+
+        self.emit_event(
+            "start", 
+            command=list(command), 
+            pid=getattr(self._calculation_process, "pid", None),
+            timeout=self.timeout,
+            polling_period=self.polling_period_outfiles,
+            out_file_name=self._out_file_name,
+            capture_output=self.capture_output
+        )
+
+        self.publish_status("watching")
+
+    def publish_status(self, phase):
+        """Publish the state of the assassin in the status segment (if 
+        there is one). See StatusSegment.phases for possible phases."""
+
+        if not self._status_segment is None:
+            self._status_segment.write(self, phase)
+
+    def terminate_calculation_process(self):
+        """Stop the goverened subprocess."""
+
+        if not self._shadow_ledger is None:
+            self.log("Shadow mode: would terminate child process now.", 2)
+            self._shadow_ledger.record(
+                self.time_now(), "terminate_calculation_process"
+            )
+            return
+
+        self.log("Attempting to terminating child process.")
+        self._calculation_process.terminate()
+        self.log("Finished terminating child process.")
+
+    def log(self, msg, level=0):
+        """Write message to log file. There are several levels available 
+        to distinct between more or less important log messages:
+        
+        level should be bettween 0 and 3:
+            - 0 ordinary info
+            - 1 important info
+            - 2 warning
+            - 3 error
+        """
+
+        self._logger.log(msg=msg, level=level)
+
+    def emit_event(self, kind, detector=None, **values):
+        """Write an event with the measured values to the event log (if 
+        there is one, see EventLog)"""
+
+        if not self._event_log is None:
+            self._event_log.write(kind, self.time_now(), detector, values)
+
+    @profiled("send_email")
+    def send_email(self, subject, message):
+        self._email_handler.send_email(subject=subject, message=message)
+
+    def send_email_notification_assassin_error(self, exception=None):
+        """Used to send to user an error warning, in case e.g. an exception
+        that cannot be handled occurres"""
+
+        if not self._email_handler is None:
+            msg = "Dear VSC3 user, " + os.linesep
+            msg += "while tending to your calculation '" +  \
+                self.get_job_name() + "' (job id: " + str(self.get_job_id()) + \
+                    ") an unexpected error occurred. Please manually check " + \
+                        "the situation on vsc immediately!!!"  + os.linesep
+            
+            if not exception is None:
+                msg += "The following error occurred: " + str(exception) + \
+                    os.linesep
+
+            msg += os.linesep + "Best Regards," + os.linesep
+            msg += "Your favorite Slurm-Assassin"
+
+
+            self.send_email(
+                subject="Unexpected Assassin-Error, USER ACTION REQUIRED!",
+                message=msg
+            )
+
+
+    def _diagnostics_for_email(self):
+        """The summary of the diagnostic bundle as part of a mail (empty if
+        none was collected)"""
+
+        if self.diagnostic_summary is None:
+            return ""
+
+        return os.linesep + "Diagnostics collected before the job was " + \
+            "cancelled:" + os.linesep + os.linesep + \
+                self.diagnostic_summary.replace("\n", os.linesep)
+
+    def send_email_notification_crashed(
+        self, 
+        exception=None, 
+        job_cancelled=True
+    ):
+        """If the user specified a notification email address, 
+        send a notification mail that the job crashed."""
+
+        if not self._email_handler is None:
+            msg = "Dear VSC3 user, " + os.linesep
+            msg += "your calculation '" +  self.get_job_name() + \
+                "' has crashed." 
+                        
+            if job_cancelled:
+                msg += "The corresponding job '" + \
+                        str(self.get_job_id()) + "' was thus cancelled." + \
+                            os.linesep
+            else:
+                msg += "Please check the corresponding job '" + \
+                    str(self.get_job_id()) + "'." + os.linesep
+
+            if not exception is None:
+                msg += "The following error occurred: " + str(exception) + \
+                    os.linesep
+
+            msg += self._diagnostics_for_email()
+
+            msg += os.linesep + "Best Regards," + os.linesep
+            msg += "Your favorite Slurm-Assassin"
+
+
+            self.send_email(
+                subject="Calculation Crashed",
+                message=msg
+            )
+
+    def send_email_notification_timeout(self, job_cancelled=True):
+        """If the user specified a notification email address, 
+        send a notification mail that the job timed out."""
+
+        if not self._email_handler is None:
+            msg = "Dear VSC3 user, " + os.linesep
             msg += "your calculation '" +  self.get_job_name() + \
                         "' has timed out, because the was no update in any " + \
                             "of the outfiles for " + str(self.timeout / 60.0) + \
@@ -388,6 +3332,8 @@ class SlurmAssassin(object):
                 msg += "Please check the corresponding job '" + \
                     str(self.get_job_id()) + "'." + os.linesep
 
+            msg += self._diagnostics_for_email()
+
             msg += os.linesep + "Best Regards," + os.linesep
             msg += "Your favorite Slurm-Assassin"
 
@@ -398,52 +3344,449 @@ class SlurmAssassin(object):
             )
 
 
+    @profiled("is_timeout_reached")
     def is_timeout_reached(self):
         """Checks the outfile(s) for changes. Returns whether there 
         the time that passed since the last change exceeds the timeout."""
 
+        # finished sub-calculations can not time out, stalled ones only 
+        # once no other one is running any more (the sub-calculations were
+        # just scanned by is_calculation_finished)
+        tracker = self._subcalculation_tracker
+        if not tracker is None:
+            counts = tracker.count()
+            if counts[tracker.RUNNING] > 0:
+                return False
+            elif counts[tracker.STALLED] > 0:
+                return True
+            return self.time_now() - self.time_last_update_out > self.timeout
+
         timeout_reached = False
 
         #--- find time of most recent file change ---
-        modification_time = max(
-            [ self.time_last_modified(f) for f in self.out_file_name]
+        out_files = self.out_file_name
+        modification_times = [self.time_last_modified(f) for f in out_files]
+        modification_time = max(modification_times)
+        #---
+
+        if not self._rank_tracker is None:
+            self._rank_tracker.update(
+                out_files, 
+                modification_times, 
+                [self.outfile_sizes.get(f, 0) for f in out_files],
+                self.time_calculation_start
+            )
+
+        # if there was a modification, store new modification time
+        if modification_time > self.time_last_update_out:
+            self.time_last_update_out = modification_time
+
+        # else check if calculation timed out
+        elif abs(modification_time - self.time_now()) > self.timeout:
+            timeout_reached = True
+
+        # otherwise no action necessary
+        else:
+            pass
+
+        return timeout_reached
+
+    @staticmethod
+    def _map(f):
+        """Map the file f into memory (None if that is not possible, e.g. 
+        for empty files or files that are not on disk)"""
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    @property
+    def output_matcher(self):
+        """The OutputMatcher of the code profile (rebuilt if the 
+        end_of_calculation_string was changed)"""
+
+        if self._output_matcher is None or \
+            self._output_matcher.finish_markers[0] != \
+                self.end_of_calculation_string:
+
+            self._output_matcher = OutputMatcher.for_profile(
+                self.code_profile,
+                self.end_of_calculation_string
+            )
+        return self._output_matcher
+
+    def _note_markers(self, data, start=0, end=None, new_from=0, before=None):
+        """Note the markers of the code profile (see OutputMatcher) in 
+        data[start:end], skipping matches that end before new_from or start
+        at/after before (they were already noted). A crash signature is 
+        kept in crash_signature, iterations are counted. Returns whether a 
+        finish marker was found."""
+
+        is_finished = False
+
+        for kind, match in self.output_matcher.finditer(data, start, end):
+
+            if match.end() <= new_from or \
+                (not before is None and match.start() >= before):
+                continue
+
+            if kind == OutputMatcher.FINISH:
+                is_finished = True
+
+            elif kind == OutputMatcher.CRASH:
+                if self.crash_signature is None:
+                    line_start = data.rfind(
+                        b"\n", max(0, match.start() - 200), match.start()
+                    ) + 1 or max(0, match.start() - 200)
+                    line_end = data.find(b"\n", match.end(), match.end() + 200)
+                    if line_end == -1:
+                        line_end = match.end()
+
+                    self.crash_signature = bytes(
+                        data[line_start:line_end]
+                    ).decode(errors="replace").strip()
+
+            else:
+                self.n_iterations += 1
+                self.time_last_iteration = self.time_now()
+
+        return is_finished
+
+    def _search_backwards(self, mapped, offset):
+        """Search the mapped outfile from offset to its end for the markers
+        of the code. The end of calculation string is usually in the last 
+        few kB, so the last backward_search_window bytes are searched 
+        backwards in chunks. Only if it is not found there, the rest is 
+        searched for it (without copying the mapped file)."""
+
+        end = len(mapped)
+        overlap = self.output_matcher.overlap
+        start = max(0, offset - overlap)
+        window_start = max(start, end - self.backward_search_window)
+
+        # the skipped output can not be checked for repetitions, only the
+        # last chunk (from its first complete line) is passed on
+        if not self._repetition_detector is None:
+            self._repetition_detector.skip()
+            chunk_start = max(start, end - self.scan_chunk_size)
+            if chunk_start > 0:
+                chunk_start = \
+                    mapped.find(b"\n", chunk_start - 1, end) + 1 or end
+            self._repetition_detector.feed(mapped[chunk_start:end])
+
+        block_end = end
+        while block_end > window_start:
+            block_start = max(window_start, block_end - self.scan_chunk_size)
+            if self._note_markers(
+                mapped, 
+                block_start, 
+                min(end, block_end + overlap),
+                new_from=offset,
+                before=block_end
+            ):
+                return True
+            block_end = block_start
+
+        return window_start > start and self.output_matcher.find_finish(
+            mapped, start, window_start + overlap
+        )
+
+    def _scan_captured(self, pump):
+        """Check the output that arrived through the pump since the last 
+        check for the markers of the code (see _note_markers). Returns 
+        whether a finish marker was found."""
+
+        data, gap = pump.take()
+
+        # the checks could not keep up and some output was dropped
+        if gap:
+            self.log("{0} bytes of captured output were not checked.".format(
+                pump.n_skipped
+            ), 2)
+            self._captured_tail = b""
+            if not self._repetition_detector is None:
+                self._repetition_detector.skip()
+
+        if not self._repetition_detector is None:
+            # after a gap, from the first complete line on
+            self._repetition_detector.feed(
+                data[data.find(b"\n") + 1:] if gap else data
+            )
+
+        data = self._captured_tail + data
+        overlap = self.output_matcher.overlap
+
+        # the search holds the interpreter lock, it is done in chunks so 
+        # the pumps can empty the pipes in between and the calculation is
+        # never blocked for long
+        is_finished = False
+        for start in range(len(self._captured_tail), len(data), 
+                self.scan_chunk_size):
+            is_finished = self._note_markers(
+                data, 
+                max(0, start - overlap), 
+                start + self.scan_chunk_size,
+                new_from=start
+            ) or is_finished
+            self._clock.sleep(0)
+
+        self._captured_tail = data[-overlap:] if overlap > 0 else b""
+
+        return is_finished
+
+    @profiled("is_calculation_finished")
+    def is_calculation_finished(self):
+        """Check if the end_calculation_string (or another finish marker of
+        the code profile) appeared in the outfile. Crash signatures and 
+        iterations are noted on the way (see _note_markers). Only the part 
+        of the outfile that was appended since the last check is read (see
+        scan_offsets). If that is more than a chunk, it is searched 
+        backwards from the end (see _search_backwards)."""
+
+        if not self._subcalculation_tracker is None:
+            return self.scan_subcalculations()
+
+        is_finished = False
+
+        path = self.out_file_name[0]
+
+        if path in self._pumps:
+            is_finished = self._scan_captured(self._pumps[path])
+
+            if not self._trace_recorder is None:
+                self._trace_recorder.record_finished(
+                    self.time_now(), is_finished
+                )
+            return is_finished
+
+        try:
+            stat = self._file_system.stat(path)
+            inode = getattr(stat, "st_ino", None)
+
+            known_inode, offset = self.scan_offsets.get(path, (inode, 0))
+
+            # file was replaced or truncated, search it from the start
+            if known_inode != inode or stat.st_size < offset:
+                offset = 0
+                if not self._repetition_detector is None:
+                    self._repetition_detector.reset()
+
+            with self._file_system.open(path, "rb") as f:
+
+                mapped = None
+                if stat.st_size - offset > self.scan_chunk_size:
+                    mapped = self._map(f)
+
+                if not mapped is None:
+                    with mapped:
+                        is_finished = self._search_backwards(mapped, offset)
+                        self.scan_offsets[path] = (inode, len(mapped))
+
+                else:
+                    # markers may have been cut off at the end of the last 
+                    # search
+                    overlap = self.output_matcher.overlap
+                    position = max(0, offset - overlap)
+                    f.seek(position)
+
+                    tail, searched = b"", offset
+                    while True:
+                        chunk = f.read(self.scan_chunk_size)
+                        if not chunk:
+                            break
+
+                        # pass on the new output (without the overlap)
+                        if not self._repetition_detector is None:
+                            self._repetition_detector.feed(
+                                chunk[max(0, offset - position):]
+                            )
+
+                        data = tail + chunk
+                        data_start = position - len(tail)
+                        position += len(chunk)
+
+                        if self._note_markers(
+                            data, new_from=searched - data_start
+                        ):
+                            is_finished = True
+                            break
+
+                        searched = position
+                        tail = data[-overlap:] if overlap > 0 else b""
+
+                    self.scan_offsets[path] = (inode, f.tell())
+
+        except FileNotFoundError:
+            msg = "Main outfile " + path + " not found!"
+            self.log(msg, 3)
+            raise CalculationCrashMainOutfileMissing(msg)
+
+        if not self._trace_recorder is None:
+            self._trace_recorder.record_finished(self.time_now(), is_finished)
+
+        return is_finished
+
+    @profiled("scan_subcalculations")
+    def scan_subcalculations(self):
+        """Scan the outfiles matched by wild cards as sub-calculations 
+        (see SubcalculationTracker), the other outfiles are only stat'ed. 
+        The progress is logged whenever the number of sub-calculations in a
+        state changes. Returns whether the expected number of 
+        sub-calculations has finished."""
+
+        tracker = self._subcalculation_tracker
+        counts = tracker.count()
+
+        literal = set(f for f in self._out_file_name if not "*" in f)
+        for path in self._out_file_name:
+            if path in literal:
+                self.time_last_update_out = max(
+                    self.time_last_update_out, self.time_last_modified(path)
+                )
+
+        tracker.scan(
+            [path for path in self.out_file_name if not path in literal],
+            self.output_matcher,
+            self._file_system,
+            self.time_now(),
+            self.time_calculation_start
+        )
+
+        for subcalculation in tracker.subcalculations.values():
+            self.outfile_sizes[subcalculation.path] = subcalculation.size
+
+            if not self._trace_recorder is None:
+                self._trace_recorder.record_outfile(
+                    self.time_now(), 
+                    subcalculation.path,
+                    subcalculation.time_last_update,
+                    subcalculation.size
+                )
+
+        if not tracker.time_last_update is None:
+            self.time_last_update_out = max(
+                self.time_last_update_out, tracker.time_last_update
+            )
+
+        #--- report progress ---
+        new_counts = tracker.count()
+        if new_counts != counts:
+            self.log("Sub-calculations: {0} finished, {1} running, {2} " \
+                "stalled (of {3}{4}).".format(
+                    new_counts[tracker.FINISHED],
+                    new_counts[tracker.RUNNING],
+                    new_counts[tracker.STALLED],
+                    len(tracker),
+                    "" if tracker.n_expected is None \
+                        else ", {0} expected".format(tracker.n_expected)
+                ), 1)
+            from assassin_detectors import OutfileDetector
+            self.emit_event(
+                "subcalculations", 
+                OutfileDetector.name, 
+                n_expected=tracker.n_expected,
+                **new_counts
+            )
+
+        if new_counts[tracker.STALLED] > counts[tracker.STALLED]:
+            self.log("Sub-calculations not updated for more than {0:.0f} " \
+                "minutes: {1}.".format(
+                    tracker.timeout / 60, 
+                    tracker.describe(tracker.paths(tracker.STALLED))
+                ), 2)
+        #---
+
+        is_finished = tracker.is_finished
+
+        if not self._trace_recorder is None:
+            self._trace_recorder.record_finished(self.time_now(), is_finished)
+
+        return is_finished
+
+    def get_state(self):
+        """The state of the assassin that is worth keeping if it is 
+        restarted (see StateSnapshot)"""
+        return {
+            "job_id": os.environ.get("SLURM_JOB_ID"),
+            "time_last_update_out": self.time_last_update_out,
+            "scan_offsets": dict(
+                (path, list(value)) for path, value in \
+                    self.scan_offsets.items()
+            ),
+            "n_polls": self.n_polls,
+            "n_process_checks": self.n_process_checks,
+            "n_iterations": self.n_iterations,
+            "n_resumes": self.n_resumes
+        }
+
+    def set_state(self, state):
+        """Resume a state saved by get_state. Scan offsets are only kept if
+        the file still has the same inode and is at least as large."""
+
+        for path, (inode, offset) in state.get("scan_offsets", {}).items():
+            try:
+                stat = self._file_system.stat(path)
+            except (IOError, OSError):
+                continue
+
+            if getattr(stat, "st_ino", None) == inode and \
+                stat.st_size >= offset:
+                self.scan_offsets[path] = (inode, offset)
+
+        # a resumed calculation gets a full timeout from its (re)start
+        self.time_last_update_out = max(
+            self.time_last_update_out, 
+            state.get("time_last_update_out", 0)
         )
-        #---
 
-        # if there was a modification, store new modification time
-        if modification_time > self.time_last_update_out:
-            self.time_last_update_out = modification_time
+        self.n_polls += state.get("n_polls", 0)
+        self.n_process_checks += state.get("n_process_checks", 0)
+        self.n_iterations += state.get("n_iterations", 0)
+        self.n_resumes = state.get("n_resumes", 0) + 1
 
-        # else check if calculation timed out
-        elif abs(modification_time - self.time_now()) > self.timeout:
-            timeout_reached = True
+        self.log("Resumed state of previous assassin ({0} of {1} scan " \
+            "offsets valid).".format(
+                len(self.scan_offsets), len(state.get("scan_offsets", {}))
+            ), 1)
 
-        # otherwise no action necessary
-        else:
-            pass
+    def save_state(self, force=False):
+        """Save a snapshot of the state (if a state file is used and the 
+        last one is older than the snapshot period or force is set)"""
+        
+        if self._state_snapshot is None:
+            return
 
-        return timeout_reached
+        if force or self._state_snapshot.is_due(self.time_now()):
+            try:
+                self._state_snapshot.save(self.get_state(), self.time_now())
+            except (IOError, OSError) as ex:
+                self.log("Could not save state: " + str(ex), 2)
 
-    def is_calculation_finished(self):
-        """Check if the end_calculation_string appeared in the outfile"""
+    def sample_resources(self):
+        """Sample cpu time and memory of the calculation process tree. 
+        Returns None if not available (e.g. if not on Linux)."""
 
-        is_finished = False
+        pid = getattr(self._calculation_process, "pid", None)
+        if pid is None:
+            return None
 
-        try:
-            with open(self.out_file_name[0], "r") as f:
-                for line in f: # TODO avoid re-reading the whole outfile, maybe used read in chunk by chunk
-                    if self.end_of_calculation_string in line:
-                        is_finished = True
-                        break
+        if self._resource_sampler is None:
+            try:
+                self._resource_sampler = ResourceSampler()
+            except (ValueError, OSError, AttributeError):
+                return None
 
-        except FileNotFoundError:
-            msg = "Main outfile " + self.out_file_name[0] + " not found!"
-            self.log(msg, 3)
-            raise CalculationCrashMainOutfileMissing(msg)
+        sample = self._resource_sampler.sample(pid)
+        self.last_resource_sample = sample
+        if not sample is None:
+            self.resource_history.append((self.time_now(), sample))
 
+        if not sample is None and not self._trace_recorder is None:
+            self._trace_recorder.record_resources(self.time_now(), sample)
 
-        return is_finished
+        return sample
 
+    @profiled("is_calculation_crashed")
     def is_calculation_crashed(self):
         """Checks if there is an error message in the error file, that would 
         justify killing the job"""
@@ -451,90 +3794,319 @@ class SlurmAssassin(object):
         #raise NotImplementedError("TODO: parse error file for common errors")
         return False
 
+    def collect_diagnostics(self, reason=None):
+        """Collect the diagnostic bundle (if one is configured), before the
+        evidence is gone with the job. Returns its summary (None if no 
+        bundle was collected)."""
+
+        if self._diagnostic_bundle is None:
+            return None
+
+        self.publish_status("collecting")
+        try:
+            self.diagnostic_summary = \
+                self._diagnostic_bundle.collect(self, reason)
+            self.log("Collected diagnostics: " + \
+                self._diagnostic_bundle.path, 1)
+        except Exception as ex:
+            self.log("Could not collect diagnostics: " + str(ex), 2)
+
+        return self.diagnostic_summary
+
+    @profiled("kill_job")
     def kill_job(self):
-        """Cancels the current job via Slurm's scancel."""
+        """Cancels the current job via Slurm's scancel (or requeues it, see 
+        RequeuePolicy)."""
 
         job_id = self.get_job_id()
 
+        if not self._shadow_ledger is None:
+            self.log("Shadow mode: would kill job " + str(job_id) + " now.", 2)
+            self._shadow_ledger.record(self.time_now(), "kill_job")
+            self.emit_event(
+                "kill", 
+                action="shadow", 
+                target=self.get_kill_target(), 
+                verdict=self.verdict
+            )
+            return
+
         self.log("Killing job " + str(job_id), 1)
+        self.publish_status("killing")
+
+        # scancel will also end the assassin, so save the trace first
+        if not self._trace_recorder is None:
+            self._trace_recorder.flush()
+        self.save_state(force=True)
+
+        # requeue the job if it can be restarted
+        if not self._requeue_policy is None and \
+            self.verdict in ("timeout", "crashed") and \
+                self._requeue_policy.should_requeue(
+                    self.get_kill_target(), self._file_system
+                ):
+            
+            self.log("Restart files found, requeueing job " + \
+                self.get_kill_target(), 1)
+            self.emit_event(
+                "kill", 
+                action="requeue", 
+                target=self.get_kill_target(), 
+                verdict=self.verdict
+            )
+            if self._requeue_policy.requeue(self.get_kill_target()):
+                return
+            self.log("Requeueing failed, cancelling the job instead.", 2)
 
         # cancell the slurm job the assassin is running in.
-        sp.run(["scancel", job_id]) 
+        self.emit_event(
+            "kill", 
+            action="cancel", 
+            target=self.get_kill_target(), 
+            verdict=self.verdict
+        )
+        if not self._kill_coordinator is None:
+            self._kill_coordinator.request(self.get_kill_target())
+        else:
+            sp.run(self._scancel_command + [self.get_kill_target()]) 
 
-    def _lurk(self):
-        """This function encapsulates the monitoring process. It is used 
-        by lurk an kill and only a separate function for testing reasons."""
+    @profiled("process_handle")
+    def check_process_handle(self):
+        """Check the process handle whether the calculation has ended. 
+        Returns True if it exited normally, raises 
+        CalculationCrashFoundByProcessHandle if it exited with an error 
+        and returns False if it is still running."""
 
-        time_last_poll = self.time_calculation_start
+        return_code = self._calculation_process.poll()
+        self.n_process_checks += 1
 
-        while True:
+        if not self._trace_recorder is None and not return_code is None:
+            self._trace_recorder.record_process(self.time_now(), return_code)
+        
+        # calculation process has terminated :D
+        if not return_code is None:
             
-            time.sleep(self.polling_period_process_handle)
+            # calculation exited normally
+            if return_code == 0:
+                
+                self.log("Calculation finished (by process handle).", 1)
+                self.verdict = "finished"
+                return True
             
-            #--- check process handle if calculation has ended ---
-            # check process handle 
-            return_code = self._calculation_process.poll()
+            # there was an error
+            else:
+                self.verdict = "crashed"
+                raise CalculationCrashFoundByProcessHandle(
+                    "Calculation finished with return code " + \
+                        str(return_code) + "."
+                )
+
+        return False
+
+    @profiled("poll_cycle")
+    def poll_outfiles(self):
+        """Check the outfiles whether the calculation has finished, crashed 
+        or timed out. Returns True if it has finished, raises the 
+        corresponding DeadCalculation if it crashed or timed out and 
+        returns False otherwise."""
             
-            # calculation process has terminated :D
-            if not return_code is None:
-                
-                # calculation exited normally
-                if return_code == 0:
-                    
-                    self.log("Calculation finished (by process handle).", 1)
-                    break # quit the while-loop
-                
-                # there was an error
-                else:
-                    raise CalculationCrashFoundByProcessHandle(
-                        "Calculation finished with return code " + \
-                            str(return_code) + "."
-                    )
-            #---
+        self.log("Polling outfiles.")
 
+        self.n_polls += 1
+        self.time_last_poll = self.time_now()
+        self.publish_status("polling")
 
-            #--- Handle file polling ---
+        if not self._trace_recorder is None:
+            self._trace_recorder.record_process(self.time_now(), None)
 
-            # check file polling interval. 
-            if abs(time_last_poll - self.time_now()) > \
-                self.polling_period_outfiles:
-                
-                self.log("Polling outfiles.")
-
-                #--- check outfiles---
-                if self.is_calculation_finished():
-                    
-                    self.log("Calculation finished (by outfile).", 1)
-                    break # quit the while-loop, calculation was successful
-
-                elif self.is_calculation_crashed():
-                    
-                    raise CalculationCrashFoundByErrorFile(
-                        "Calculation crash was detected via error file: " + \
-                            str(self.err_file_name)
+        if not self._trace_recorder is None or \
+            not self._metrics_exporter is None:
+            self.sample_resources()
+
+        #--- check outfiles---
+        if self.is_calculation_finished():
+            
+            self.log("Calculation finished (by outfile).", 1)
+            self.verdict = "finished"
+            return True
+
+        elif not self.crash_signature is None:
+
+            self.verdict = "crashed"
+            raise CalculationCrashFoundByOutfile(
+                "Crash signature of " + self.code_profile.name + \
+                    " found in main outfile: " + self.crash_signature
+            )
+
+        elif self.is_calculation_crashed():
+            
+            self.verdict = "crashed"
+            raise CalculationCrashFoundByErrorFile(
+                "Calculation crash was detected via error file: " + \
+                    str(self.err_file_name)
+            )
+
+        else:
+            
+            self.log("Outfiles show no crashed or finished calculation.")
+
+            # if nothing meaningful was found in outfiles, 
+            # see if timeout is reached
+            if self.is_timeout_reached():
+
+                msg = "Timeout of {0} minutes was exceeded.".format(
+                    self.timeout / 60.0
+                )
+
+                tracker = self._subcalculation_tracker
+                if not tracker is None and tracker.paths(tracker.STALLED):
+                    msg += " Stalled sub-calculations: " + \
+                        tracker.describe(tracker.paths(tracker.STALLED)) + "."
+
+                self.verdict = "timeout"
+                raise CalculationTimeout(msg)
+
+            # the sizes were just updated by is_timeout_reached
+            if not self._output_guard is None:
+                try:
+                    self._output_guard.check(
+                        self.time_now(), 
+                        sum(self.outfile_sizes.values()),
+                        self._file_system,
+                        self.out_file_name[0]
+                    )
+                except CalculationRunawayOutput:
+                    self.verdict = "crashed"
+                    raise
+
+            # the tracker was updated by is_timeout_reached
+            if not self._rank_tracker is None:
+                self.check_ranks()
+
+            # the detector was fed by is_calculation_finished
+            if not self._repetition_detector is None and \
+                self._repetition_detector.is_stuck(self.time_now()):
+
+                self.verdict = "crashed"
+                raise CalculationRepeatingOutput(
+                    "The main outfile has only repeated a block of {0} " \
+                    "line(s) for {1:.1f} minutes.".format(
+                        self._repetition_detector.period,
+                        (self.time_now() - \
+                            self._repetition_detector.time_repeating_since) / 60
                     )
+                )
+        #---
 
-                else:
-                    
-                    self.log("Outfiles show no crashed or finished calculation.")
+        return False
 
-                    # if nothing meaningful was found in outfiles, 
-                    # see if timeout is reached
-                    if self.is_timeout_reached():
+    def check_ranks(self):
+        """Check the progress of the outfiles of the ranks (see 
+        RankProgressTracker). Ranks that lag behind are logged when their 
+        number changes."""
 
-                        raise CalculationTimeout(
-                            "Timeout of {0} minutes was exceeded.".format(
-                                self.timeout / 60.0
-                            )
-                        )
-                #---
+        tracker = self._rank_tracker
+        n_lagging = len(tracker.lagging)
+        try:
+            tracker.check(self.time_now())
+        except CalculationRanksStalled:
+            self.verdict = "timeout"
+            raise
+
+        if len(tracker.lagging) != n_lagging and tracker.lagging:
+            from assassin_detectors import OutfileDetector
+            self.emit_event(
+                "ranks_lagging",
+                OutfileDetector.name,
+                ranks=len(tracker),
+                lagging=len(tracker.lagging),
+                stalled=len(tracker.stalled)
+            )
+            self.log("{0} of {1} ranks lag behind: {2}.".format(
+                len(tracker.lagging), 
+                len(tracker), 
+                tracker.describe(tracker.lagging)
+            ), 2)
+
+    def _lurk(self):
+        """This function encapsulates the monitoring process. It is used 
+        by lurk an kill and only a separate function for testing reasons."""
 
-                # update last poll time
-                time_last_poll = self.time_now()
-            #---
+        scheduler = self._detector_scheduler
+        scheduler.reset(self.time_calculation_start)
+
+        while True:
+            
+            self._clock.sleep(scheduler.sleep_time(self, self.time_now()))
+
+            # run the detectors that are due (e.g. check the process handle
+            # if the calculation has ended, poll the outfiles)
+            verdict = scheduler.run_due(self)
+
+            if verdict.state != "running":
+                self.emit_event(
+                    "verdict",
+                    scheduler.last_detector.name,
+                    verdict=verdict.name,
+                    exception=None if verdict.exception is None \
+                        else type(verdict.exception).__name__,
+                    message=None if verdict.exception is None \
+                        else str(verdict.exception)
+                )
+
+            if verdict.state == "finished":
+                break # quit the while-loop, calculation was successful
+
+            elif verdict.state == "dead":
+                self.verdict = verdict.name
+                raise verdict.exception
 
         self.log("Calculation finished normally", 1)
 
+    def _close(self):
+        """Called by the lurk functions when the assassin is done"""
+
+        # let the pumps write what is left in the pipes
+        for path, pump in self._pumps.items():
+            if not pump.wait(timeout=30):
+                self.log("Captured output to " + path + " is still " + \
+                    "being written.", 2)
+            elif not pump.error is None:
+                self.log("Could not write captured output to " + path + \
+                    ": " + str(pump.error), 3)
+
+        for detector in self._detector_scheduler.detectors:
+            detector.close()
+
+        if not self._subcalculation_tracker is None:
+            self._subcalculation_tracker.close()
+
+        # nothing to resume after a calculation has finished
+        if not self._state_snapshot is None:
+            if self.verdict == "finished":
+                self._state_snapshot.remove()
+            else:
+                self.save_state(force=True)
+
+        if not self._trace_recorder is None:
+            self._trace_recorder.close()
+
+        if not self._event_log is None:
+            self.emit_event(
+                "end",
+                verdict=self.verdict,
+                polls=self.n_polls,
+                seconds_since_last_update=self.time_now() - \
+                    self.time_last_update_out,
+                dropped_events=self._event_log.n_dropped
+            )
+            self._event_log.close()
+            self._event_log = None
+
+        if not self._status_segment is None:
+            self.publish_status("ended")
+            self._status_segment.close()
+
     def lurk_and_kill(self):
         """Activates a listener that checks whether the calculation started via
         the start_calculation method is still alive. If it has died the 
@@ -557,14 +4129,22 @@ class SlurmAssassin(object):
            implemented).
         """
 
+        exit_code = None
+
         try:
             
             #keep listening if calculation is still sane
             self._lurk()
 
+        except SystemExit as ex:
+
+            # terminated by a signal (see StatusSegment)
+            exit_code = ex.code
+
         except CalculationCrashed as ex:
             
             self.log("Calculation crashed!" + str(ex), 3)
+            self.collect_diagnostics(ex)
             self.send_email_notification_crashed(exception=ex)
 
             self.kill_job()
@@ -573,6 +4153,7 @@ class SlurmAssassin(object):
         except CalculationTimeout as ex:
 
             self.log("Calculation timed out! " + str(ex), 3)
+            self.collect_diagnostics(ex)
             self.send_email_notification_timeout()
 
             # stop the calculation process.
@@ -587,14 +4168,19 @@ class SlurmAssassin(object):
         except Exception as ex:
             
             self.log("An unexpected error occurred: " + str(ex))
+            self.emit_event(
+                "error", exception=type(ex).__name__, message=str(ex)
+            )
             self.send_email_notification_assassin_error(ex)
 
             self.kill_job()
 
         finally:
+
+            self._close()
             
             # end whichever python program the assassin was run in.
-            sys.exit()
+            sys.exit(exit_code)
 
     def lurk_and_notify(self):
         """Activates a listener that checks whether the calculation started via
@@ -621,70 +4207,611 @@ class SlurmAssassin(object):
         NO FURTHER ACTION (i.e. like cancelling the job) IS TAKEN WHATSOEVER!
         """
 
-        while True:
-            try:
-                
-                # keep listening if calculation is still sane
-                self._lurk()
+        reported_crashes = set()
+
+        while True:
+            try:
+                
+                # keep listening if calculation is still sane
+                self._lurk()
+
+                # lurking finishes means that the calculation process must have
+                # finished properly.
+                break
+
+            except CalculationCrashFoundByProcessHandle as ex:
+                
+                self.log("Calculation crashed! " + str(ex), 3)
+                self.send_email_notification_crashed(ex, job_cancelled=False)
+                
+                # since process is finished lurkin should be finished as well
+                break
+
+            except CalculationCrashMainOutfileMissing as ex:
+
+                self.log("Calculation crashed! " + str(ex), 3)
+                self.send_email_notification_crashed(ex, job_cancelled=False)
+                self.log("Continue lurking.")
+
+            except CalculationCrashed as ex:
+
+                # e.g. a crash signature or runaway output, which is found 
+                # again at every poll: each crash is only reported once 
+                # (regardless of the numbers in its message)
+                crash = (type(ex).__name__, re.sub(
+                    r"[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?", "#", str(ex)
+                ))
+                if not crash in reported_crashes:
+                    reported_crashes.add(crash)
+                    self.log("Calculation crashed! " + str(ex), 3)
+                    self.send_email_notification_crashed(
+                        ex, job_cancelled=False
+                    )
+                    self.log("Continue lurking.")
+
+            except CalculationTimeout as ex:
+
+                self.log("Calculation timed out! " + str(ex), 3)
+                self.send_email_notification_timeout(job_cancelled=False)
+                self.log("Continue lurking.")
+
+            except Exception as ex:
+                
+                self.log("An unexpected error occurred: " + str(ex))
+                self.emit_event(
+                    "error", exception=type(ex).__name__, message=str(ex)
+                )
+                self.send_email_notification_assassin_error(ex)
+                self.log("Continue lurking.")
+
+
+        self.log("Lurk and notify ended.")
+
+        self._close()
+
+        sys.exit()            
+
+    def lurk_in_shadow(self):
+        """Activates a listener that checks whether the calculation started via
+        the start_calculation method is still alive, exactly like 
+        lurk_and_kill does. However, the assassin must have been created 
+        with a shadow_file: instead of terminating the calculation and 
+        cancelling the job, the assassin only records (with a timestamp) 
+        that it would have done so and keeps watching the calculation. 
+        
+        A new decision is only recorded if the calculation has shown signs of 
+        life since the previous one. When the calculation has ended, a 
+        summary of the decisions is written to the shadow file, including 
+        the core hours a kill would have saved and whether the calculation 
+        recovered afterwards. Then python will be ended via sys.exit.
+        """
+
+        if self._shadow_ledger is None:
+            raise ValueError("Shadow mode requires a shadow_file.")
+
+        ledger = self._shadow_ledger
+
+        while True:
+            try:
+
+                # keep listening if calculation is still sane
+                self._lurk()
+                break
+
+            except DeadCalculation as ex:
+
+                # only decide again if the calculation has recovered since
+                if not ledger.time_last_decision is None and \
+                    self.time_last_update_out <= ledger.time_last_decision:
+                    pass
+
+                else:
+                    self.log("Shadow mode: calculation is dead! " + str(ex), 2)
+                    ledger.reason = type(ex).__name__ + ": " + str(ex)
+
+                    if isinstance(ex, CalculationTimeout):
+                        self.terminate_calculation_process()
+                    self.kill_job()
+
+                # crashed processes cannot recover, stop lurking
+                if isinstance(ex, CalculationCrashFoundByProcessHandle):
+                    break
+
+            except Exception as ex:
+
+                self.log("An unexpected error occurred: " + str(ex))
+                self.emit_event(
+                    "error", exception=type(ex).__name__, message=str(ex)
+                )
+                self.send_email_notification_assassin_error(ex)
+                break
+
+        #--- write summary ---
+        return_code = self._calculation_process.poll()
+        finished = False
+        try:
+            finished = self.is_calculation_finished()
+        except Exception:
+            pass
+
+        summary = ledger.summarize(
+            time_start=self.time_calculation_start,
+            time_end=self.time_now(),
+            time_last_update=self.time_last_update_out,
+            cores=self.get_number_of_cores(),
+            succeeded=return_code == 0 or finished,
+            job_id=os.environ.get("SLURM_JOB_ID"),
+            job_name=self.get_job_name(),
+            return_code=return_code,
+            timeout=self.timeout,
+            polling_period=self.polling_period_outfiles
+        )
+        ledger.write(summary)
+        self.log(
+            "Shadow mode summary written to " + ledger.path + \
+                ". Core hours a kill would have saved: {0:.2f}".format(
+                    summary["core_hours_saved"]
+                ), 
+            1
+        )
+        #---
+
+        self.log("Lurk in shadow ended.")
+
+        self._close()
+
+        sys.exit()            
+
+
+def main(args):
+
+    if isinstance(args.command, list):
+        command = args.command
+    else: 
+        command = args.command.split()
+
+    # the code that is run decides where to look and what to look for
+    if not args.code_profile is None:
+        code_profile = code_profiles[args.code_profile]
+    else:
+        code_profile = detect_code_profile(command) or code_profiles["aims"]
+    Logger.log("Using the code profile of " + code_profile.name + ".")
+
+    outfiles = args.outfiles
+    if outfiles is None:
+        outfiles = code_profile.out_files
+
+    if not args.profile_stats_file is None or not args.profile_every is None:
+        profiler = PollProfiler(
+            stats_file=args.profile_stats_file or None,
+            profile_every=args.profile_every
+        )
+        profiler.install_dump_handlers(log=Logger.log)
+    else:
+        profiler = None
+
+    if not args.metrics_textfile is None or \
+        not args.metrics_port is None or \
+            not args.metrics_socket is None:
+        metrics_exporter = MetricsExporter(
+            job_id=os.environ.get("SLURM_JOB_ID", "unknown"),
+            textfile=args.metrics_textfile,
+            port=args.metrics_port,
+            unix_socket=args.metrics_socket
+        )
+    else:
+        metrics_exporter = None
+
+    scancel_command = args.scancel_command.split()
+    if args.kill_batching:
+        from assassin_kills import KillCoordinator
+        try:
+            kill_coordinator = KillCoordinator(
+                args.kill_spool or KillCoordinator.default_spool_directory(),
+                scancel_command=scancel_command
+            )
+        except (IOError, OSError) as ex:
+            Logger.log("Could not create kill spool: " + str(ex), 2)
+            kill_coordinator = None
+    else:
+        kill_coordinator = None
+
+    # publish the state in shared memory if running in a slurm job
+    status_segment = None
+    if args.status_segment and "SLURM_JOB_ID" in os.environ:
+        try:
+            status_segment = StatusSegment(os.environ["SLURM_JOB_ID"])
+            status_segment.install_cleanup_handlers()
+        except (IOError, OSError) as ex:
+            Logger.log("Could not create status segment: " + str(ex), 2)
+
+    if args.diagnostics_file is None or not args.shadow_file is None:
+        diagnostic_bundle = None
+    else:
+        main_outfile = outfiles if isinstance(outfiles, str) \
+            else outfiles[0]
+        diagnostic_bundle = DiagnosticBundle(
+            args.diagnostics_file or DiagnosticBundle.default_path(
+                main_outfile, os.environ.get("SLURM_JOB_ID", "unknown")
+            ),
+            deadline=args.diagnostics_deadline
+        )
+
+    if not args.max_output_rate is None or not args.output_quota is None or\
+        args.guard_free_space:
+        output_guard = OutputGrowthGuard(
+            max_growth_rate=None if args.max_output_rate is None \
+                else args.max_output_rate * 1024**2,
+            quota=None if args.output_quota is None \
+                else args.output_quota * 1024**3,
+            check_free_space=args.guard_free_space,
+            time_end=OutputGrowthGuard.job_end_time()
+        )
+    else:
+        output_guard = None
+
+    if not args.repetition_timeout is None:
+        repetition_detector = RepetitionDetector(
+            args.repetition_timeout * 60,
+            ignore_numbers=args.repetition_ignore_numbers
+        )
+    else:
+        repetition_detector = None
+
+    if not args.max_stalled_ranks is None:
+        if args.max_stalled_ranks.endswith("%"):
+            max_stalled = float(args.max_stalled_ranks[:-1]) / 100
+        else:
+            max_stalled = int(args.max_stalled_ranks)
+
+        rank_tracker = RankProgressTracker(
+            args.timeout * 60,
+            max_stalled=max_stalled,
+            factor=args.straggler_factor,
+            min_lag=args.polling_period * 60
+        )
+    else:
+        rank_tracker = None
+
+    if not args.subcalculations is None:
+        subcalculation_tracker = SubcalculationTracker(
+            args.timeout * 60,
+            n_expected=args.subcalculations or None,
+            n_threads=args.subcalculation_threads
+        )
+    else:
+        subcalculation_tracker = None
+
+    if not args.event_log is None:
+        event_log = EventLog(
+            args.event_log,
+            job_id=os.environ.get("SLURM_JOB_ID", "unknown"),
+            max_bytes=int(args.event_log_max_size * 1024**2)
+        )
+    else:
+        event_log = None
+
+    from assassin_detectors import load_detector
+    detectors = [load_detector(spec) for spec in args.detectors]
+    if args.node_agents:
+        from assassin_agents import NodeAgentDetector
+        detectors.append(NodeAgentDetector(node_timeout=args.node_timeout * 60))
+
+    assassin = SlurmAssassin(
+        timeout=args.timeout,
+        polling_period=args.polling_period,
+        out_file_name=outfiles,
+        err_file_name=code_profile.err_file,
+        email=args.email,
+        trace_file=args.trace_file,
+        shadow_file=args.shadow_file,
+        profiler=profiler,
+        metrics_exporter=metrics_exporter,
+        status_segment=status_segment,
+        poll_scheduler=None if args.poll_jitter is None else \
+            PollScheduler.from_environment(
+                args.polling_period * 60, 
+                jitter=args.poll_jitter
+            ),
+        kill_coordinator=kill_coordinator,
+        state_file=args.state_file,
+        output_guard=output_guard,
+        repetition_detector=repetition_detector,
+        rank_tracker=rank_tracker,
+        subcalculation_tracker=subcalculation_tracker,
+        detectors=detectors,
+        code_profile=code_profile,
+        diagnostic_bundle=diagnostic_bundle,
+        capture_output=args.capture_output,
+        event_log=event_log
+    )
+    assassin._scancel_command = scancel_command
+
+    if not args.restart_files is None:
+        assassin._requeue_policy = RequeuePolicy(
+            args.restart_files,
+            max_requeues=args.max_requeues,
+            state_file=args.requeue_state_file,
+            scontrol_command=args.scontrol_command.split()
+        )
+
+    # let the daemon on the node do the watching if there is one
+    client = None
+    if not args.daemon_socket is None and args.shadow_file is None:
+        from assassin_daemon import AssassinDaemon, DaemonClient
+        client = DaemonClient(args.daemon_socket or \
+            AssassinDaemon.default_socket_path())
+        try:
+            client.connect()
+        except OSError as ex:
+            Logger.log("Assassin daemon not reachable (" + str(ex) + \
+                "), watching the calculation myself.", 2)
+            client = None
+
+    assassin.start_calculation_process(command=command)
+
+    if not client is None:
+        try:
+            verdict = client.watch(
+                assassin._calculation_process,
+                {
+                    "job_id": assassin.get_job_id(),
+                    "job_name": assassin.get_job_name(),
+                    "out_file_name": [
+                        os.path.abspath(f) for f in assassin._out_file_name
+                    ],
+                    "timeout": args.timeout,
+                    "polling_period": args.polling_period,
+                    "mode": "notify" if args.notify_only else "kill",
+                    "email": args.email,
+                    "log_file": os.path.abspath(Logger.name_of_logfile),
+                    "poll_jitter": args.poll_jitter,
+                    "code_profile": code_profile.name,
+                    "array_job_id": os.environ.get("SLURM_ARRAY_JOB_ID"),
+                    "array_task_id": os.environ.get("SLURM_ARRAY_TASK_ID")
+                }
+            )
+            assassin.log("Assassin daemon is done: " + str(verdict), 1)
+
+            # the daemon watched the calculation, this assassin has no 
+            # state worth resuming
+            if not assassin._state_snapshot is None:
+                assassin._state_snapshot.remove()
+                assassin._state_snapshot = None
+
+            assassin._close()
+            sys.exit()
+
+        except OSError as ex:
+            assassin.log(str(ex) + " Watching the calculation myself.", 2)
+
+        finally:
+            client.close()
+    
+    if not args.shadow_file is None:
+        assassin.lurk_in_shadow()
+    elif args.notify_only:
+        assassin.lurk_and_notify()
+    else:
+        assassin.lurk_and_kill()
+
+
+def status_main(argv):
+    """The status subcommand: print the states of all assassins on this node
+    as published in their status segments."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="assassin.py status",
+        description="Shows the state of all assassins running on this node."
+    )
+    parser.add_argument(
+        '-d', '--directory',
+        help="Directory of the status segments (default /dev/shm).",
+        default=None,
+        dest="directory"
+    )
+    parser.add_argument(
+        '--json',
+        help="Print the states as json.",
+        action="store_true",
+        dest="json"
+    )
+    args = parser.parse_args(argv)
+
+    states = StatusSegment.read_all(args.directory)
+
+    if args.json:
+        print(json.dumps([
+            dict(state, path=path) for path, state in states if state
+        ], indent=2))
+        return
+
+    now = datetime.now().timestamp()
+
+    print("{0:>12} {1:>8} {2:>9} {3:>9} {4:>8} {5:>12} {6:>12}".format(
+        "job id", "pid", "phase", "verdict", "polls", 
+        "last poll", "last update"
+    ))
+    for path, state in states:
+        if state is None:
+            print(path + ": unreadable")
+            continue
+
+        print("{0:>12} {1:>8} {2:>9} {3:>9} {4:>8} {5:>10.0f} s {6:>10.0f} s"
+            .format(
+                state["job_id"], 
+                state["pid"], 
+                state["phase"], 
+                state["verdict"], 
+                state["n_polls"],
+                now - state["time_last_poll"],
+                now - state["time_last_update_out"]
+            )
+        )
+
+
+class LazyArgumentParser(object):
+    """A stand-in for argparse.ArgumentParser that parses the command line 
+    of the watchdog without importing argparse, which would delay the 
+    start of the calculation (see benchmarks/startup_time.py). 
+
+    The arguments are declared as for argparse, but only options given by
+    one of their flags (or as --flag=value) with the actions store, 
+    store_true and append and nargs None, "?" or "+" are parsed here. 
+    Everything else (e.g. --help, abbreviated flags or errors) is left to 
+    an argparse.ArgumentParser with the same arguments, so the results and
+    the messages are the same as argparse's.
+    """
+
+    # values that look like options, but are not (as in argparse)
+    _negative_number = re.compile(r"^-\d+$|^-\d*\.\d+$")
+
+    def __init__(self, **kwargs):
+        """All kwargs are passed on to argparse.ArgumentParser"""
+
+        self._kwargs = kwargs
+        self._arguments = []
+
+        # flag -> (dest, kwargs of add_argument)
+        self._options = {}
 
-                # lurking finishes means that the calculation process must have
-                # finished properly.
-                break
+    def add_argument(self, *flags, **kwargs):
 
-            except CalculationCrashFoundByProcessHandle as ex:
-                
-                self.log("Calculation crashed! " + str(ex), 3)
-                self.send_email_notification_crashed(ex, job_cancelled=False)
-                
-                # since process is finished lurkin should be finished as well
-                break
+        dest = kwargs.get("dest")
+        if dest is None:
+            long_flags = [f for f in flags if f.startswith("--")]
+            dest = (long_flags or flags)[0].lstrip("-").replace("-", "_")
 
-            except CalculationCrashMainOutfileMissing as ex:
+        self._arguments.append((flags, kwargs))
+        for flag in flags:
+            self._options[flag] = (dest, kwargs)
 
-                self.log("Calculation crashed! " + str(ex), 3)
-                self.send_email_notification_crashed(ex, job_cancelled=False)
-                self.log("Continue lurking.")
+    def argparse_parser(self):
+        """The equivalent argparse.ArgumentParser"""
 
-            except CalculationTimeout as ex:
+        import argparse
 
-                self.log("Calculation timed out! " + str(ex), 3)
-                self.send_email_notification_timeout(job_cancelled=False)
-                self.log("Continue lurking.")
+        parser = argparse.ArgumentParser(**self._kwargs)
+        for flags, kwargs in self._arguments:
+            parser.add_argument(*flags, **kwargs)
+        return parser
 
-            except Exception as ex:
-                
-                self.log("An unexpected error occurred: " + str(ex))
-                self.send_email_notification_assassin_error(ex)
-                self.log("Continue lurking.")
+    def error(self, message):
+        """Print the usage and message and exit (see argparse)"""
+        self.argparse_parser().error(message)
 
+    def parse_args(self, args=None):
+        """Parse args (default: sys.argv[1:]), returns a namespace with an 
+        attribute for every argument"""
 
-        self.log("Lurk and notify ended.")
-        sys.exit()            
+        args = sys.argv[1:] if args is None else list(args)
 
+        values = self._parse(args)
+        if values is None:
+            return self.argparse_parser().parse_args(args)
 
-def main(args):
-    assassin = SlurmAssassin(
-        timeout=args.timeout,
-        polling_period=args.polling_period,
-        out_file_name=args.outfiles,
-        email=args.email
-    )
+        return types.SimpleNamespace(**values)
 
-    if isinstance(args.command, list):
-        command = args.command
-    else: 
-        command = args.command.split()
-    assassin.start_calculation_process(command=command)
-    
-    if args.notify_only:
-        assassin.lurk_and_notify()
-    else:
-        assassin.lurk_and_kill()
+    def _is_value(self, arg):
+        return not arg.startswith("-") or arg == "-" or \
+            not self._negative_number.match(arg) is None
 
+    def _convert(self, value, kwargs):
+        """value converted by the type of the argument (None if that fails
+        or the value is not one of its choices)"""
 
-if __name__ == '__main__':
+        try:
+            value = kwargs.get("type", str)(value)
+        except (TypeError, ValueError):
+            return None
+
+        if "choices" in kwargs and not value in kwargs["choices"]:
+            return None
+        return value
+
+    def _parse(self, args):
+        """The values of all arguments as dict (None if args can not be 
+        parsed here)"""
+
+        values = {}
+        for flags, kwargs in self._arguments:
+            dest, _ = self._options[flags[0]]
+            action = kwargs.get("action", "store")
+
+            if action == "store_true":
+                values[dest] = kwargs.get("default", False)
+            elif action == "append":
+                default = kwargs.get("default")
+                values[dest] = None if default is None else list(default)
+            else:
+                default = kwargs.get("default")
+                # argparse converts string defaults
+                if isinstance(default, str) and "type" in kwargs:
+                    default = kwargs["type"](default)
+                values[dest] = default
+
+        i = 0
+        while i < len(args):
+
+            flag, value = args[i], None
+            if flag.startswith("--") and "=" in flag:
+                flag, value = flag.split("=", 1)
+
+            if not flag in self._options:
+                return None
+
+            dest, kwargs = self._options[flag]
+            action = kwargs.get("action", "store")
+            nargs = kwargs.get("nargs")
+            i += 1
+
+            if action == "store_true":
+                if not value is None:
+                    return None
+                values[dest] = True
+                continue
+
+            if not action in ("store", "append") or \
+                not nargs in (None, "?", "+"):
+                return None
+
+            if value is None:
+                given = []
+                while i < len(args) and self._is_value(args[i]) and \
+                    (nargs == "+" or not given):
+                    given.append(args[i])
+                    i += 1
+            else:
+                given = [value]
 
-    parser = argparse.ArgumentParser(
+            if not given:
+                if nargs != "?":
+                    return None
+                values[dest] = kwargs.get("const")
+                continue
+
+            converted = [self._convert(v, kwargs) for v in given]
+            if any(v is None for v in converted):
+                return None
+
+            value = converted if nargs == "+" else converted[0]
+            if action == "append":
+                values[dest] = (values[dest] or []) + [value]
+            else:
+                values[dest] = value
+
+        return values
+
+
+def build_parser():
+    """The parser of the watchdog's command line (see LazyArgumentParser)"""
+
+    from assassin_kills import KillCoordinator
+    from assassin_detectors import detector_registry, detector_entry_point_group
+
+    parser = LazyArgumentParser(
         prog="assassin.py",
         description= \
 """If you want to do calculations on VSC and feel like you should
@@ -741,8 +4868,10 @@ It is also possible to put down wildcards in the specification of the out files.
 If a wild card is given in the (first element of a list of) output file path(s)
 the main outfile will be which ever file matches the search string and is 
 first by alphabetical order.
+
+Default are the outfiles of the code profile (e.g. aims.out for aims).
 """,
-        default="aims.out",
+        default=None,
         type=str,
         nargs="+",
         required=False,
@@ -783,9 +4912,458 @@ first by alphabetical order.
         nargs="?",
         dest="notify_only"
     )
-    
-    
-    args = parser.parse_args()
-    main(args)
-       
 
+    parser.add_argument(
+        '--record-trace',
+        help="Record every observation of the assassin (outfile " + \
+            "modification times and sizes, process status, resource " + \
+                "usage) to a binary trace file, that can be replayed " + \
+                    "with replay.py to tune timeout and polling period.",
+        metavar="trace_file",
+        default=None,
+        type=str,
+        required=False,
+        dest="trace_file"
+    )
+
+    parser.add_argument(
+        '--shadow',
+        help="Run in shadow mode: the assassin will neither kill the " + \
+            "calculation nor cancel the job, but record when it would " + \
+                "have done so. At the end of the job a (json) summary of " + \
+                    "these decisions, including the core hours a kill " + \
+                        "would have saved, is written to the given file " + \
+                            "(default: assassin_shadow.json).",
+        metavar="summary_file",
+        const="assassin_shadow.json",
+        default=None,
+        nargs="?",
+        type=str,
+        required=False,
+        dest="shadow_file"
+    )
+
+    parser.add_argument(
+        '--profile',
+        help="Record how long the polling cycle and each of its checks " + \
+            "take. A summary is written to the given file (or to the " + \
+                "log if no file is given) at exit and whenever the " + \
+                    "assassin receives SIGUSR2.",
+        metavar="stats_file",
+        const="",
+        default=None,
+        nargs="?",
+        type=str,
+        required=False,
+        dest="profile_stats_file"
+    )
+
+    parser.add_argument(
+        '--profile-every',
+        help="Profile every N-th polling cycle with cProfile (implies " + \
+            "--profile).",
+        metavar="N",
+        default=None,
+        type=int,
+        required=False,
+        dest="profile_every"
+    )
+
+    parser.add_argument(
+        '--metrics-textfile',
+        help="Write the live state of the assassin after every polling " + \
+            "cycle as Prometheus textfile (replaced atomically), e.g. " + \
+                "into the directory of the node exporter's textfile " + \
+                    "collector.",
+        metavar="path.prom",
+        default=None,
+        type=str,
+        required=False,
+        dest="metrics_textfile"
+    )
+
+    parser.add_argument(
+        '--metrics-port',
+        help="Serve the Prometheus metrics via http on localhost:port.",
+        metavar="port",
+        default=None,
+        type=int,
+        required=False,
+        dest="metrics_port"
+    )
+
+    parser.add_argument(
+        '--metrics-socket',
+        help="Serve the Prometheus metrics via http on a unix socket.",
+        metavar="path",
+        default=None,
+        type=str,
+        required=False,
+        dest="metrics_socket"
+    )
+
+
+    parser.add_argument(
+        '--event-log',
+        help="Append the events of the assassin (start, polls, " + \
+            "verdicts, kills, ...) as json lines with a stable schema " + \
+            "to this file (see EventLog), for tools that should not " + \
+            "parse the log file.",
+        metavar="path.jsonl",
+        default=None,
+        type=str,
+        required=False,
+        dest="event_log"
+    )
+
+    parser.add_argument(
+        '--event-log-max-size',
+        help="The size (in MiB) up to which routine events (polls) are " + \
+            "written to the event log (default 16). Verdicts and kills " + \
+            "are always written.",
+        metavar="MiB",
+        default=16,
+        type=float,
+        required=False,
+        dest="event_log_max_size"
+    )
+
+    parser.add_argument(
+        '--status-segment',
+        help="Publish the assassin's state in shared memory (/dev/shm), " + \
+            "where it can be read by 'assassin.py status'.",
+        action="store_true",
+        dest="status_segment"
+    )
+
+    parser.add_argument(
+        '--poll-jitter',
+        help="Stagger the polls: the intervals between two polls deviate " + \
+            "by up to this fraction from the polling period (e.g. 0.1) " + \
+            "and in a slurm job the first poll is shifted by a phase " + \
+            "derived from the job id, so assassins started together " + \
+            "(e.g. of an array job) do not poll the file system at the " + \
+            "same moments. By default the polls are not staggered.",
+        metavar="fraction",
+        default=None,
+        type=float,
+        required=False,
+        dest="poll_jitter"
+    )
+
+    parser.add_argument(
+        '--scancel-command',
+        help="The command used to cancel the job (default scancel), " + \
+            "the job id is appended.",
+        metavar="cmd",
+        default="scancel",
+        type=str,
+        required=False,
+        dest="scancel_command"
+    )
+
+    parser.add_argument(
+        '--kill-spool',
+        help="Directory in which the kill requests of all assassins are " + \
+            "collected with --kill-batching, so they can be merged into " + \
+            "few scancel calls (default " + \
+            KillCoordinator.default_spool_directory() + "). Must belong " + \
+            "to the user with mode 0700 and support flock if shared " + \
+            "between nodes.",
+        metavar="path",
+        default=None,
+        type=str,
+        required=False,
+        dest="kill_spool"
+    )
+
+    parser.add_argument(
+        '--kill-batching',
+        help="Merge the kill with those of other assassins on the node " + \
+            "into few scancel calls (see --kill-spool) instead of calling " + \
+            "scancel right away.",
+        action="store_true",
+        dest="kill_batching"
+    )
+
+    parser.add_argument(
+        '--requeue-if',
+        help="Requeue the job (scontrol requeue) instead of cancelling " + \
+            "it, if one of these restart files (wildcards allowed) exists " + \
+            "when the calculation has timed out or crashed.",
+        metavar="restart_file",
+        nargs='+',
+        default=None,
+        type=str,
+        required=False,
+        dest="restart_files"
+    )
+
+    parser.add_argument(
+        '--max-requeues',
+        help="How often a job may be requeued (default 3).",
+        default=3,
+        type=int,
+        required=False,
+        dest="max_requeues"
+    )
+
+    parser.add_argument(
+        '--requeue-state-file',
+        help="File in which the requeues are counted. By default the " + \
+            "count is taken from SLURM_RESTART_COUNT.",
+        metavar="path",
+        default=None,
+        type=str,
+        required=False,
+        dest="requeue_state_file"
+    )
+
+    parser.add_argument(
+        '--scontrol-command',
+        help="The command used to requeue the job (default scontrol).",
+        metavar="cmd",
+        default="scontrol",
+        type=str,
+        required=False,
+        dest="scontrol_command"
+    )
+
+    parser.add_argument(
+        '--state-file',
+        help="If given, the assassin saves its state to this file from " + \
+            "time to time, so it can resume it when the job is requeued " + \
+            "or the assassin is restarted. Best put on a node-local or " + \
+            "home file system.",
+        metavar="path",
+        default=None,
+        type=str,
+        required=False,
+        dest="state_file"
+    )
+
+    parser.add_argument(
+        '--capture-output',
+        help="Pipe the stdout of the command through the assassin into " + \
+            "the main outfile (and its stderr into the error file of the " + \
+            "code profile). The output is checked as it arrives instead " + \
+            "of polling the file system. Not possible for codes that " + \
+            "write their main outfile themselves (e.g. vasp).",
+        action="store_true",
+        dest="capture_output"
+    )
+
+    parser.add_argument(
+        '--diagnostics',
+        help="Collect diagnostics (process states, tails of the " + \
+            "outfiles, ...) to this archive before a dead calculation " + \
+            "is killed (if no path is given, to slurm_assassin_" + \
+            "diagnostics_<job id>.tar.gz next to the main outfile).",
+        metavar="path",
+        nargs="?",
+        const="",
+        default=None,
+        type=str,
+        required=False,
+        dest="diagnostics_file"
+    )
+
+    parser.add_argument(
+        '--diagnostics-deadline',
+        help="The longest time (in s) the collection of the diagnostics " + \
+            "may delay the kill. Default is 5 s.",
+        metavar="seconds",
+        default=5,
+        type=float,
+        required=False,
+        dest="diagnostics_deadline"
+    )
+
+    parser.add_argument(
+        '--max-output-rate',
+        help="Kill the calculation if its outfiles grow faster than " + \
+            "this (in MiB/s, averaged over 5 polls).",
+        metavar="MiB/s",
+        default=None,
+        type=float,
+        required=False,
+        dest="max_output_rate"
+    )
+
+    parser.add_argument(
+        '--output-quota',
+        help="Kill the calculation if its outfiles would exceed this " + \
+            "total size (in GiB) before the job ends.",
+        metavar="GiB",
+        default=None,
+        type=float,
+        required=False,
+        dest="output_quota"
+    )
+
+    parser.add_argument(
+        '--guard-free-space',
+        help="Kill the calculation if its outfiles would fill the " + \
+            "file system before the job ends.",
+        action="store_true",
+        dest="guard_free_space"
+    )
+
+    parser.add_argument(
+        '--repetition-timeout',
+        help="Kill the calculation if its main outfile only repeats " + \
+            "the same block of lines for this many minutes.",
+        metavar="minutes",
+        default=None,
+        type=float,
+        required=False,
+        dest="repetition_timeout"
+    )
+
+    parser.add_argument(
+        '--repetition-ignore-numbers',
+        help="Lines that only differ in numbers (e.g. a counter) count " + \
+            "as repetitions.",
+        action="store_true",
+        dest="repetition_ignore_numbers"
+    )
+
+    parser.add_argument(
+        '--max-stalled-ranks',
+        help="Track every outfile (e.g. one per rank, matched by wild " + \
+            "cards) on its own and kill the calculation if this many of " + \
+            "them were not updated for the timeout, even if others still " + \
+            "are. A number of ranks, or a percentage of all (e.g. 10%%).",
+        metavar="N",
+        default=None,
+        dest="max_stalled_ranks"
+    )
+
+    parser.add_argument(
+        '--straggler-factor',
+        help="With --max-stalled-ranks, ranks whose time since their " + \
+            "last update exceeds the median by this factor are reported " + \
+            "as lagging behind (default 10).",
+        default=10,
+        type=float,
+        dest="straggler_factor"
+    )
+
+    parser.add_argument(
+        '--subcalculations',
+        help="Track every outfile matched by the wild cards of " + \
+            "--out-files (e.g. '*/aims.out') as a sub-calculation of its " + \
+            "own, that is finished, running or stalled. The timeout only " + \
+            "applies to the sub-calculations that have not finished. If N " + \
+            "is given, the calculation is finished once N of them have " + \
+            "finished (otherwise when its process ends).",
+        metavar="N",
+        nargs="?",
+        const=0,
+        default=None,
+        type=int,
+        required=False,
+        dest="subcalculations"
+    )
+
+    parser.add_argument(
+        '--subcalculation-threads',
+        help="The number of threads the outfiles of the " + \
+            "sub-calculations are scanned by (default 8).",
+        default=8,
+        type=int,
+        dest="subcalculation_threads"
+    )
+
+    parser.add_argument(
+        '--code-profile',
+        help="The code that is run, it decides the default outfiles and " + \
+            "the markers that are looked for in the main outfile (when " + \
+            "it has finished, crashed or completed an iteration). If not " + \
+            "given, the code is detected from the command (aims if it " + \
+            "is not recognized).",
+        choices=list(code_profiles),
+        default=None,
+        dest="code_profile"
+    )
+
+    parser.add_argument(
+        '--detector',
+        help="Run an additional detector, given as NAME[,key=value,...]" + \
+            " (e.g. cpu_idle,duration=3600). NAME is a built-in detector " + \
+            "(" + ", ".join(sorted(detector_registry)) + "), one " + \
+            "installed via the entry point group " + \
+            detector_entry_point_group + " or module:Class. Can be " + \
+            "given several times.",
+        metavar="spec",
+        default=[],
+        action="append",
+        dest="detectors"
+    )
+
+    parser.add_argument(
+        '--node-agents',
+        help="Start an agent on every node of the job (with srun) that " + \
+            "reports the state of the ranks on its node, and kill the " + \
+            "job if a node stops reporting or its ranks stall (see the " + \
+            "detector nodes for more settings).",
+        action="store_true",
+        dest="node_agents"
+    )
+
+    parser.add_argument(
+        '--node-timeout',
+        help="Time (in minutes) after which a node whose agent has not " + \
+            "reported is considered dead (default 5).",
+        default=5,
+        type=float,
+        dest="node_timeout"
+    )
+
+    parser.add_argument(
+        '--daemon-socket',
+        help="Let the assassin daemon listening on this socket watch " + \
+            "the calculation ('assassin.py daemon'). If no path is given " + \
+            "the daemon of the current user is used. If the daemon is " + \
+            "not reachable, the assassin watches the calculation itself.",
+        metavar="path",
+        nargs="?",
+        const="",
+        default=None,
+        type=str,
+        required=False,
+        dest="daemon_socket"
+    )
+
+    return parser
+
+
+if __name__ == '__main__':
+
+    # the subsystems import the core as assassin, which has to be this module
+    # and not a second copy of it (with classes of its own)
+    sys.modules.setdefault("assassin", sys.modules[__name__])
+
+    if sys.argv[1:2] == ["status"]:
+        status_main(sys.argv[2:])
+
+    elif sys.argv[1:2] == ["daemon"]:
+        from assassin_daemon import daemon_main
+        daemon_main(sys.argv[2:])
+
+    elif sys.argv[1:2] == ["agent"]:
+        from assassin_agents import agent_main
+        agent_main(sys.argv[2:])
+
+    else:
+        parser = build_parser()
+        args = parser.parse_args()
+
+        if not args.max_stalled_ranks is None and \
+            not args.subcalculations is None:
+            parser.error(
+                "--max-stalled-ranks can not be combined with " + \
+                "--subcalculations."
+            )
+
+        main(args)
@@ -0,0 +1,658 @@
+"""This module contains the node agents of the slurm assassin. A
+calculation that spans several nodes is only seen by the assassin (see
+SlurmAssassin in assassin.py) through the mpirun process on the first node
+and the shared outfiles. To see the ranks on the other nodes, a NodeAgent
+is started on every node (with srun), which reports the state of the ranks
+on its node to the NodeMonitor of the assassin (see NodeAgentDetector, or
+the assassin's --node-agents option).
+
+Example:
+    python assassin.py agent host:port --period 10 -x aims.x
+"""
+
+import subprocess as sp
+import os, sys
+import json
+import signal
+
+from collections import deque, OrderedDict
+
+from assassin import ResourceSampler
+from assassin import CalculationNodeLost, CalculationNodeStalled
+from assassin_detectors import Detector, Verdict, register_detector
+from assassin_daemon import JsonLinesConnection
+
+
+def _open_socket(address, listen=False):
+    """A socket for address, which is the path of a unix socket or 
+    host:port of a tcp socket. If listen is set, the socket is bound to 
+    address (an empty host means all interfaces, port 0 a free port)."""
+
+    import socket
+
+    if "/" in address:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        target = address
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        host, _, port = address.rpartition(":")
+        target = (host, int(port))
+
+    if listen:
+        if not isinstance(target, tuple):
+            if os.path.exists(target):
+                os.remove(target)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(target)
+        sock.listen(128)
+    else:
+        sock.connect(target)
+
+    return sock
+
+
+def expand_nodelist(nodelist):
+    """The host names of a slurm node list such as 'n[01-03,07],gpu1' (as 
+    in SLURM_JOB_NODELIST)"""
+
+    # split at the commas outside of brackets
+    items, depth, start = [], 0, 0
+    for i, character in enumerate(nodelist):
+        if character == "[":
+            depth += 1
+        elif character == "]":
+            depth -= 1
+        elif character == "," and depth == 0:
+            items.append(nodelist[start:i])
+            start = i + 1
+    items.append(nodelist[start:])
+
+    names = []
+    for item in items:
+        if not "[" in item:
+            if item:
+                names.append(item)
+            continue
+
+        # expand the first range, the rest of the name may contain more
+        prefix, _, rest = item.partition("[")
+        ranges, _, suffix = rest.partition("]")
+        for part in ranges.split(","):
+            first, _, last = part.partition("-")
+            if last:
+                for number in range(int(first), int(last) + 1):
+                    names += expand_nodelist(
+                        prefix + str(number).zfill(len(first)) + suffix
+                    )
+            else:
+                names += expand_nodelist(prefix + first + suffix)
+
+    return names
+
+
+class NodeAgent(object):
+    """Reports the state of the ranks of a calculation on one node to the 
+    NodeMonitor of the assassin (one agent runs per node, see 
+    NodeMonitor.launch_agents). 
+
+    The ranks are the processes of the user whose command name starts with 
+    one of the executables of the code. Every period the agent samples them
+    and sends what changed since its last report (json, one per line):
+        {"type": "hello", "node": ..., "token": ...}: once after connecting
+        {"type": "sample", "cpu": ..., optionally "ranks": ..., "rss": ...,
+            "states": ...}
+    cpu is the cpu time (in s) the ranks used since the last report, ranks 
+    the number of ranks, rss their resident memory (in bytes, only if it 
+    changed by more than rss_resolution) and states the number of ranks per
+    process state (e.g. {"R": 63, "D": 1}). A sample is sent even if 
+    nothing changed, it tells the assassin the node is alive. The token 
+    authenticates the agent (see NodeMonitor).
+
+    The agent ends when the assassin closes the connection.
+    """
+
+    rss_resolution = 0.05
+
+    def __init__(self, 
+        address, 
+        executables, 
+        period=10, 
+        node=None, 
+        sampler=None, 
+        sleep=None,
+        token=None
+    ):
+        """Args:
+            address: the address of the NodeMonitor (unix socket path or 
+                host:port).
+            executables: beginnings of the command names of the ranks.
+            period: time (in s) between two reports.
+            node: the name of the node (default: the host name).
+            sampler: the ResourceSampler used to find the ranks.
+            sleep: function that waits for the given time (in s) and 
+                returns whether the agent should stop (default: wait for 
+                the connection to be closed).
+            token: the token of the NodeMonitor (default: taken from the
+                environment variable NodeMonitor.token_variable).
+        """
+
+        import socket
+
+        self.address = address
+        self.executables = list(executables)
+        self.period = period
+        self.node = socket.gethostname() if node is None else node
+        self._sampler = ResourceSampler() if sampler is None else sampler
+        self._sleep = sleep
+        self.token = os.environ.get(NodeMonitor.token_variable, "") \
+            if token is None else token
+
+        self._socket = None
+        self._running = False
+
+        # what the assassin knows
+        self._cpu_times = {}
+        self._reported = {"ranks": None, "rss": None, "states": None}
+
+    def report(self):
+        """Sample the ranks and return the report of what changed"""
+
+        ranks = self._sampler.find(self.executables)
+
+        # ranks that have ended take their cpu time with them, so the cpu
+        # time is summed up per rank
+        cpu = sum(
+            cpu_time - self._cpu_times.get(pid, 0) \
+                for pid, (_, cpu_time, _) in ranks.items()
+        )
+        self._cpu_times = dict(
+            (pid, cpu_time) for pid, (_, cpu_time, _) in ranks.items()
+        )
+
+        states = {}
+        for state, _, _ in ranks.values():
+            states[state] = states.get(state, 0) + 1
+        rss = sum(rss for _, _, rss in ranks.values())
+
+        report = {"type": "sample", "cpu": round(max(0, cpu), 2)}
+
+        if self._reported["ranks"] != len(ranks):
+            report["ranks"] = self._reported["ranks"] = len(ranks)
+        if self._reported["states"] != states:
+            report["states"] = self._reported["states"] = states
+
+        reported_rss = self._reported["rss"]
+        if reported_rss is None or \
+            abs(rss - reported_rss) > self.rss_resolution * reported_rss:
+            report["rss"] = self._reported["rss"] = rss
+
+        return report
+
+    def _send(self, message):
+        self._socket.sendall((json.dumps(message) + "\n").encode())
+
+    def _wait(self, timeout):
+        """Wait for timeout seconds, returns whether the connection was 
+        closed (by the assassin) in the meantime"""
+
+        import select
+
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        return bool(readable) and not self._socket.recv(4096)
+
+    def run(self):
+        """Report until the assassin closes the connection (or stop is 
+        called)"""
+
+        self._socket = _open_socket(self.address)
+        self._running = True
+        try:
+            self._send({
+                "type": "hello", "node": self.node, "token": self.token
+            })
+
+            while self._running:
+                self._send(self.report())
+
+                if self._sleep is None:
+                    if self._wait(self.period):
+                        break
+                elif self._sleep(self.period):
+                    break
+
+        except OSError:
+            pass # the assassin is gone
+
+        finally:
+            self._socket.close()
+
+    def stop(self):
+        self._running = False
+
+
+class NodeState(object):
+    """The state of the ranks on one node, as reported by its NodeAgent"""
+
+    def __init__(self, node, time_now):
+        self.node = node
+        self.time_connected = time_now
+        self.time_last_report = time_now
+        self.connected = True
+
+        self.n_reports = 0
+        self.cpu_time = 0.0
+        self.ranks = 0
+        self.max_ranks = 0
+        self.rss = 0
+        self.states = {}
+
+        # (time, cpu time) of the reports
+        self.history = deque()
+
+    def update(self, report, time_now):
+        """Apply a sample report of the agent"""
+
+        self.n_reports += 1
+        self.time_last_report = time_now
+        self.cpu_time += report.get("cpu", 0)
+
+        self.ranks = report.get("ranks", self.ranks)
+        self.max_ranks = max(self.max_ranks, self.ranks)
+        self.rss = report.get("rss", self.rss)
+        self.states = report.get("states", self.states)
+
+        self.history.append((time_now, self.cpu_time))
+
+    def cpu_fraction(self, duration, time_now):
+        """The fraction of a core each rank used on average over the last 
+        duration seconds (None if the node did not report for that long)"""
+
+        history = self.history
+        while len(history) > 2 and time_now - history[1][0] >= duration:
+            history.popleft()
+
+        if not history or time_now - history[0][0] < duration:
+            return None
+
+        time_first, cpu_time_first = history[0]
+        return (self.cpu_time - cpu_time_first) / \
+            (time_now - time_first) / max(1, self.ranks)
+
+    def describe(self):
+        return "{0}: {1} ranks ({2}), {3:.0f} MB".format(
+            self.node,
+            self.ranks,
+            ", ".join(
+                "{0} {1}".format(n, state) \
+                    for state, n in sorted(self.states.items())
+            ) or "-",
+            self.rss / 1024.0**2
+        )
+
+
+class NodeMonitor(object):
+    """Collects the reports of the NodeAgents of a calculation (see 
+    NodeAgent for the protocol). The monitor does not need a thread of its
+    own: receive is called by the NodeAgentDetector when it runs.
+
+    A silent node gets the job killed, so not anybody who can reach the 
+    port may pose as one: the first message of a connection must be a 
+    hello with the monitor's (random) token, which is passed to the agents
+    in the environment, and the node must be one of the job's nodes. 
+    Other connections are dropped, as are those that do not say hello 
+    within hello_timeout and those beyond max_connections.
+    """
+
+    # the agents run beside the calculation in the same allocation
+    srun_command = ["srun", "--overlap", "--ntasks-per-node=1"]
+
+    # the environment variable the token is passed to the agents in
+    token_variable = "SLURM_ASSASSIN_AGENT_TOKEN"
+
+    def __init__(self, 
+        address=None, 
+        token=None, 
+        nodes=None, 
+        max_connections=None,
+        hello_timeout=30
+    ):
+        """Args:
+            address: where the agents connect to: the path of a unix 
+                socket (only for agents on the same node) or host:port 
+                (default: all interfaces and a free port).
+            token: the token the agents authenticate with (default: a 
+                random one).
+            nodes: the host names agents may report for (default: the 
+                nodes in SLURM_JOB_NODELIST, any if it is not set).
+            max_connections: the largest number of open connections 
+                (default: two per node).
+            hello_timeout: time (in s) within which a new connection must 
+                say hello.
+        """
+        
+        import socket
+        import secrets
+
+        self.token = secrets.token_hex(16) if token is None else token
+
+        if nodes is None and "SLURM_JOB_NODELIST" in os.environ:
+            nodes = expand_nodelist(os.environ["SLURM_JOB_NODELIST"])
+        self.allowed_nodes = None if nodes is None \
+            else set(node.split(".")[0] for node in nodes)
+
+        if max_connections is None:
+            max_connections = 256 if self.allowed_nodes is None \
+                else 2 * len(self.allowed_nodes)
+        self.max_connections = max_connections
+        self.hello_timeout = hello_timeout
+
+        # connections that were dropped
+        self.n_rejected = 0
+
+        self._server = _open_socket(
+            ":0" if address is None else address, 
+            listen=True
+        )
+        self._server.setblocking(False)
+
+        if self._server.family == socket.AF_UNIX:
+            self.address = self._socket_path = address
+        else:
+            self._socket_path = None
+            self.address = "{0}:{1}".format(
+                socket.gethostname(), self._server.getsockname()[1]
+            )
+
+        # node name -> NodeState
+        self.nodes = OrderedDict()
+
+        # socket -> (connection, node name, time connected)
+        self._connections = {}
+
+        self._launcher = None
+
+    def launch_agents(self, executables, period=10, launcher=None):
+        """Start the agents, by default one per node of the job with srun.
+        launcher replaces the srun command (e.g. [] starts one agent on 
+        this node)."""
+
+        import assassin
+
+        if launcher is None:
+            launcher = self.srun_command + [
+                "--nodes=" + os.environ.get("SLURM_JOB_NUM_NODES", "1")
+            ]
+
+        command = launcher + [
+            sys.executable, os.path.abspath(assassin.__file__), "agent", 
+            self.address,
+            "--period", str(period), "-x"
+        ] + list(executables)
+
+        # srun passes the environment on to the agents
+        with open(os.devnull, "w") as fnull:
+            self._launcher = sp.Popen(
+                command, 
+                stdout=fnull, 
+                stderr=fnull,
+                env=dict(os.environ, **{self.token_variable: self.token})
+            )
+
+    def _authenticate(self, message):
+        """The node name of a valid hello message (None if it is not)"""
+
+        import hmac
+
+        if not isinstance(message, dict) or message.get("type") != "hello":
+            return None
+
+        if not hmac.compare_digest(
+            str(message.get("token", "")).encode(), self.token.encode()
+        ):
+            return None
+
+        node = str(message.get("node"))
+        if not self.allowed_nodes is None and \
+            not node.split(".")[0] in self.allowed_nodes:
+            return None
+
+        return node
+
+    def _drop(self, client):
+        """Close the connection of client"""
+        connection, node, _ = self._connections.pop(client)
+        client.close()
+        if node is None:
+            self.n_rejected += 1
+        else:
+            self.nodes[node].connected = False
+
+    def receive(self, time_now):
+        """Accept new agents and apply all reports that have arrived"""
+
+        import select
+
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except (BlockingIOError, OSError):
+                break
+
+            if len(self._connections) >= self.max_connections:
+                client.close()
+                self.n_rejected += 1
+                continue
+
+            client.setblocking(False)
+            self._connections[client] = \
+                (JsonLinesConnection(client), None, time_now)
+
+        if not self._connections:
+            return
+
+        readable, _, _ = select.select(list(self._connections), [], [], 0)
+        for client in readable:
+            connection, node, time_connected = self._connections[client]
+
+            try:
+                messages = connection.receive()
+            except ValueError:
+                messages = None # not json
+
+            for message in messages or []:
+
+                # the first message must be a valid hello
+                if node is None:
+                    node = self._authenticate(message)
+                    if node is None:
+                        messages = None
+                        break
+
+                    self._connections[client] = \
+                        (connection, node, time_connected)
+                    if node in self.nodes:
+                        self.nodes[node].connected = True
+                    else:
+                        self.nodes[node] = NodeState(node, time_now)
+
+                elif isinstance(message, dict) and \
+                    message.get("type") == "sample":
+                    self.nodes[node].update(message, time_now)
+
+            if messages is None:
+                self._drop(client)
+
+        # connections that never said hello
+        for client, (_, node, time_connected) in \
+            list(self._connections.items()):
+            if node is None and \
+                time_now - time_connected > self.hello_timeout:
+                self._drop(client)
+
+    def close(self):
+        """Disconnect the agents (which makes them end) and stop listening"""
+
+        for client in list(self._connections):
+            client.close()
+        self._connections.clear()
+
+        self._server.close()
+        if not self._socket_path is None:
+            try:
+                os.remove(self._socket_path)
+            except OSError:
+                pass
+
+        if not self._launcher is None and self._launcher.poll() is None:
+            self._launcher.terminate()
+
+
+@register_detector
+class NodeAgentDetector(Detector):
+    """Watches the nodes of a multi-node calculation through NodeAgents 
+    (see NodeMonitor). A node is considered dead 
+     - if its agent has not reported for node_timeout (the node hangs or 
+       went down, CalculationNodeLost),
+     - if its ranks used less than min_cpu_fraction of a core each for 
+       duration (CalculationNodeStalled), e.g. because they wait for a 
+       hung file system. Nodes on which no ranks were ever found are not 
+       judged (probably the executable was not recognized).
+
+    If no monitor is given, one is created at the first run and the agents 
+    are started with srun, looking for the executables of the assassin's 
+    code profile.
+    """
+
+    name = "nodes"
+
+    def __init__(self, 
+        monitor=None, 
+        node_timeout=300, 
+        duration=1800, 
+        min_cpu_fraction=0.05,
+        agent_period=10,
+        period=None, 
+        cpu_budget=None
+    ):
+        """Args:
+            monitor: the NodeMonitor the agents report to.
+            node_timeout: time (in s) after which a silent node is dead.
+            duration: how long (in s) the ranks of a node must have been 
+                idle.
+            min_cpu_fraction: the fraction of a core below which a rank 
+                counts as idle.
+            agent_period: time (in s) between two reports of the agents.
+        """
+        super(NodeAgentDetector, self).__init__(period, cpu_budget)
+        self.monitor = monitor
+        self.node_timeout = node_timeout
+        self.duration = duration
+        self.min_cpu_fraction = min_cpu_fraction
+        self.agent_period = agent_period
+
+        self._time_started = None
+        self._warned = set()
+
+    def _start(self, assassin):
+        self.monitor = NodeMonitor()
+        self.monitor.launch_agents(
+            assassin.code_profile.executables, period=self.agent_period
+        )
+        assassin.log("Started node agents reporting to " + \
+            self.monitor.address + ".", 1)
+
+    def _warn(self, assassin, key, msg):
+        if not key in self._warned:
+            self._warned.add(key)
+            assassin.log(msg, 2)
+
+    def check(self, assassin):
+
+        time_now = assassin.time_now()
+
+        if self.monitor is None:
+            self._start(assassin)
+        if self._time_started is None:
+            self._time_started = time_now
+
+        self.monitor.receive(time_now)
+
+        if not self.monitor.nodes and \
+            time_now - self._time_started > self.node_timeout:
+            self._warn(assassin, None, "No node agent has reported yet.")
+
+        for state in self.monitor.nodes.values():
+
+            if time_now - state.time_last_report > self.node_timeout:
+                return Verdict.dead(
+                    CalculationNodeLost,
+                    "Node {0} has not reported for {1:.0f} minutes.".format(
+                        state.node, 
+                        (time_now - state.time_last_report) / 60
+                    )
+                )
+
+            if state.max_ranks == 0:
+                if time_now - state.time_connected > self.node_timeout:
+                    self._warn(assassin, state.node, "No ranks found on " + \
+                        "node " + state.node + ".")
+                continue
+
+            cpu_fraction = state.cpu_fraction(self.duration, time_now)
+            if not cpu_fraction is None and \
+                cpu_fraction < self.min_cpu_fraction:
+                return Verdict.dead(
+                    CalculationNodeStalled,
+                    "The ranks on node {0} used {1:.1%} of a core each in " \
+                    "the last {2:.0f} minutes ({3}).".format(
+                        state.node, 
+                        cpu_fraction, 
+                        self.duration / 60,
+                        state.describe()
+                    )
+                )
+
+    def close(self):
+        if not self.monitor is None:
+            self.monitor.close()
+
+
+def agent_main(argv):
+    """The agent subcommand: report the ranks on this node to the assassin 
+    (see NodeAgent, started by NodeMonitor.launch_agents)."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="assassin.py agent",
+        description="Reports the state of the ranks of a calculation on " + \
+            "this node to the assassin."
+    )
+    parser.add_argument(
+        'address',
+        help="Address of the assassin (unix socket path or host:port)."
+    )
+    parser.add_argument(
+        '-x', '--executables',
+        help="Beginnings of the command names of the ranks.",
+        nargs='+',
+        required=True,
+        dest="executables"
+    )
+    parser.add_argument(
+        '--period',
+        help="Time (in s) between two reports (default 10).",
+        default=10,
+        type=float,
+        dest="period"
+    )
+    args = parser.parse_args(argv)
+
+    agent = NodeAgent(args.address, args.executables, period=args.period)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: agent.stop())
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        pass
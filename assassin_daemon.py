@@ -0,0 +1,658 @@
+"""This module contains the assassin daemon, which watches the calculations
+of all jobs on a node in a single process (see AssassinDaemon), and the
+thin client that registers a job with it (see DaemonClient, or the
+assassin's --daemon-socket option).
+
+Example:
+    python assassin.py daemon --socket /tmp/assassin-$USER.sock
+"""
+
+import os
+import json
+import signal
+
+from assassin import Logger, Clock, FileSystem, ResourceSampler
+from assassin import PollScheduler, EMailHandler, SlurmAssassin
+from assassin import DeadCalculation, CalculationTimeout
+from assassin import CalculationCrashFoundByProcessHandle
+
+
+class RemoteProcess(object):
+    """Stands in for the Popen handle of a calculation that was started by 
+    a client of the AssassinDaemon: the return code is reported by the 
+    client and termination is requested from it."""
+
+    def __init__(self, pid, send):
+        """Args:
+            pid: process id of the calculation.
+            send: function that sends a message (dict) to the client.
+        """
+        self.pid = pid
+        self.returncode = None
+        self._send = send
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self._send({"type": "terminate"})
+
+
+class CachingFileSystem(FileSystem):
+    """Wraps a file system and caches the results of stat and glob for 
+    max_age seconds, so assassins that watch the same files share the 
+    calls."""
+
+    def __init__(self, file_system, clock, max_age=1.0):
+        self._file_system = file_system
+        self._clock = clock
+        self.max_age = max_age
+
+        # (operation, argument) -> (time, result, exception)
+        self._cache = {}
+
+    def _cached(self, operation, argument, function):
+
+        now = self._clock.time_now()
+
+        try:
+            time_cached, result, exception = self._cache[(operation, argument)]
+            if now - time_cached > self.max_age:
+                raise KeyError
+        except KeyError:
+            result, exception = None, None
+            try:
+                result = function(argument)
+            except (IOError, OSError) as ex:
+                exception = ex
+            self._cache[(operation, argument)] = (now, result, exception)
+
+            # forget old entries now and then
+            if len(self._cache) > 10000:
+                self._cache = dict(
+                    (key, value) for key, value in self._cache.items() \
+                        if now - value[0] <= self.max_age
+                )
+
+        if not exception is None:
+            raise exception
+        return result
+
+    def stat(self, path):
+        return self._cached("stat", path, self._file_system.stat)
+
+    def glob(self, pattern):
+        return list(self._cached("glob", pattern, self._file_system.glob))
+
+    def open(self, path, mode="r"):
+        return self._file_system.open(path, mode)
+
+    def statvfs(self, path):
+        return self._cached("statvfs", path, self._file_system.statvfs)
+
+
+class MailQueue(object):
+    """Collects the mails of many assassins, so they can be sent in one go
+    over a single connection to the mail server."""
+
+    def __init__(self, logger=Logger):
+        self._logger = logger
+        self._mails = []
+
+    def __len__(self):
+        return len(self._mails)
+
+    def put(self, msg):
+        self._mails.append(msg)
+
+    def flush(self):
+        """Send all queued mails"""
+
+        if not self._mails:
+            return
+
+        mails, self._mails = self._mails, []
+        try:
+            import smtplib
+            s = smtplib.SMTP('localhost')
+            for msg in mails:
+                s.send_message(msg)
+            s.quit()
+        except Exception as ex:
+            self._logger.log(
+                "[Mailer] Could not send {0} mails: {1}".format(
+                    len(mails), ex
+                ), 
+                3
+            )
+
+
+class QueuedEMailHandler(EMailHandler):
+    """An EMailHandler that puts the mails in a MailQueue instead of 
+    sending them right away."""
+
+    def __init__(self, queue, *args, **kwargs):
+        super(QueuedEMailHandler, self).__init__(*args, **kwargs)
+        self._queue = queue
+
+    def send_email(self, subject, message):
+        self._log("Queueing mail to " + self.recipient_address + ": " + subject)
+        self._queue.put(self.build_message(subject, message))
+
+
+class DaemonJobAssassin(SlurmAssassin):
+    """The assassin of a single job that is watched by an AssassinDaemon. 
+    It takes job id and name from the registration instead of the 
+    environment, so all its actions are scoped to the registering job."""
+
+    def __init__(self, 
+        job_id, 
+        job_name="Unknown", 
+        array_job_id=None, 
+        array_task_id=None, 
+        *args, 
+        **kwargs
+    ):
+        self._job_id = str(job_id)
+        self._job_name = job_name
+        self._array_job = (array_job_id, array_task_id)
+        super(DaemonJobAssassin, self).__init__(*args, **kwargs)
+
+    def get_job_id(self):
+        return self._job_id
+
+    def get_array_job(self):
+        return self._array_job
+
+    def get_job_name(self):
+        return self._job_name
+
+
+class DaemonJob(object):
+    """A job registered at the AssassinDaemon"""
+
+    def __init__(self, assassin, mode, send):
+        self.assassin = assassin
+        self.mode = mode
+        self.send = send
+        self.time_next_check = assassin.time_now()
+        self.schedule_next_check()
+
+    def schedule_next_check(self):
+        assassin = self.assassin
+        self.time_next_check = assassin.time_now() + \
+            assassin._detector_scheduler.sleep_time(
+                assassin, assassin.time_now()
+            )
+
+
+class AssassinDaemon(object):
+    """Watches the calculations of all jobs on a node in a single process. 
+
+    Jobs are registered by thin clients (see DaemonClient, or the option 
+    --daemon-socket of the assassin) over a unix socket. The client starts 
+    the calculation, registers it and reports when it has exited; 
+    everything else is done by the daemon, which checks all jobs in one 
+    event loop. The jobs share a stat cache (CachingFileSystem), a resource
+    sampler and a mail queue. Kills and notifications are scoped to the 
+    job that registered.
+
+    The protocol consists of json messages, one per line. Client to daemon:
+        {"type": "register", "job_id": ..., "pid": ..., "out_file_name": 
+            ..., "timeout": ..., "polling_period": ..., "mode": "kill" or 
+            "notify", optionally "job_name", "err_file_name", "email", 
+            "log_file", "poll_jitter" (staggers the polls, see 
+            PollScheduler), "code_profile" (see CodeProfile), 
+            "array_job_id" and "array_task_id"}
+        {"type": "exit", "return_code": ...}
+    Daemon to client:
+        {"type": "registered"}
+        {"type": "terminate"}: the client should terminate the calculation
+        {"type": "done", "verdict": ...}: the daemon stopped watching
+        {"type": "error", "message": ...}
+    """
+
+    _job_assassin = DaemonJobAssassin
+
+    @staticmethod
+    def default_socket_path():
+        """The socket of the daemon of the current user"""
+        return "/tmp/slurm_assassin.{0}.sock".format(os.getuid())
+
+    def __init__(self, 
+        socket_path=None, 
+        clock=None, 
+        file_system=None, 
+        stat_cache_age=1.0
+    ):
+        """Args:
+            socket_path: the unix socket the daemon listens on (only needed
+                for serve_forever).
+            clock: the clock used by the daemon and all jobs.
+            file_system: the file system used by all jobs (it is wrapped 
+                by a CachingFileSystem).
+            stat_cache_age: the time (in s) the results of stat and glob 
+                are shared between jobs.
+        """
+
+        self.socket_path = socket_path
+        self._clock = Clock() if clock is None else clock
+        self._file_system = CachingFileSystem(
+            FileSystem() if file_system is None else file_system,
+            self._clock,
+            stat_cache_age
+        )
+
+        try:
+            self._resource_sampler = ResourceSampler(max_age=stat_cache_age)
+        except (ValueError, OSError, AttributeError):
+            self._resource_sampler = None
+
+        self.mail_queue = MailQueue(logger=self._job_assassin._logger)
+
+        # job id -> DaemonJob
+        self.jobs = {}
+
+        self._running = False
+
+    def log(self, msg, level=0):
+        self._job_assassin._logger.log(msg="[Daemon] " + msg, level=level)
+
+    def register(self, request, send=lambda message: None):
+        """Start watching the job described by request (see the 
+        register message). Messages to the job's client are passed to 
+        send. Returns the DaemonJob."""
+
+        job_id = str(request["job_id"])
+
+        polling_period = request.get("polling_period", 5)
+        if not request.get("poll_jitter") is None:
+            poll_scheduler = PollScheduler.for_job(
+                polling_period * 60,
+                job_id,
+                array_job_id=request.get("array_job_id"),
+                array_task_id=request.get("array_task_id"),
+                jitter=request["poll_jitter"]
+            )
+        else:
+            poll_scheduler = None
+
+        assassin = self._job_assassin(
+            job_id=job_id,
+            job_name=request.get("job_name", "Unknown"),
+            array_job_id=request.get("array_job_id"),
+            array_task_id=request.get("array_task_id"),
+            timeout=request.get("timeout", 15),
+            polling_period=polling_period,
+            out_file_name=request.get("out_file_name", "aims.out"),
+            err_file_name=request.get("err_file_name", "aims.err"),
+            email=request.get("email"),
+            clock=self._clock,
+            file_system=self._file_system,
+            poll_scheduler=poll_scheduler,
+            code_profile=request.get("code_profile")
+        )
+
+        # log into the job's log file
+        if "log_file" in request:
+            assassin._logger = type(
+                "JobLogger", 
+                (assassin._logger,), 
+                {"name_of_logfile": request["log_file"]}
+            )
+
+        if not assassin._email_handler is None:
+            assassin._email_handler = QueuedEMailHandler(
+                self.mail_queue,
+                sender_address=assassin._email_handler.sender_address,
+                recipient_address=assassin._email_handler.recipient_address,
+                subject_prefix=assassin._email_handler.subject_prefix,
+                logger=assassin._logger
+            )
+
+        assassin._resource_sampler = self._resource_sampler
+        assassin._calculation_process = RemoteProcess(request.get("pid"), send)
+
+        job = DaemonJob(assassin, request.get("mode", "kill"), send)
+        self.jobs[job_id] = job
+
+        self.log("Registered job " + job_id + " (" + job.mode + ").", 1)
+        assassin.log("Watched by the assassin daemon (pid {0}).".format(
+            os.getpid()
+        ), 1)
+        send({"type": "registered"})
+
+        return job
+
+    def unregister(self, job_id, verdict=None):
+        job = self.jobs.pop(str(job_id), None)
+        if not job is None:
+            self.log("Unregistered job " + str(job_id) + ".")
+            job.send({"type": "done", "verdict": verdict})
+
+    def report_exit(self, job_id, return_code):
+        """The client reported that the calculation of job has exited"""
+        job = self.jobs.get(str(job_id))
+        if not job is None:
+            job.assassin._calculation_process.returncode = return_code
+            job.time_next_check = self._clock.time_now()
+
+    def time_until_next_check(self):
+        if not self.jobs:
+            return None
+        return max(
+            0, 
+            min(job.time_next_check for job in self.jobs.values()) - \
+                self._clock.time_now()
+        )
+
+    def check(self, job):
+        """One step of the watch loop (see SlurmAssassin._lurk) for job"""
+
+        assassin = job.assassin
+
+        try:
+            verdict = assassin._detector_scheduler.run_due(assassin)
+
+            if verdict.state == "finished":
+                self.unregister(assassin.get_job_id(), "finished")
+
+            elif verdict.state == "dead":
+                assassin.verdict = verdict.name
+                raise verdict.exception
+
+        except DeadCalculation as ex:
+            self.react(job, ex)
+
+        except Exception as ex:
+            assassin.log("An unexpected error occurred: " + str(ex))
+            assassin.send_email_notification_assassin_error(ex)
+            if job.mode == "kill":
+                assassin.kill_job()
+            self.unregister(assassin.get_job_id(), "error")
+
+        job.schedule_next_check()
+
+    def react(self, job, ex):
+        """Act on a dead calculation like lurk_and_kill (mode 'kill') or 
+        lurk_and_notify (mode 'notify') would."""
+
+        assassin = job.assassin
+        is_timeout = isinstance(ex, CalculationTimeout)
+
+        if is_timeout:
+            assassin.log("Calculation timed out! " + str(ex), 3)
+        else:
+            assassin.log("Calculation crashed! " + str(ex), 3)
+
+        if job.mode == "kill":
+
+            if is_timeout:
+                assassin.send_email_notification_timeout()
+                assassin.terminate_calculation_process()
+            else:
+                assassin.send_email_notification_crashed(exception=ex)
+
+            assassin.kill_job()
+            self.unregister(assassin.get_job_id(), assassin.verdict)
+
+        else:
+
+            if is_timeout:
+                assassin.send_email_notification_timeout(job_cancelled=False)
+            else:
+                assassin.send_email_notification_crashed(
+                    ex, job_cancelled=False
+                )
+
+            if isinstance(ex, CalculationCrashFoundByProcessHandle):
+                self.unregister(assassin.get_job_id(), assassin.verdict)
+            else:
+                assassin.log("Continue lurking.")
+
+    def run_due_checks(self):
+        """Check all jobs that are due and send queued mails"""
+
+        now = self._clock.time_now()
+        for job in list(self.jobs.values()):
+            if job.time_next_check <= now:
+                self.check(job)
+
+        self.mail_queue.flush()
+
+    def _handle_message(self, connection, message):
+
+        if message.get("type") == "register":
+            connection.job_id = str(message.get("job_id"))
+            try:
+                self.register(message, send=connection.send)
+            except Exception as ex:
+                connection.send({"type": "error", "message": str(ex)})
+
+        elif message.get("type") == "exit":
+            self.report_exit(connection.job_id, message.get("return_code"))
+
+    def serve_forever(self):
+        """Accept clients on the unix socket and watch their jobs"""
+
+        import socket
+        import selectors
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(128)
+        server.setblocking(False)
+
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ, "accept")
+        selector.register(self._wakeup_read, selectors.EVENT_READ, "wakeup")
+
+        self.log("Listening on " + self.socket_path, 1)
+        self._running = True
+
+        try:
+            while self._running:
+
+                timeout = self.time_until_next_check()
+                for key, _ in selector.select(
+                    timeout=1.0 if timeout is None else min(timeout, 1.0)
+                ):
+
+                    if key.data == "accept":
+                        client, _ = server.accept()
+                        client.setblocking(False)
+                        selector.register(
+                            client, 
+                            selectors.EVENT_READ, 
+                            JsonLinesConnection(client)
+                        )
+
+                    elif key.data == "wakeup":
+                        key.fileobj.recv(64)
+
+                    else:
+                        connection = key.data
+                        messages = connection.receive()
+                        for message in messages or []:
+                            self._handle_message(connection, message)
+
+                        if messages is None:
+                            # client is gone, so is its job
+                            selector.unregister(connection.socket)
+                            connection.socket.close()
+                            if connection.job_id in self.jobs:
+                                self.log(
+                                    "Client of job " + connection.job_id + \
+                                        " disconnected.", 
+                                    2
+                                )
+                                self.jobs.pop(connection.job_id)
+
+                self.run_due_checks()
+
+        finally:
+            selector.close()
+            server.close()
+            self._wakeup_read.close()
+            self._wakeup_write.close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def stop(self):
+        """Stop serve_forever (may be called from another thread)"""
+        self._running = False
+        try:
+            self._wakeup_write.send(b"x")
+        except (AttributeError, OSError):
+            pass
+
+
+class JsonLinesConnection(object):
+    """A client connection of the AssassinDaemon (json lines)"""
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.job_id = None
+        self._buffer = b""
+
+    def send(self, message):
+        try:
+            self.socket.sendall((json.dumps(message) + "\n").encode())
+        except OSError:
+            pass
+
+    def receive(self):
+        """Returns the complete messages received, None if closed"""
+        try:
+            data = self.socket.recv(65536)
+        except BlockingIOError:
+            return []
+        except OSError:
+            return None
+
+        if not data:
+            return None
+
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        return [json.loads(line.decode()) for line in lines if line.strip()]
+
+
+class DaemonClient(object):
+    """The thin client of the AssassinDaemon: it starts the calculation, 
+    registers it at the daemon and reports when it has exited."""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._socket = None
+        self._buffer = b""
+
+    def connect(self):
+        """Connect to the daemon. Raises OSError if it is not running."""
+        import socket
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(self.socket_path)
+
+    def _send(self, message):
+        self._socket.sendall((json.dumps(message) + "\n").encode())
+
+    def _receive(self, timeout):
+        """Returns the messages received within timeout, None if the 
+        connection was closed"""
+        import select
+
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        if not readable:
+            return []
+
+        data = self._socket.recv(65536)
+        if not data:
+            return None
+
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        return [json.loads(line.decode()) for line in lines if line.strip()]
+
+    def watch(self, process, registration, check_period=1.0):
+        """Register the calculation process at the daemon and wait until 
+        the daemon is done with it. Returns the verdict of the daemon, 
+        raises OSError if the connection to the daemon is lost."""
+
+        registration = dict(registration, type="register", pid=process.pid)
+        self._send(registration)
+
+        exit_reported = False
+
+        while True:
+
+            messages = self._receive(check_period)
+            if messages is None:
+                raise OSError("Connection to assassin daemon lost.")
+
+            for message in messages:
+
+                if message["type"] == "terminate":
+                    process.terminate()
+
+                elif message["type"] == "done":
+                    return message.get("verdict")
+
+                elif message["type"] == "error":
+                    raise OSError("Assassin daemon: " + message["message"])
+
+            if not exit_reported:
+                return_code = process.poll()
+                if not return_code is None:
+                    self._send({"type": "exit", "return_code": return_code})
+                    exit_reported = True
+
+    def close(self):
+        if not self._socket is None:
+            self._socket.close()
+
+
+def daemon_main(argv):
+    """The daemon subcommand: watch the jobs of all clients on this node 
+    (see AssassinDaemon)."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="assassin.py daemon",
+        description="Watches the calculations of all assassins started " + \
+            "with --daemon-socket on this node in a single process."
+    )
+    parser.add_argument(
+        '-s', '--socket',
+        help="The unix socket to listen on (default " + \
+            AssassinDaemon.default_socket_path() + ").",
+        default=None,
+        dest="socket"
+    )
+    parser.add_argument(
+        '--stat-cache-age',
+        help="Time (in s) for which results of stat/glob and the " + \
+            "process scan are shared between jobs (default 1).",
+        default=1.0,
+        type=float,
+        dest="stat_cache_age"
+    )
+    args = parser.parse_args(argv)
+
+    daemon = AssassinDaemon(
+        socket_path=args.socket or AssassinDaemon.default_socket_path(),
+        stat_cache_age=args.stat_cache_age
+    )
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,375 @@
+"""This module contains the detectors of the slurm assassin (see
+SlurmAssassin in assassin.py). The checks the assassin runs while it lurks
+are detectors. Every detector runs at its own cadence (see
+DetectorScheduler) and returns a Verdict. Besides the built-in detectors,
+detectors are registered with register_detector, installed via the entry
+point group slurm_assassin.detectors or given as module:Class (see
+load_detector, or the assassin's --detector option).
+"""
+
+from collections import namedtuple, deque
+
+import time
+
+from assassin import DeadCalculation, CalculationTimeout, CalculationIdle
+
+
+class Verdict(namedtuple("Verdict", ["state", "exception"])):
+    """The outcome of a detector run. state is 'running' (nothing found), 
+    'finished' (the calculation ended properly) or 'dead'. Dead verdicts 
+    carry the DeadCalculation that describes how the calculation died."""
+
+    @classmethod
+    def running(cls):
+        return cls("running", None)
+
+    @classmethod
+    def finished(cls):
+        return cls("finished", None)
+
+    @classmethod
+    def dead(cls, exception_class, message=""):
+        """A dead verdict, exception_class must be a DeadCalculation"""
+        if not issubclass(exception_class, DeadCalculation):
+            raise TypeError(str(exception_class) + " is no DeadCalculation.")
+        return cls("dead", exception_class(message))
+
+    @property
+    def name(self):
+        """The verdict as stored in SlurmAssassin.verdict (running, 
+        finished, crashed or timeout)"""
+        if self.state != "dead":
+            return self.state
+        elif isinstance(self.exception, CalculationTimeout):
+            return "timeout"
+        else:
+            return "crashed"
+
+
+class Detector(object):
+    """Base class of the checks the assassin runs while it lurks. 
+
+    Subclasses implement check(assassin), which returns a Verdict (None 
+    counts as running) or raises a DeadCalculation. How often a detector 
+    runs is set by the class attributes (they can be overridden per 
+    instance in the constructor):
+     - period: the time (in s) between two runs. If None, the detector 
+       runs every time the assassin wakes up (i.e. every 
+       polling_period_process_handle).
+     - cpu_budget: the fraction of a core the detector may use on average 
+       (None for no limit). If its runs are expensive, they are spread out 
+       further than period.
+
+    Detectors that hold resources release them in close. Detectors are 
+    registered by name with register_detector, or installed by other 
+    packages via the entry point group 'slurm_assassin.detectors'
+    (see load_detector).
+    """
+
+    name = None
+    period = None
+    cpu_budget = None
+
+    def __init__(self, period=None, cpu_budget=None):
+        if not period is None:
+            self.period = period
+        if not cpu_budget is None:
+            self.cpu_budget = cpu_budget
+
+        self.time_last_run = None
+
+        # statistics of the cpu time (in s) the runs took
+        self.n_runs = 0
+        self.cpu_time = 0.0
+        self.mean_cost = 0.0
+
+    def reset(self, time_now):
+        """Start counting the period at time_now"""
+        self.time_last_run = time_now
+
+    @property
+    def effective_period(self):
+        """The period stretched to keep the cpu budget (None if the 
+        detector runs at every wake up)"""
+
+        period = self.period
+        if not self.cpu_budget is None and self.mean_cost > 0:
+            period = max(period or 0, self.mean_cost / self.cpu_budget)
+        return period or None
+
+    def time_until_due(self, assassin, time_now):
+        """Time (in s) until the next run (None if it runs at every wake 
+        up of the assassin)"""
+        period = self.effective_period
+        if period is None:
+            return None
+        return self.time_last_run + period - time_now
+
+    def is_due(self, assassin, time_now):
+        time_until_due = self.time_until_due(assassin, time_now)
+
+        # runs are scheduled to the exact time, allow for rounding
+        return time_until_due is None or time_until_due <= 1e-6
+
+    def check(self, assassin):
+        raise NotImplementedError("Detectors must implement check.")
+
+    def close(self):
+        """Called when the assassin is done (e.g. to free sockets)"""
+        pass
+
+
+detector_registry = {}
+
+def register_detector(cls):
+    """Class decorator that makes a detector available under its name, 
+    e.g. for the --detector option"""
+    detector_registry[cls.name] = cls
+    return cls
+
+detector_entry_point_group = "slurm_assassin.detectors"
+
+def load_detector(spec):
+    """Create a detector from a spec of the form NAME[,key=value,...]. NAME
+    is the name of a registered detector, of one installed via the entry 
+    point group slurm_assassin.detectors or the import path module:Class. 
+    The key value pairs are passed to the constructor (numbers are 
+    converted)."""
+
+    name, *options = spec.split(",")
+
+    kwargs = {}
+    for option in options:
+        key, _, value = option.partition("=")
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        kwargs[key.strip()] = value
+
+    if name in detector_registry:
+        cls = detector_registry[name]
+
+    elif ":" in name:
+        import importlib
+        module, _, attribute = name.partition(":")
+        cls = getattr(importlib.import_module(module), attribute)
+
+    else:
+        try:
+            from importlib.metadata import entry_points
+            installed = entry_points()
+            if hasattr(installed, "select"):
+                candidates = list(installed.select(
+                    group=detector_entry_point_group, name=name
+                ))
+            else:
+                candidates = [
+                    e for e in installed.get(detector_entry_point_group, []) \
+                        if e.name == name
+                ]
+        except ImportError:
+            import pkg_resources
+            candidates = list(pkg_resources.iter_entry_points(
+                detector_entry_point_group, name
+            ))
+
+        if not candidates:
+            raise ValueError("Unknown detector: " + name)
+        cls = candidates[0].load()
+
+    return cls(**kwargs)
+
+
+class DetectorScheduler(object):
+    """Runs the detectors of an assassin when they are due, in the order 
+    they were given, and measures the cpu time they take."""
+
+    def __init__(self, detectors, tick):
+        """Args:
+            detectors: list of Detectors.
+            tick: the longest time (in s) the assassin sleeps between two 
+                wake ups.
+        """
+        self.detectors = list(detectors)
+        self.tick = tick
+
+        # the detector that returned the last verdict other than running
+        self.last_detector = None
+
+    def reset(self, time_now):
+        for detector in self.detectors:
+            detector.reset(time_now)
+
+    def sleep_time(self, assassin, time_now):
+        """How long to sleep until the next detector is due"""
+
+        sleep_time = self.tick
+        for detector in self.detectors:
+            time_until_due = detector.time_until_due(assassin, time_now)
+            if not time_until_due is None:
+                sleep_time = min(sleep_time, max(0, time_until_due))
+        return sleep_time
+
+    def run(self, detector, assassin):
+        """Run one detector and return its verdict"""
+
+        cpu_time_start = time.process_time()
+        try:
+            verdict = detector.check(assassin) or Verdict.running()
+        except DeadCalculation as ex:
+            verdict = Verdict("dead", ex)
+        finally:
+            cost = time.process_time() - cpu_time_start
+
+            detector.n_runs += 1
+            detector.cpu_time += cost
+            detector.mean_cost = cost if detector.n_runs == 1 \
+                else 0.8 * detector.mean_cost + 0.2 * cost
+            detector.time_last_run = assassin.time_now()
+
+        return verdict
+
+    def run_due(self, assassin):
+        """Run all detectors that are due. Returns the first verdict other 
+        than running (the remaining detectors are skipped then)."""
+
+        for detector in self.detectors:
+            if detector.is_due(assassin, assassin.time_now()):
+                verdict = self.run(detector, assassin)
+                if verdict.state != "running":
+                    self.last_detector = detector
+                    return verdict
+
+        return Verdict.running()
+
+
+@register_detector
+class ProcessHandleDetector(Detector):
+    """Checks whether the calculation process has ended (at every wake up 
+    of the assassin)"""
+
+    name = "process_handle"
+
+    def check(self, assassin):
+        if assassin.check_process_handle():
+            return Verdict.finished()
+
+
+@register_detector
+class OutfileDetector(Detector):
+    """Polls the outfiles for the end of calculation string, crashes and 
+    timeouts (see SlurmAssassin.poll_outfiles). When it is due is decided 
+    by the assassin's PollScheduler."""
+
+    name = "outfiles"
+
+    def time_until_due(self, assassin, time_now):
+        if assassin._poll_scheduler.staggered:
+            return assassin._poll_scheduler.time_until_due(
+                time_now, self.time_last_run
+            )
+        return None
+
+    def is_due(self, assassin, time_now):
+        return assassin._poll_scheduler.is_due(time_now, self.time_last_run)
+
+    def check(self, assassin):
+
+        if not assassin._profiler is None:
+            assassin._profiler.begin_cycle()
+
+        time_poll_start = time.perf_counter()
+        try:
+            finished = assassin.poll_outfiles()
+        finally:
+            assassin.last_poll_duration = \
+                time.perf_counter() - time_poll_start
+
+            if not assassin._profiler is None:
+                assassin._profiler.end_cycle()
+
+            if not assassin._metrics_exporter is None:
+                assassin._metrics_exporter.update(assassin)
+
+            assassin.emit_event(
+                "poll", 
+                self.name,
+                seconds_since_last_update=assassin.time_now() - \
+                    assassin.time_last_update_out,
+                outfile_bytes=sum(assassin.outfile_sizes.values()),
+                iterations=assassin.n_iterations,
+                poll_duration=assassin.last_poll_duration
+            )
+
+            assassin.publish_status("watching")
+
+        if finished:
+            return Verdict.finished()
+
+        assassin._poll_scheduler.polled()
+
+        if not assassin._trace_recorder is None:
+            assassin._trace_recorder.flush()
+
+        assassin.save_state()
+
+
+@register_detector
+class IdleCpuDetector(Detector):
+    """Considers a calculation dead if its processes used (almost) no cpu 
+    time for longer than duration, e.g. because its ranks wait for each 
+    other in a deadlock. Walking the process tree is comparably expensive,
+    so it runs rarely."""
+
+    name = "cpu_idle"
+    period = 60
+    cpu_budget = 0.01
+
+    def __init__(self, 
+        duration=1800, 
+        min_cpu_fraction=0.05, 
+        period=None, 
+        cpu_budget=None
+    ):
+        """Args:
+            duration: how long (in s) the calculation must have been idle.
+            min_cpu_fraction: the fraction of a core below which the 
+                calculation counts as idle.
+        """
+        super(IdleCpuDetector, self).__init__(period, cpu_budget)
+        self.duration = duration
+        self.min_cpu_fraction = min_cpu_fraction
+
+        # (time, cpu time) samples, spanning just over duration
+        self._samples = deque()
+
+    def check(self, assassin):
+
+        sample = assassin.sample_resources()
+        if sample is None:
+            return None
+
+        time_now = assassin.time_now()
+        self._samples.append((time_now, sample.cpu_time))
+        while len(self._samples) > 2 and \
+            time_now - self._samples[1][0] >= self.duration:
+            self._samples.popleft()
+
+        time_first, cpu_time_first = self._samples[0]
+        if time_now - time_first < self.duration:
+            return None
+
+        cpu_fraction = (sample.cpu_time - cpu_time_first) / \
+            (time_now - time_first)
+        if cpu_fraction < self.min_cpu_fraction:
+            return Verdict.dead(
+                CalculationIdle,
+                "The calculation used {0:.1%} of a core in the last {1:.0f}"\
+                " minutes.".format(cpu_fraction, (time_now - time_first) / 60)
+            )
+
+
+# the detector of the node agents is built in as well, it registers itself
+# when its module is imported (which needs the classes above)
+import assassin_agents
@@ -0,0 +1,281 @@
+"""This module contains the kill coordinator of the slurm assassin, which
+collapses the kill requests of many assassins (see SlurmAssassin in
+assassin.py, or the assassin's --kill-batching option) into few scancel
+calls, so slurmctld is not hammered when a whole file system stalls.
+"""
+
+import subprocess as sp
+import os
+import fcntl
+import stat
+
+from assassin import Logger, Clock
+
+
+class KillCoordinator(object):
+    """Collapses the kill requests of many assassins into few scancel calls.
+
+    When a whole file system stalls, every assassin on it decides to kill 
+    its job at about the same time and slurmctld would be hammered by 
+    thousands of scancel calls. Instead, every assassin drops its kill 
+    request into a spool directory and tries to take a lock on it. The 
+    assassin that gets the lock becomes the leader: it waits a short batch
+    window for more requests, then cancels all requested jobs with batched 
+    scancel calls (array tasks are collapsed into e.g. 1234_[1-3,7]), no 
+    more often than every min_interval seconds, and retries calls that 
+    fail because the controller is not reachable. The leader cancels its 
+    own job last. The other assassins wait until their request has been 
+    handled; if the leader dies, one of them takes over.
+
+    The spool directory should be node-local unless the file system it is 
+    on supports flock across nodes. It must belong to the user and be 
+    accessible to nobody else (mode 0700), and only requests written by the
+    user are handled, so other users cannot plant kill requests for the 
+    user's jobs.
+    """
+
+    # messages of scancel that indicate a busy or unreachable controller
+    transient_errors = [
+        "timed out",
+        "Unable to contact slurm controller",
+        "Slurm backup controller in standby mode",
+        "Resource temporarily unavailable",
+        "Zero Bytes were transmitted or received",
+        "Connection refused"
+    ]
+
+    _logger = Logger
+
+    def __init__(self,
+        spool_directory,
+        scancel_command=["scancel"],
+        batch_window=2.0,
+        max_batch=500,
+        min_interval=1.0,
+        retries=5,
+        backoff=2.0,
+        wait_timeout=600,
+        clock=None
+    ):
+        """Args:
+            spool_directory: directory of the kill requests and the lock 
+                (created with mode 0700 if it does not exist). A 
+                PermissionError is raised if it belongs to somebody else or
+                is accessible to others.
+            scancel_command: the command used to cancel jobs (the job ids 
+                are appended).
+            batch_window: time (in s) the leader waits for more requests
+                before the first scancel.
+            max_batch: maximum number of jobs cancelled by one scancel.
+            min_interval: minimum time (in s) between two scancel calls.
+            retries: number of retries of a scancel that failed because 
+                the controller was not reachable.
+            backoff: the wait before the n-th retry is 
+                min_interval * backoff**n.
+            wait_timeout: time (in s) after which an assassin whose request
+                was not handled cancels its job itself.
+            clock: used for waiting (wall time if None).
+        """
+
+        self.spool_directory = spool_directory
+        self.scancel_command = list(scancel_command)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.wait_timeout = wait_timeout
+        self._clock = Clock() if clock is None else clock
+
+        self._time_last_call = None
+        self.n_calls = 0
+
+        os.makedirs(spool_directory, mode=0o700, exist_ok=True)
+
+        info = os.lstat(spool_directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            stat.S_IMODE(info.st_mode) != 0o700:
+            raise PermissionError(
+                "Kill spool " + spool_directory + " must be a directory " + \
+                    "of the user with mode 0700."
+            )
+
+    @staticmethod
+    def default_spool_directory():
+        """The user's runtime directory if there is one, otherwise a
+        directory in /tmp"""
+
+        if "XDG_RUNTIME_DIR" in os.environ:
+            return os.path.join(
+                os.environ["XDG_RUNTIME_DIR"], "slurm_assassin_kills"
+            )
+        return "/tmp/slurm_assassin_kills.{0}".format(os.getuid())
+
+    def log(self, msg, level=0):
+        self._logger.log(msg="[Kill] " + msg, level=level)
+
+    def _request_path(self, target):
+        return os.path.join(self.spool_directory, str(target) + ".kill")
+
+    def enqueue(self, target):
+        """Drop a kill request for target (a job id or array_job_task)"""
+
+        path = self._request_path(target)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(os.getpid()))
+        os.replace(path + ".tmp", path)
+
+    def pending(self):
+        """All targets whose kill was requested (by the user), but not yet 
+        done"""
+
+        targets = []
+        for name in os.listdir(self.spool_directory):
+            if not name.endswith(".kill"):
+                continue
+
+            try:
+                owner = os.lstat(
+                    os.path.join(self.spool_directory, name)
+                ).st_uid
+            except FileNotFoundError:
+                continue
+
+            if owner != os.getuid():
+                self.log("Ignoring kill request " + name + " of user " + \
+                    str(owner) + ".", 2)
+                continue
+
+            targets.append(name[:-len(".kill")])
+
+        return sorted(targets)
+
+    def _done(self, targets):
+        for target in targets:
+            try:
+                os.remove(self._request_path(target))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def collapse(targets):
+        """The arguments for scancel that cancel all targets: tasks of the 
+        same array job are merged, e.g. 1234_1, 1234_2, 1234_3 and 1234_7 
+        become 1234_[1-3,7]."""
+
+        tasks, arguments = {}, []
+        for target in targets:
+            job, _, task = str(target).partition("_")
+            if task.isdigit():
+                tasks.setdefault(job, []).append(int(task))
+            else:
+                arguments.append(str(target))
+
+        for job in sorted(tasks):
+
+            ranges = []
+            for task in sorted(set(tasks[job])):
+                if ranges and task == ranges[-1][1] + 1:
+                    ranges[-1][1] = task
+                else:
+                    ranges.append([task, task])
+
+            if len(ranges) == 1 and ranges[0][0] == ranges[0][1]:
+                arguments.append(job + "_" + str(ranges[0][0]))
+            else:
+                arguments.append(job + "_[" + ",".join(
+                    str(a) if a == b else "{0}-{1}".format(a, b) \
+                        for a, b in ranges
+                ) + "]")
+
+        return arguments
+
+    def scancel(self, targets):
+        """Cancel targets with one scancel call (retried if the controller
+        is not reachable). Returns whether it succeeded."""
+
+        arguments = self.collapse(targets)
+
+        for attempt in range(self.retries + 1):
+
+            # rate limit
+            wait = self.min_interval * self.backoff ** attempt \
+                if attempt else self.min_interval
+            if not self._time_last_call is None:
+                remaining = self._time_last_call + wait - self._clock.time_now()
+                if remaining > 0:
+                    self._clock.sleep(remaining)
+
+            self.log("Running " + " ".join(self.scancel_command + arguments))
+            self._time_last_call = self._clock.time_now()
+            self.n_calls += 1
+
+            result = sp.run(
+                self.scancel_command + arguments,
+                stdout=sp.PIPE,
+                stderr=sp.PIPE
+            )
+            if result.returncode == 0:
+                return True
+
+            message = result.stderr.decode(errors="replace").strip()
+            if not any(e in message for e in self.transient_errors):
+                # e.g. jobs that have ended already
+                self.log("scancel failed: " + message, 2)
+                return False
+
+            self.log("scancel failed (attempt {0}): {1}".format(
+                attempt + 1, message
+            ), 2)
+
+        self.log("Giving up on cancelling " + " ".join(arguments), 3)
+        return False
+
+    def _lead(self, own_target):
+        """Cancel all pending targets, own_target last"""
+
+        self._clock.sleep(self.batch_window)
+
+        while True:
+
+            pending = self.pending()
+            others = [t for t in pending if t != str(own_target)]
+
+            if not others:
+                if str(own_target) in pending:
+                    self._done([own_target])
+                    self.scancel([own_target])
+                return
+
+            for i in range(0, len(others), self.max_batch):
+                batch = others[i:i + self.max_batch]
+                self.scancel(batch)
+                self._done(batch)
+
+    def request(self, target):
+        """Request the kill of target and wait until it is done (if the 
+        calling assassin runs in the job, this will not return)."""
+
+        self.enqueue(target)
+
+        time_deadline = self._clock.time_now() + self.wait_timeout
+        with open(os.path.join(self.spool_directory, "lock"), "a") as lock:
+
+            while os.path.exists(self._request_path(target)):
+
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    # somebody else is the leader
+                    if self._clock.time_now() > time_deadline:
+                        self.log("Kill request was not handled in time.", 2)
+                        self._done([target])
+                        self.scancel([target])
+                        return
+                    self._clock.sleep(0.5)
+                    continue
+
+                try:
+                    self._lead(target)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""This script simulates the assassins of an array job that are all started
+within a second and measures how evenly their file system operations
+(stat/open/glob, i.e. requests to the metadata servers) are spread over
+time, once with plain polling and once with staggered polling (see
+PollScheduler in assassin.py).
+
+Every assassin runs on a virtual clock (see tests/simulation.py), so hours
+of job time pass in milliseconds. The calculations write output for a
+while and then stall, so the detection latency of the staggered assassins
+can be checked against the bound timeout + polling_period * (1 + jitter).
+
+For each schedule it is reported:
+ - peak, 99th percentile and mean number of file system operations per
+   second (over the seconds in which there were any),
+ - the maximum detection latency of the stalls and its bound.
+
+Example:
+    python benchmarks/load_spread.py -n 1000 --jitter 0.1
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+
+from collections import Counter, OrderedDict
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root_path)
+sys.path.insert(0, os.path.join(root_path, "tests"))
+
+from assassin import SlurmAssassin, Logger, PollScheduler
+from assassin import CalculationTimeout
+
+from simulation import Simulation, VirtualFileSystem
+
+
+class QuietAssassin(SlurmAssassin):
+    """Does not write a log file"""
+
+    class _logger(Logger):
+        @classmethod
+        def log(cls, msg, level=0):
+            pass
+
+
+class RecordingFileSystem(VirtualFileSystem):
+    """Records the (virtual) times of all file system operations"""
+
+    def __init__(self, clock, times):
+        super(RecordingFileSystem, self).__init__(clock)
+        self._times = times
+
+    def stat(self, path):
+        self._times.append(self._clock.time_now())
+        return super(RecordingFileSystem, self).stat(path)
+
+    def open(self, path, mode="r"):
+        self._times.append(self._clock.time_now())
+        return super(RecordingFileSystem, self).open(path, mode)
+
+    def glob(self, pattern):
+        self._times.append(self._clock.time_now())
+        return super(RecordingFileSystem, self).glob(pattern)
+
+
+def run(args, staggered):
+    """Simulate args.n assassins, returns the times of all file system
+    operations and the detection latencies"""
+
+    rng = random.Random(args.seed)
+
+    times, latencies = [], []
+    for task in range(args.n):
+
+        # all tasks start within start_spread seconds
+        simulation = Simulation(start=1.5e9 + rng.uniform(0, args.start_spread))
+        simulation.file_system = RecordingFileSystem(simulation.clock, times)
+
+        if staggered:
+            poll_scheduler = PollScheduler.for_job(
+                args.polling_period * 60,
+                "{0}_{1}".format(args.array_job_id, task),
+                array_job_id=args.array_job_id,
+                array_task_id=task,
+                jitter=args.jitter
+            )
+        else:
+            poll_scheduler = None
+
+        assassin = simulation.make_assassin(
+            QuietAssassin,
+            timeout=args.timeout,
+            polling_period=args.polling_period,
+            out_file_name="calc.out",
+            poll_scheduler=poll_scheduler
+        )
+
+        n_writes = rng.randint(1, int(args.duration * 60 / args.write_period))
+        simulation.launch(
+            assassin,
+            Simulation.writes_then_stalls(
+                "calc.out", n_writes, args.write_period, 10 * args.timeout * 60
+            )
+        )
+
+        try:
+            assassin._lurk()
+        except CalculationTimeout:
+            time_stall = assassin.time_calculation_start + \
+                (n_writes - 1) * args.write_period
+            latencies.append(simulation.clock.time_now() - time_stall)
+
+    return times, latencies
+
+
+def summarize(times, latencies, args, staggered):
+
+    per_second = sorted(Counter(int(t) for t in times).values())
+
+    jitter = args.jitter if staggered else 0
+    bound = args.timeout * 60 + args.polling_period * 60 * (1 + jitter) + \
+        2 * min(30, args.polling_period * 6)
+
+    return OrderedDict([
+        ("schedule", "staggered" if staggered else "plain"),
+        ("operations", len(times)),
+        ("peak_ops_per_second", per_second[-1]),
+        ("p99_ops_per_second", per_second[int(0.99 * (len(per_second) - 1))]),
+        ("mean_ops_per_second", len(times) / float(len(per_second))),
+        ("stalls_detected", len(latencies)),
+        ("max_latency", max(latencies) if latencies else None),
+        ("latency_bound", bound)
+    ])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="load_spread.py",
+        description="Simulates the assassins of an array job and reports " + \
+            "how their file system operations are spread over time."
+    )
+    parser.add_argument('-n', help="Number of assassins.",
+        default=500, type=int, dest="n")
+    parser.add_argument('-T', '--time-out', help="Timeout in minutes.",
+        default=30, type=float, dest="timeout")
+    parser.add_argument('-p', '--polling', help="Polling period in minutes.",
+        default=5, type=float, dest="polling_period")
+    parser.add_argument('--jitter', help="Jitter of the staggered polls.",
+        default=0.1, type=float, dest="jitter")
+    parser.add_argument('--start-spread',
+        help="The assassins start within this many seconds.",
+        default=1.0, type=float, dest="start_spread")
+    parser.add_argument('--duration',
+        help="Maximum time (in minutes) the calculations write output.",
+        default=120, type=float, dest="duration")
+    parser.add_argument('--write-period',
+        help="Time between two writes of a calculation (in s).",
+        default=60, type=float, dest="write_period")
+    parser.add_argument('--array-job-id', default="75129", dest="array_job_id",
+        help=argparse.SUPPRESS)
+    parser.add_argument('--seed', default=0, type=int, dest="seed",
+        help=argparse.SUPPRESS)
+    parser.add_argument('--json', help="Print the results as json.",
+        action="store_true", dest="json")
+
+    args = parser.parse_args()
+
+    results = []
+    for staggered in (False, True):
+        times, latencies = run(args, staggered)
+        results.append(summarize(times, latencies, args, staggered))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            print("{0:>9}: peak {1:>5} ops/s, p99 {2:>5} ops/s, mean " \
+                "{3:>6.1f} ops/s, max latency {4:.0f} s (bound {5:.0f} s)".format(
+                r["schedule"], r["peak_ops_per_second"],
+                r["p99_ops_per_second"], r["mean_ops_per_second"],
+                r["max_latency"], r["latency_bound"]
+            ))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""This script measures whether capturing the output of a calculation 
+through the assassin (see OutputPump in assassin.py, or the assassin's 
+--capture-output option) slows the calculation down. 
+
+A child process writes size MB to its stdout (as fast as it can or at a
+given rate), once 
+redirected to a file directly (like a shell redirection) and once piped 
+through the assassin, which checks the captured output every poll_period 
+seconds meanwhile. For both it is reported how long the child took and 
+its throughput in MB/s.
+
+The script fails (exit code 1) if the captured child is slower than 
+min_ratio times the direct one, or if it wrote less than min_rate MB/s:
+
+    python benchmarks/pipe_throughput.py -s 2000 -r 500 --min-rate 490
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess as sp
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root_path)
+
+from assassin import SlurmAssassin, Logger
+
+
+class QuietAssassin(SlurmAssassin):
+    """Does not write a log file"""
+
+    class _logger(Logger):
+        @classmethod
+        def log(cls, msg, level=0):
+            pass
+
+
+def writer(size, rate):
+    """Command of a child that writes size MB (in lines) to stdout, at 
+    most rate MB/s (0: as fast as it can)"""
+    return [
+        sys.executable, "-c",
+        "import sys, time\n"
+        "block = b'  | Total energy : -2078.836574830 Ha\\n' * 28000\n"
+        "time_start = time.perf_counter()\n"
+        "for i in range(int({0} * 2**20 / len(block))):\n"
+        "    sys.stdout.buffer.write(block)\n"
+        "    ahead = (i + 1) * len(block) / ({1} * 2**20 or 1e300) - \\\n"
+        "        (time.perf_counter() - time_start)\n"
+        "    if ahead > 0:\n"
+        "        sys.stdout.buffer.flush()\n"
+        "        time.sleep(ahead)\n"
+        "sys.stdout.buffer.write(b'Have a nice day\\n')\n".format(size, rate)
+    ]
+
+
+def run_direct(folder, args):
+    """Time of the child writing directly to a file"""
+
+    outfile = os.path.join(folder, "direct.out")
+    time_start = time.perf_counter()
+    with open(outfile, "wb") as f:
+        sp.check_call(writer(args.size, args.rate), stdout=f)
+    return time.perf_counter() - time_start, os.path.getsize(outfile)
+
+
+def run_captured(folder, args):
+    """Time of the child writing through the assassin"""
+
+    outfile = os.path.join(folder, "captured.out")
+    assassin = QuietAssassin(
+        out_file_name=outfile,
+        err_file_name=None,
+        capture_output=True
+    )
+
+    time_start = time.perf_counter()
+    assassin.start_calculation_process(writer(args.size, args.rate))
+
+    # the end of the child is noticed within 10 ms, the output is checked
+    # every poll_period
+    finished = False
+    process = assassin._calculation_process
+    time_check = time_start
+    while process.poll() is None:
+        time.sleep(0.01)
+        if time.perf_counter() - time_check >= args.poll_period:
+            finished = assassin.is_calculation_finished() or finished
+            time_check = time.perf_counter()
+    time_child = time.perf_counter() - time_start
+
+    assassin._pumps[outfile].wait()
+    finished = assassin.is_calculation_finished() or finished
+
+    return time_child, os.path.getsize(outfile), finished, \
+        assassin._pumps[outfile].n_skipped
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="pipe_throughput.py",
+        description="Measures how fast a calculation can write through " + \
+            "the assassin's output capture."
+    )
+    parser.add_argument('-s', '--size', help="MB written by the child.",
+        default=1000, type=float, dest="size")
+    parser.add_argument('-r', '--rate', 
+        help="Maximum rate the child writes at in MB/s (default 0, i.e. " + \
+            "as fast as it can).",
+        default=0, type=float, dest="rate")
+    parser.add_argument('--poll-period', 
+        help="Time between two checks of the output (in s).",
+        default=1, type=float, dest="poll_period")
+    parser.add_argument('--min-ratio',
+        help="Minimum throughput relative to writing directly (default 0.8).",
+        default=0.8, type=float, dest="min_ratio")
+    parser.add_argument('--min-rate',
+        help="Minimum throughput in MB/s (default 0, i.e. not checked).",
+        default=0, type=float, dest="min_rate")
+    parser.add_argument('--json', help="Print the results as json.",
+        action="store_true", dest="json")
+
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="assassin_pipe_")
+    try:
+        time_direct, size_direct = run_direct(folder, args)
+        time_captured, size_captured, finished, skipped = \
+            run_captured(folder, args)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    rate_direct = size_direct / 2**20 / time_direct
+    rate_captured = size_captured / 2**20 / time_captured
+
+    results = {
+        "size": size_captured,
+        "rate_direct": rate_direct,
+        "rate_captured": rate_captured,
+        "ratio": rate_captured / rate_direct,
+        "finish_detected": finished,
+        "bytes_not_checked": skipped,
+        "complete": size_captured == size_direct
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("direct: {0:.0f} MB/s, captured: {1:.0f} MB/s ({2:.0%}), " \
+            "finish detected: {3}, {4} bytes not checked".format(
+            rate_direct, rate_captured, results["ratio"], finished, skipped
+        ))
+
+    sys.exit(0 if results["complete"] and finished and \
+        results["ratio"] >= args.min_ratio and \
+            rate_captured >= args.min_rate else 1)
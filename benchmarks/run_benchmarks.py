@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""This script benchmarks the slurm assassin on synthetic workloads (see
+utilities/dummy_*.py): large outfiles, thousands of outfiles matched by
+wildcards, bursty writers, stuck writers and crashing child processes.
+
+Every scenario is run once per mode of the assassin in a fresh python
+process, so the measured resources belong to this one run. For each run
+the following is measured:
+ - time to detect: time from the event (calculation got stuck, crashed or
+   finished) until the assassin noticed it,
+ - cpu time and context switches of the watchdog (via getrusage, the
+   workload itself is not included),
+ - file system operations of the assassin (stat/open/glob) and read/write
+   syscalls (from /proc/self/io, Linux only),
+ - peak resident memory of the watchdog.
+
+The results are stored as json, so they can be compared across commits:
+
+    python benchmarks/run_benchmarks.py -o before.json
+    ... (change something)
+    python benchmarks/run_benchmarks.py -o after.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+
+For outputs of GB size use e.g. --large-output-size 2000000000.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess as sp
+
+from collections import defaultdict, OrderedDict
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+utilities_path = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "utilities"
+)
+
+sys.path.insert(0, root_path)
+
+from assassin import SlurmAssassin, Logger, FileSystem
+from assassin import CalculationCrashed, CalculationTimeout
+
+
+class CountingFileSystem(FileSystem):
+    """Counts the file system operations of the assassin"""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def stat(self, path):
+        self.counts["stat"] += 1
+        return super(CountingFileSystem, self).stat(path)
+
+    def open(self, path, mode="r"):
+        self.counts["open"] += 1
+        return super(CountingFileSystem, self).open(path, mode)
+
+    def glob(self, pattern):
+        self.counts["glob"] += 1
+        return super(CountingFileSystem, self).glob(pattern)
+
+
+def read_proc_io():
+    """IO counters of this process (empty if not available)"""
+    try:
+        with open("/proc/self/io") as f:
+            return dict(
+                (key, int(value)) for key, value in \
+                    (line.split(":") for line in f if ":" in line)
+            )
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def dummy(name):
+    return [sys.executable, os.path.join(utilities_path, name)]
+
+
+#--- scenarios ---
+# Every scenario returns the command of the workload and the settings for
+# the assassin (timeout and polling period in s) for a temporary folder.
+
+def scenario_stuck_writer(folder, args):
+    outfile = os.path.join(folder, "calc.out")
+    return {
+        "command": dummy("dummy_stuck_writer.py") + ["-o", outfile],
+        "out_file_name": outfile,
+        "timeout": 2,
+        "polling_period": 0.5,
+        "expected": "timeout"
+    }
+
+def scenario_bursty_writer(folder, args):
+    outfile = os.path.join(folder, "calc.out")
+    return {
+        "command": dummy("dummy_bursty_writer.py") + ["-o", outfile],
+        "out_file_name": outfile,
+        "timeout": 2,
+        "polling_period": 0.5,
+        "expected": "finished"
+    }
+
+def scenario_large_output(folder, args):
+    outfile = os.path.join(folder, "calc.out")
+    return {
+        "command": dummy("dummy_large_output.py") + [
+            "-o", outfile, "-s", str(args.large_output_size)
+        ],
+        "out_file_name": outfile,
+        "timeout": 60,
+        "polling_period": 0.5,
+        "expected": "finished"
+    }
+
+def scenario_many_outfiles(folder, args):
+    return {
+        "command": dummy("dummy_many_outfiles.py") + [
+            "-o", folder, "-n", str(args.n_outfiles)
+        ],
+        "out_file_name": [
+            os.path.join(folder, "0", "rank_0.out"),
+            os.path.join(folder, "*", "rank_*.out")
+        ],
+        "timeout": 2,
+        "polling_period": 0.5,
+        "expected": "timeout"
+    }
+
+def scenario_crashing_child(folder, args):
+    outfile = os.path.join(folder, "calc.out")
+    return {
+        "command": dummy("dummy_crashing_child.py") + ["-o", outfile],
+        "out_file_name": outfile,
+        "timeout": 60,
+        "polling_period": 0.5,
+        "expected": "crashed"
+    }
+
+scenarios = OrderedDict([
+    ("stuck_writer", scenario_stuck_writer),
+    ("bursty_writer", scenario_bursty_writer),
+    ("large_output", scenario_large_output),
+    ("many_outfiles", scenario_many_outfiles),
+    ("crashing_child", scenario_crashing_child)
+])
+#---
+
+#--- modes ---
+# Every mode returns additional keyword arguments for the assassin.
+modes = OrderedDict([
+    ("default", lambda folder: {}),
+    ("trace", lambda folder: {
+        "trace_file": os.path.join(folder, "assassin.trace")
+    })
+])
+#---
+
+
+def run_one(scenario, mode, args):
+    """Run a single benchmark in this process and return the results"""
+
+    folder = tempfile.mkdtemp(prefix="assassin_benchmark_")
+    Logger.name_of_logfile = os.path.join(folder, "assassin.log")
+
+    try:
+        spec = scenarios[scenario](folder, args)
+        event_file = os.path.join(folder, "event")
+
+        file_system = CountingFileSystem()
+        assassin = SlurmAssassin(
+            timeout=spec["timeout"] / 60.0,
+            polling_period=spec["polling_period"] / 60.0,
+            out_file_name=spec["out_file_name"],
+            file_system=file_system,
+            **modes[mode](folder)
+        )
+
+        with open(os.devnull, "w") as fnull:
+            assassin.start_calculation_process(
+                spec["command"] + ["-e", event_file],
+                stdout=fnull,
+                stderr=fnull
+            )
+
+        #--- lurk and measure ---
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        io_before = read_proc_io()
+
+        try:
+            assassin._lurk()
+            outcome = "finished"
+        except CalculationTimeout:
+            outcome = "timeout"
+        except CalculationCrashed:
+            outcome = "crashed"
+
+        time_detected = time.time()
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        io_after = read_proc_io()
+        #---
+
+        process = assassin._calculation_process
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+        try:
+            with open(event_file) as f:
+                time_to_detect = time_detected - float(f.read())
+        except (IOError, ValueError):
+            time_to_detect = None
+
+        return OrderedDict([
+            ("scenario", scenario),
+            ("mode", mode),
+            ("expected", spec["expected"]),
+            ("outcome", outcome),
+            ("correct", outcome == spec["expected"]),
+            ("timeout", spec["timeout"]),
+            ("polling_period", spec["polling_period"]),
+            ("time_to_detect", time_to_detect),
+            ("cpu_user", usage_after.ru_utime - usage_before.ru_utime),
+            ("cpu_system", usage_after.ru_stime - usage_before.ru_stime),
+            ("context_switches_voluntary",
+                usage_after.ru_nvcsw - usage_before.ru_nvcsw),
+            ("context_switches_involuntary",
+                usage_after.ru_nivcsw - usage_before.ru_nivcsw),
+            ("file_system_operations", dict(file_system.counts)),
+            ("syscalls_read",
+                io_after.get("syscr", 0) - io_before.get("syscr", 0)),
+            ("syscalls_write",
+                io_after.get("syscw", 0) - io_before.get("syscw", 0)),
+            ("bytes_read", io_after.get("rchar", 0) - io_before.get("rchar", 0)),
+            # kilobytes on Linux
+            ("peak_rss", usage_after.ru_maxrss)
+        ])
+
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return sp.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=root_path,
+            stderr=sp.DEVNULL
+        ).decode().strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def run_all(args):
+    """Run every selected benchmark in a separate python process"""
+
+    results = []
+    for scenario in scenarios:
+        if args.only and not scenario in args.only:
+            continue
+
+        for mode in modes:
+
+            print("Running " + scenario + " (" + mode + ") ...", file=sys.stderr)
+
+            output = sp.check_output(
+                [sys.executable, os.path.realpath(__file__),
+                    "--run-one", scenario, mode,
+                    "--large-output-size", str(args.large_output_size),
+                    "--n-outfiles", str(args.n_outfiles)
+                ]
+            )
+            results.append(json.loads(output.decode()))
+
+    return OrderedDict([
+        ("commit", git_commit()),
+        ("date", time.strftime("%Y-%m-%d, %H:%M:%S")),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("results", results)
+    ])
+
+
+compared_metrics = [
+    "time_to_detect",
+    "cpu_user",
+    "cpu_system",
+    "syscalls_read",
+    "bytes_read",
+    "peak_rss"
+]
+
+def compare(path_old, path_new, tolerance):
+    """Print the relative change of the metrics between two result files.
+    Returns the number of metrics that got worse by more than tolerance."""
+
+    with open(path_old) as f:
+        old = json.load(f)
+    with open(path_new) as f:
+        new = json.load(f)
+
+    old_results = dict(
+        ((r["scenario"], r["mode"]), r) for r in old["results"]
+    )
+
+    print("Comparing {0} with {1}".format(old.get("commit"), new.get("commit")))
+
+    regressions = 0
+    for result in new["results"]:
+        key = (result["scenario"], result["mode"])
+        if not key in old_results:
+            continue
+
+        for metric in compared_metrics:
+            before, after = old_results[key][metric], result[metric]
+            if not before or after is None:
+                continue
+
+            change = (after - before) / float(before)
+            marker = ""
+            if change > tolerance:
+                marker = "  <-- regression"
+                regressions += 1
+
+            print("{0:>16} {1:>8} {2:>16}: {3:>12.4g} -> {4:>12.4g} ({5:+.0%}){6}".format(
+                key[0], key[1], metric, before, after, change, marker
+            ))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="run_benchmarks.py",
+        description="Benchmarks detection latency and overhead of the " + \
+            "slurm assassin on synthetic workloads."
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        help="The json file the results are written to.",
+        default="benchmark_results.json",
+        dest="output"
+    )
+    parser.add_argument(
+        '--only',
+        help="Only run the given scenarios. Available: " + \
+            ", ".join(scenarios),
+        nargs="+",
+        default=None,
+        dest="only"
+    )
+    parser.add_argument(
+        '--large-output-size',
+        help="Size of the outfile in the large_output scenario in bytes.",
+        default=100 * 1024**2,
+        type=int,
+        dest="large_output_size"
+    )
+    parser.add_argument(
+        '--n-outfiles',
+        help="Number of outfiles in the many_outfiles scenario.",
+        default=2000,
+        type=int,
+        dest="n_outfiles"
+    )
+    parser.add_argument(
+        '--compare',
+        help="Compare two result files instead of running benchmarks.",
+        nargs=2,
+        metavar=("old", "new"),
+        default=None,
+        dest="compare"
+    )
+    parser.add_argument(
+        '--tolerance',
+        help="Relative change above which a metric is counted as " + \
+            "regression in comparisons (default 0.2).",
+        default=0.2,
+        type=float,
+        dest="tolerance"
+    )
+    parser.add_argument(
+        '--run-one',
+        help=argparse.SUPPRESS,
+        nargs=2,
+        default=None,
+        dest="run_one"
+    )
+
+    args = parser.parse_args()
+
+    if not args.run_one is None:
+        print(json.dumps(run_one(args.run_one[0], args.run_one[1], args)))
+
+    elif not args.compare is None:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.tolerance) else 0)
+
+    else:
+        results = run_all(args)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+        for r in results["results"]:
+            print("{0:>16} {1:>8}: {2:>9} (expected {3:>9}), detected " \
+                "after {4:.2f} s, cpu {5:.3f} s, peak rss {6} kB".format(
+                r["scenario"], r["mode"], r["outcome"], r["expected"],
+                r["time_to_detect"] or float("nan"),
+                r["cpu_user"] + r["cpu_system"], r["peak_rss"]
+            ))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""This script measures how long it takes to import the assassin and parse
+its command line, i.e. how long the watchdog delays the start of the 
+calculation. When thousands of
+array tasks start at once on a shared file system, every module imported
+before the calculation is launched adds to a storm of metadata requests,
+so the startup path should only use a few modules of the standard library.
+
+The import is measured with python -X importtime in fresh interpreters
+(the assassin is byte compiled beforehand, so compilation is not counted).
+It is reported
+ - the median time to import the assassin (including the modules it
+   imports) over several runs,
+ - the modules imported on the way that the interpreter itself does not
+   load at startup.
+
+The script fails (exit code 1) if the median exceeds the budget or if a
+module is imported (on import or while the command line is parsed) that 
+must not be on the startup path (e.g. numpy or argparse):
+
+    python benchmarks/startup_time.py --budget 60
+"""
+
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import tempfile
+import py_compile
+import subprocess as sp
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# a typical command line of the watchdog
+startup_statement = "import assassin; assassin.build_parser().parse_args(" + \
+    "['-c', 'mpirun', 'aims.x', '-T', '30', '-e', 'me@test.test'])"
+
+# modules that are only needed for mails, help and errors of the command 
+# line or analyses
+forbidden_modules = [
+    "numpy", "scipy", "smtplib", "email", "argparse", "ssl"
+]
+
+
+def import_times(folder, statement):
+    """Import times (in microseconds) of all modules loaded by statement in
+    a fresh interpreter, as dict module name -> cumulative time, and the 
+    names of the modules imported by statement itself (not by another 
+    module)."""
+
+    output = sp.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=folder,
+        env=dict(os.environ, PYTHONPATH=folder),
+        stdout=sp.DEVNULL,
+        stderr=sp.PIPE,
+        check=True
+    ).stderr.decode()
+
+    times, top_level = {}, set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue # header line
+        if not name.startswith("  "):
+            top_level.add(name.strip())
+
+    return times, top_level
+
+
+def measure(repeats):
+    """Runs startup_statement repeats times, returns the median import time
+    of the assassin's modules (in ms) and the modules it loads additionally
+    to the interpreter."""
+
+    folder = tempfile.mkdtemp(prefix="assassin_startup_")
+    try:
+        own_modules = set()
+        for path in glob.glob(os.path.join(root_path, "assassin*.py")):
+            name = os.path.splitext(os.path.basename(path))[0]
+            shutil.copy(path, folder)
+            py_compile.compile(
+                os.path.join(folder, name + ".py"),
+                cfile=os.path.join(
+                    folder,
+                    "__pycache__",
+                    name + "." + sys.implementation.cache_tag + ".pyc"
+                )
+            )
+            own_modules.add(name)
+
+        baseline = set(import_times(folder, "pass")[0])
+
+        runs, modules = [], set()
+        for _ in range(repeats):
+            times, top_level = import_times(folder, startup_statement)
+            runs.append(sum(
+                times[name] for name in own_modules & top_level
+            ) / 1000.0)
+            modules |= set(times) - baseline
+
+        runs.sort()
+        return runs[len(runs) // 2], sorted(modules - own_modules)
+
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="startup_time.py",
+        description="Measures the time it takes to import the assassin " + \
+            "and fails if it exceeds a budget."
+    )
+    parser.add_argument('--budget',
+        help="Maximum median import time in ms (default 100).",
+        default=100, type=float, dest="budget")
+    parser.add_argument('-n', '--repeats',
+        help="Number of imports to measure (default 11).",
+        default=11, type=int, dest="repeats")
+    parser.add_argument('--json', help="Print the results as json.",
+        action="store_true", dest="json")
+
+    args = parser.parse_args()
+
+    median, modules = measure(args.repeats)
+    violations = sorted(set(
+        m.split(".")[0] for m in modules \
+            if m.split(".")[0] in forbidden_modules
+    ))
+
+    if args.json:
+        print(json.dumps({
+            "median_import_time": median,
+            "budget": args.budget,
+            "modules": modules,
+            "forbidden_modules": violations
+        }, indent=2))
+    else:
+        print("import assassin: {0:.1f} ms (budget {1:.1f} ms), {2} " \
+            "modules loaded".format(median, args.budget, len(modules)))
+        for module in violations:
+            print("  forbidden on the startup path: " + module)
+
+    sys.exit(1 if median > args.budget or violations else 0)
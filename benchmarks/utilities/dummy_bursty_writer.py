@@ -0,0 +1,44 @@
+"""This script is run as a dummy process that writes to an outfile in
+bursts (many lines at once, then a pause) and finally writes the end of
+calculation string. The time of the final write is stored in the event file.
+"""
+import os
+import time
+import argparse
+
+
+def main(outfile, event_file, n_bursts, burst_size, pause):
+
+    line = "Dummy process is bursting. " * 4 + os.linesep
+
+    with open(outfile, "a") as f:
+        for i in range(n_bursts):
+            f.write(line * burst_size)
+            f.flush()
+            time.sleep(pause)
+
+        f.write("Have a nice day." + os.linesep)
+        f.flush()
+
+    with open(event_file, "w") as f:
+        f.write(str(time.time()))
+
+    # calculation does not end by itself
+    time.sleep(3600)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="dummy_bursty_writer.py",
+        description="Dummy process that writes to a file in bursts."
+    )
+    parser.add_argument('-o', '--out-file', dest="outfile", required=True)
+    parser.add_argument('-e', '--event-file', dest="event_file", required=True)
+    parser.add_argument('-n', '--n-bursts', dest="n_bursts", type=int, default=5)
+    parser.add_argument('-s', '--burst-size', dest="burst_size", type=int, default=10000)
+    parser.add_argument('-p', '--pause', dest="pause", type=float, default=1)
+
+    args = parser.parse_args()
+    main(
+        args.outfile, args.event_file, args.n_bursts, args.burst_size, args.pause
+    )
@@ -0,0 +1,40 @@
+"""This script is run as a dummy process that writes to an outfile, starts a
+child process that crashes after a while and exits with the child's (bad)
+return code. The time of the crash is stored in the event file.
+"""
+import os
+import sys
+import time
+import subprocess
+import argparse
+
+
+def main(outfile, event_file, delay):
+
+    with open(outfile, "a") as f:
+        f.write("Dummy process is starting its child." + os.linesep)
+
+    child = subprocess.Popen([
+        sys.executable, 
+        "-c", 
+        "import time; time.sleep({0}); raise RuntimeError('crash')".format(delay)
+    ], stderr=subprocess.DEVNULL)
+    return_code = child.wait()
+
+    with open(event_file, "w") as f:
+        f.write(str(time.time()))
+
+    sys.exit(return_code)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="dummy_crashing_child.py",
+        description="Dummy process whose child crashes."
+    )
+    parser.add_argument('-o', '--out-file', dest="outfile", required=True)
+    parser.add_argument('-e', '--event-file', dest="event_file", required=True)
+    parser.add_argument('-d', '--delay', dest="delay", type=float, default=1)
+
+    args = parser.parse_args()
+    main(args.outfile, args.event_file, args.delay)
@@ -0,0 +1,46 @@
+"""This script is run as a dummy process that writes a large outfile as
+fast as possible and then writes the end of calculation string. The time of
+the final write is stored in the event file.
+"""
+import os
+import time
+import argparse
+
+
+def main(outfile, event_file, size):
+
+    block = (("Dummy process writes a lot. " * 36)[:1023] + "\n").encode()
+    block = block * 1024
+
+    with open(outfile, "ab") as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+        f.write(b"Have a nice day.\n")
+
+    with open(event_file, "w") as f:
+        f.write(str(time.time()))
+
+    # calculation does not end by itself
+    time.sleep(3600)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="dummy_large_output.py",
+        description="Dummy process that writes a large file."
+    )
+    parser.add_argument('-o', '--out-file', dest="outfile", required=True)
+    parser.add_argument('-e', '--event-file', dest="event_file", required=True)
+    parser.add_argument(
+        '-s', '--size', 
+        help="Size of the outfile in bytes.",
+        dest="size", 
+        type=int, 
+        default=100 * 1024**2
+    )
+
+    args = parser.parse_args()
+    main(args.outfile, args.event_file, args.size)
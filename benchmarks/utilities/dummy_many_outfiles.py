@@ -0,0 +1,55 @@
+"""This script is run as a dummy process that creates many outfiles in
+several folders (to be matched by wildcards), keeps updating random ones for
+a while and then gets stuck. The time of the last update is stored in the
+event file.
+"""
+import os
+import time
+import random
+import argparse
+
+
+def main(outfolder, event_file, n_files, n_folders, duration):
+
+    files = []
+    for i in range(n_files):
+        folder = os.path.join(outfolder, str(i % n_folders))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        files.append(os.path.join(folder, "rank_" + str(i) + ".out"))
+        open(files[-1], "a").close()
+
+    time_end = time.time() + duration
+    while time.time() < time_end:
+        for f in random.sample(files, min(10, n_files)):
+            with open(f, "a") as out:
+                out.write("Dummy rank is Active." + os.linesep)
+        last = time.time()
+        time.sleep(0.1)
+
+    with open(event_file, "w") as f:
+        f.write(str(last))
+
+    # stuck
+    time.sleep(3600)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="dummy_many_outfiles.py",
+        description="Dummy process that writes to many files and gets stuck."
+    )
+    parser.add_argument('-o', '--out-folder', dest="outfolder", required=True)
+    parser.add_argument('-e', '--event-file', dest="event_file", required=True)
+    parser.add_argument('-n', '--n-files', dest="n_files", type=int, default=2000)
+    parser.add_argument('-f', '--n-folders', dest="n_folders", type=int, default=20)
+    parser.add_argument('-d', '--duration', dest="duration", type=float, default=2)
+
+    args = parser.parse_args()
+    main(
+        args.outfolder, 
+        args.event_file, 
+        args.n_files, 
+        args.n_folders, 
+        args.duration
+    )
@@ -0,0 +1,40 @@
+"""This script is run as a dummy process that writes to an outfile for a
+while and then gets stuck, i.e. keeps running without writing anything.
+The time of the last write is stored in the event file.
+"""
+import os
+import time
+import argparse
+
+
+def main(outfile, event_file, duration, period):
+
+    with open(outfile, "a") as f:
+
+        time_end = time.time() + duration
+        i = 0
+        while time.time() < time_end:
+            f.write("Dummy process is Active. Loop " + str(i) + os.linesep)
+            f.flush()
+            i += 1
+            time.sleep(period)
+
+    with open(event_file, "w") as f:
+        f.write(str(os.stat(outfile).st_mtime))
+
+    # stuck
+    time.sleep(3600)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="dummy_stuck_writer.py",
+        description="Dummy process that writes to a file and then gets stuck."
+    )
+    parser.add_argument('-o', '--out-file', dest="outfile", required=True)
+    parser.add_argument('-e', '--event-file', dest="event_file", required=True)
+    parser.add_argument('-d', '--duration', dest="duration", type=float, default=2)
+    parser.add_argument('-p', '--period', dest="period", type=float, default=0.1)
+
+    args = parser.parse_args()
+    main(args.outfile, args.event_file, args.duration, args.period)
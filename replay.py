@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""This module replays traces recorded by the slurm assassin (see
+TraceRecorder in assassin.py, or the assassin's --record-trace option) in
+virtual time. The assassin's timeout detection is re-run on the recorded
+observations for a whole grid of timeouts and polling periods at once,
+and for every setting it is reported
+ - how many jobs would have been killed and how long after their last
+   outfile update that would have happened (detection latency),
+ - how many of them were killed by mistake, i.e. the calculation wrote
+   output again later or finished properly (false kills),
+ - how many core hours the kills of dead calculations would have saved.
+
+A replay can only judge what was observed: if the recorded job was killed
+by the assassin, settings that would have waited longer are counted as
+not killing the job. Output written between two recorded polls is only
+known by the modification time seen at the next poll.
+
+Example:
+    python replay.py job1.trace job2.trace -T 5 10 15 30 -p 1 2 5
+"""
+
+import numpy as np
+import struct
+import json
+import argparse
+
+from assassin import TraceRecorder
+
+
+class Trace(object):
+    """The observations recorded for one job"""
+
+    dtype = np.dtype([
+        ("kind", "u1"),
+        ("index", "<u2"),
+        ("time", "<f8"),
+        ("a", "<f8"),
+        ("b", "<f8")
+    ])
+
+    def __init__(self, header, records, file_names):
+        """Args:
+            header: dict with the job information stored by the recorder.
+            records: structured array (of dtype) of all records except
+                the ones that carry file names.
+            file_names: dict file index -> file name.
+        """
+
+        self.header = header
+        self.records = records
+        self.file_names = file_names
+
+    @classmethod
+    def load(cls, path):
+        """Read a trace file written by the TraceRecorder"""
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if not data.startswith(TraceRecorder.magic):
+            raise ValueError(path + " is not a slurm assassin trace.")
+
+        #--- read header ---
+        position = len(TraceRecorder.magic)
+        length, = struct.unpack_from("<I", data, position)
+        position += 4
+        header = json.loads(data[position:position + length].decode())
+        position += length
+        #---
+
+        #--- read records ---
+        size = TraceRecorder.record_size
+
+        # if the job was killed while writing, the last record may be
+        # incomplete.
+        n_slots = (len(data) - position) // size
+        slots = np.frombuffer(data, cls.dtype, count=n_slots, offset=position)
+        #---
+
+        #--- extract file names (they span several slots) ---
+        is_record = np.ones(n_slots, dtype=bool)
+        file_names = {}
+
+        i = 0
+        while True:
+            candidates = np.flatnonzero(
+                slots["kind"][i:] == TraceRecorder.FILE_NAME
+            )
+            if candidates.size == 0:
+                break
+
+            j = i + candidates[0]
+            n = int(slots["a"][j])
+
+            start = position + (j + 1) * size
+            name = data[start:start + n * size].rstrip(b"\0").decode()
+            file_names[int(slots["index"][j])] = name
+
+            is_record[j:j + 1 + n] = False
+            i = j + 1 + n
+        #---
+
+        return cls(header, slots[is_record], file_names)
+
+    def _of_kind(self, kind):
+        return self.records[self.records["kind"] == kind]
+
+    @property
+    def time_start(self):
+        return self.header["time_start"]
+
+    @property
+    def cores(self):
+        return self.header.get("cores", 1)
+
+    @property
+    def return_code(self):
+        """Return code of the calculation (None if not recorded)"""
+        process = self._of_kind(TraceRecorder.PROCESS)
+        finished = process[~np.isnan(process["a"])]
+        return int(finished["a"][0]) if len(finished) else None
+
+    @property
+    def time_end(self):
+        """The time the calculation ended (or the last observation if the
+        end was not recorded)."""
+        process = self._of_kind(TraceRecorder.PROCESS)
+        finished = process[~np.isnan(process["a"])]
+        if len(finished):
+            return finished["time"][0]
+        elif len(self.records):
+            return self.records["time"].max()
+        else:
+            return self.time_start
+
+    @property
+    def time_finished(self):
+        """The time the end of calculation string was first seen (None if
+        it was never seen)"""
+        finished = self._of_kind(TraceRecorder.FINISHED)
+        found = finished["time"][finished["a"] > 0]
+        return found[0] if len(found) else None
+
+    @property
+    def succeeded(self):
+        return self.return_code == 0 or not self.time_finished is None
+
+    @property
+    def modification_times(self):
+        """Sorted array of all distinct modification times of the outfiles"""
+        outfiles = self._of_kind(TraceRecorder.OUTFILE)
+        return np.unique(outfiles["a"][outfiles["a"] > 0])
+
+
+def poll_times(time_start, time_end, polling_period):
+    """The times at which the assassin polls the outfiles, if it was started
+    at time_start and the calculation ends at time_end (all in s). This
+    mirrors the assassin's loop: the process handle is checked every
+    min(30 s, polling_period / 10) and the outfiles are polled at the first
+    check after more than polling_period has passed since the last poll."""
+
+    period_handle = min(30.0, polling_period / 10.0)
+    interval = (np.floor(polling_period / period_handle + 1e-9) + 1) * \
+        period_handle
+
+    n_polls = int(max(0, np.ceil((time_end - time_start) / interval)))
+
+    times = time_start + interval * np.arange(1, n_polls + 1)
+    return times[times < time_end]
+
+
+def detection_times(trace, timeouts, polling_periods):
+    """Replays the timeout detection of the trace for all combinations of
+    timeouts and polling periods (both in s). Returns an array of shape
+    (len(polling_periods), len(timeouts)) with the time at which the
+    timeout would have been detected (nan if it would not have been)."""
+
+    timeouts = np.asarray(timeouts, dtype=float)
+    modifications = trace.modification_times
+
+    # polling stops as soon as the calculation has ended or the end of
+    # calculation string has appeared
+    time_end = trace.time_end
+    if not trace.time_finished is None:
+        time_end = min(time_end, trace.time_finished)
+
+    detected = np.full((len(polling_periods), len(timeouts)), np.nan)
+
+    for i, polling_period in enumerate(polling_periods):
+
+        polls = poll_times(trace.time_start, time_end, polling_period)
+        if polls.size == 0:
+            continue
+
+        #--- most recent modification seen at each poll ---
+        index = np.searchsorted(modifications, polls, side="right") - 1
+        modification = np.where(
+            index >= 0,
+            modifications[np.maximum(index, 0)] if modifications.size else 0,
+            trace.time_start
+        )
+        #---
+
+        # a poll only checks for the timeout if it found no new modification
+        previous = np.maximum(
+            trace.time_start,
+            np.concatenate([[-np.inf], modification[:-1]])
+        )
+        checks_timeout = ~(modification > previous)
+
+        # all timeouts are checked at once
+        hit = checks_timeout[None, :] & \
+            ((polls - modification)[None, :] > timeouts[:, None])
+
+        found = hit.any(axis=1)
+        detected[i] = np.where(found, polls[hit.argmax(axis=1)], np.nan)
+
+    return detected
+
+
+def evaluate(traces, timeouts, polling_periods):
+    """Replays all traces for the parameter grid and sums up the outcome
+    per setting. Timeouts and polling periods in minutes. Returns a dict
+    of arrays of shape (len(polling_periods), len(timeouts)):
+     - kills: number of jobs that would have been killed
+     - false_kills: kills of jobs that wrote output again later or finished
+     - latency: mean time from the last outfile update to the kill of a
+       dead job (in minutes, nan if there was none)
+     - core_hours_saved: core hours between the kill and the end of dead
+       jobs.
+     - core_hours_lost: core hours used by falsely killed jobs up to the
+       kill
+    """
+
+    shape = (len(polling_periods), len(timeouts))
+    kills = np.zeros(shape, dtype=int)
+    false_kills = np.zeros(shape, dtype=int)
+    latency = np.zeros(shape)
+    saved = np.zeros(shape)
+    lost = np.zeros(shape)
+
+    for trace in traces:
+
+        detected = detection_times(
+            trace,
+            np.asarray(timeouts) * 60,
+            np.asarray(polling_periods) * 60
+        )
+
+        modifications = trace.modification_times
+        time_end = trace.time_end
+
+        killed = detected < time_end
+        when = np.where(killed, detected, trace.time_start)
+
+        #--- was there output after the kill? ---
+        n_before = np.searchsorted(modifications, when, side="right")
+        recovered = (n_before < modifications.size) | trace.succeeded
+        #---
+
+        is_false = killed & recovered
+        is_true = killed & ~recovered
+
+        last_update = np.where(
+            n_before > 0,
+            modifications[np.maximum(n_before - 1, 0)] \
+                if modifications.size else 0,
+            trace.time_start
+        )
+
+        kills += killed
+        false_kills += is_false
+        latency += np.where(is_true, when - last_update, 0)
+        saved += np.where(is_true, time_end - when, 0) * trace.cores / 3600.0
+        lost += np.where(is_false, when - trace.time_start, 0) * \
+            trace.cores / 3600.0
+
+    true_kills = kills - false_kills
+    with np.errstate(invalid="ignore", divide="ignore"):
+        latency = np.where(true_kills > 0, latency / true_kills / 60.0, np.nan)
+
+    return {
+        "kills": kills,
+        "false_kills": false_kills,
+        "latency": latency,
+        "core_hours_saved": saved,
+        "core_hours_lost": lost
+    }
+
+
+def main(args):
+
+    traces = [Trace.load(path) for path in args.traces]
+    results = evaluate(traces, args.timeouts, args.polling_periods)
+
+    if args.json:
+        rows = []
+        for i, polling_period in enumerate(args.polling_periods):
+            for j, timeout in enumerate(args.timeouts):
+                row = {"timeout": timeout, "polling_period": polling_period}
+                for key, value in results.items():
+                    value = value[i, j].item()
+                    row[key] = None if value != value else value
+                rows.append(row)
+        print(json.dumps(rows, indent=2))
+        return
+
+    print("{0:>10} {1:>10} {2:>6} {3:>12} {4:>12} {5:>12} {6:>12}".format(
+        "timeout", "polling", "kills", "false kills", "latency",
+        "saved [ch]", "lost [ch]"
+    ))
+    for i, polling_period in enumerate(args.polling_periods):
+        for j, timeout in enumerate(args.timeouts):
+            print(
+                "{0:>10.2f} {1:>10.2f} {2:>6d} {3:>12d} {4:>12.1f} " \
+                    "{5:>12.2f} {6:>12.2f}".format(
+                    timeout,
+                    polling_period,
+                    results["kills"][i, j],
+                    results["false_kills"][i, j],
+                    results["latency"][i, j],
+                    results["core_hours_saved"][i, j],
+                    results["core_hours_lost"][i, j]
+                )
+            )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        prog="replay.py",
+        description="Replays traces recorded by the assassin " + \
+            "(--record-trace) for a grid of timeouts and polling periods."
+    )
+
+    parser.add_argument(
+        'traces',
+        nargs='+',
+        help="Trace files recorded by the assassin.",
+        metavar='trace'
+    )
+
+    parser.add_argument(
+        '-T', '--time-out',
+        help="The time-outs to replay (in minutes).",
+        nargs='+',
+        default=[5, 10, 15, 30, 60],
+        type=float,
+        dest="timeouts"
+    )
+
+    parser.add_argument(
+        '-p', '--polling',
+        help="The polling periods to replay (in minutes).",
+        nargs='+',
+        default=[1, 5],
+        type=float,
+        dest="polling_periods"
+    )
+
+    parser.add_argument(
+        '--json',
+        help="Print the results as json.",
+        action="store_true",
+        dest="json"
+    )
+
+    main(parser.parse_args())
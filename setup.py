@@ -14,5 +14,8 @@ setup(
     version='0.0',
     description='A script to start/monitor calculations on a Slurm calculation system',
     author='Johannes Cartus',
-    py_modules=['assassin']
+    py_modules=[
+        'assassin', 'assassin_detectors', 'assassin_agents', 
+        'assassin_kills', 'assassin_daemon', 'replay', 'aggregate'
+    ]
 )
\ No newline at end of file
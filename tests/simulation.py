@@ -0,0 +1,207 @@
+"""This module contains a simulated clock, file system and calculation
+process for the slurm assassin. With them the assassin's polling loop can be
+driven in virtual time, i.e. hours of simulated job time pass in
+milliseconds and every run is fully deterministic.
+"""
+
+import io
+import heapq
+import itertools
+import fnmatch
+
+from collections import namedtuple
+
+from assassin import Clock, FileSystem
+
+
+class VirtualClock(Clock):
+    """A clock that only advances when somebody sleeps. Callbacks can be
+    scheduled for a given point in (virtual) time, they are fired in order
+    while the clock is advanced by sleep."""
+
+    def __init__(self, start=1.5e9):
+
+        self._now = float(start)
+
+        # heap of scheduled (time, sequence number, callback) tuples
+        self._queue = []
+        self._sequence = itertools.count()
+
+    def time_now(self):
+        return self._now
+
+    def call_at(self, when, callback):
+        """Schedule callback to be called at the virtual time when"""
+        heapq.heappush(self._queue, (when, next(self._sequence), callback))
+
+    def call_later(self, delay, callback):
+        """Schedule callback to be called delay seconds from now"""
+        self.call_at(self._now + delay, callback)
+
+    def sleep(self, seconds):
+        """Advance time by seconds and fire all callbacks due until then"""
+
+        target = self._now + seconds
+
+        while self._queue and self._queue[0][0] <= target:
+            when, _, callback = heapq.heappop(self._queue)
+            self._now = max(self._now, when)
+            callback()
+
+        self._now = target
+
+
+VirtualStat = namedtuple("VirtualStat", ["st_mtime", "st_size", "st_ino"])
+VirtualStatVFS = namedtuple("VirtualStatVFS", ["f_bavail", "f_frsize"])
+
+
+class VirtualFileSystem(FileSystem):
+    """An in-memory file system whose modification times are taken
+    from a (virtual) clock."""
+
+    def __init__(self, clock, capacity=2**50):
+
+        self._clock = clock
+
+        # size of the file system in bytes
+        self.capacity = capacity
+
+        # path -> [content (bytes), mtime, inode]
+        self._files = {}
+        self._inodes = itertools.count(1)
+
+    def write(self, path, text):
+        """Append text to a file (created if missing) and update its mtime"""
+
+        if not path in self._files:
+            self._files[path] = [b"", 0.0, next(self._inodes)]
+
+        entry = self._files[path]
+        entry[0] += text.encode() if isinstance(text, str) else text
+        entry[1] = self._clock.time_now()
+
+    def remove(self, path):
+        del self._files[path]
+
+    def stat(self, path):
+        try:
+            content, mtime, inode = self._files[path]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+        return VirtualStat(st_mtime=mtime, st_size=len(content), st_ino=inode)
+
+    def open(self, path, mode="r"):
+
+        if any(m in mode for m in "wax+"):
+            raise ValueError("Virtual files can only be opened for reading")
+
+        try:
+            content = self._files[path][0]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+        if "b" in mode:
+            return io.BytesIO(content)
+        else:
+            return io.StringIO(content.decode())
+
+    def glob(self, pattern):
+        return [p for p in sorted(self._files) if fnmatch.fnmatch(p, pattern)]
+
+    def statvfs(self, path):
+        used = sum(len(entry[0]) for entry in self._files.values())
+        return VirtualStatVFS(f_bavail=max(0, self.capacity - used), f_frsize=1)
+
+
+class SimulatedProcess(object):
+    """Stands in for the Popen handle of a calculation. The calculation is
+    described by a list of steps that are executed on a virtual clock:
+
+        ("write", path, text): append text to the (virtual) file path
+        ("sleep", seconds): wait
+        ("exit", return_code): terminate with the given return code
+    """
+
+    def __init__(self, clock, file_system, steps):
+
+        self._clock = clock
+        self._file_system = file_system
+
+        self.returncode = None
+
+        # all steps are scheduled right away
+        when = clock.time_now()
+        for step in steps:
+
+            if step[0] == "write":
+                clock.call_at(when, self._make_write(step[1], step[2]))
+
+            elif step[0] == "sleep":
+                when += step[1]
+
+            elif step[0] == "exit":
+                clock.call_at(when, self._make_exit(step[1]))
+                break
+
+            else:
+                raise ValueError("Unknown step: " + str(step[0]))
+
+    def _make_write(self, path, text):
+        def write():
+            if self.returncode is None:
+                self._file_system.write(path, text)
+        return write
+
+    def _make_exit(self, return_code):
+        def exit():
+            if self.returncode is None:
+                self.returncode = return_code
+        return exit
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            self.returncode = -15
+
+
+class Simulation(object):
+    """Bundles a virtual clock and file system and hands out assassins and
+    calculations that live in them."""
+
+    def __init__(self, start=1.5e9):
+        self.clock = VirtualClock(start)
+        self.file_system = VirtualFileSystem(self.clock)
+
+    def make_assassin(self, cls, **kwargs):
+        """Create an assassin of class cls that uses the simulated clock and
+        file system. All kwargs are passed on to the constructor."""
+        return cls(clock=self.clock, file_system=self.file_system, **kwargs)
+
+    def launch(self, assassin, steps):
+        """Start a simulated calculation consisting of steps (see
+        SimulatedProcess) as the assassin's calculation process."""
+
+        process = SimulatedProcess(self.clock, self.file_system, steps)
+
+        assassin._process_factory = lambda *args, **kwargs: process
+        assassin.start_calculation_process(["simulated", "calculation"])
+
+        return process
+
+    @staticmethod
+    def writes_then_stalls(path, n_writes, write_period, stall, return_code=0):
+        """Steps of a calculation that writes n_writes lines to path
+        (one every write_period seconds), then writes nothing for stall
+        seconds and finally exits with return_code"""
+
+        steps = []
+        for i in range(n_writes):
+            steps.append(("write", path, "Loop " + str(i) + "\n"))
+            steps.append(("sleep", write_period))
+        steps.append(("sleep", stall))
+        steps.append(("exit", return_code))
+
+        return steps
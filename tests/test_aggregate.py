@@ -0,0 +1,178 @@
+"""This file contains tests for the aggregation of many assassin logs into
+an index.
+"""
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from aggregate import LogIndex, parse_log, find_logs, parse_time
+from aggregate import START, TIMEOUT, KILLED, WARNING, ERROR
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.time_start = time.mktime((2019, 6, 7, 12, 0, 0, 0, 0, -1))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def line(self, minutes, marker, msg):
+        timestamp = time.strftime(
+            "%Y-%m-%d, %H:%M:%S",
+            time.localtime(self.time_start + minutes * 60)
+        )
+        return marker + " " + timestamp + ": " + msg + "\n"
+
+    def write(self, job, lines, mode="a"):
+        folder = os.path.join(self.folder, job)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "assassin.log"), mode) as f:
+            f.write("".join(lines))
+        return os.path.join(folder, "assassin.log")
+
+    def run_lines(self, start, duration, outcome):
+        """The log lines of a calculation that runs for duration minutes"""
+
+        lines = [self.line(start, "[#]", "Running command: mpirun aims.x")]
+        lines += [
+            self.line(start + t, "[ ]", "Polling outfiles.") \
+                for t in range(1, duration)
+        ]
+
+        end = start + duration
+        if outcome == "finished":
+            lines.append(self.line(end, "[#]",
+                "Calculation finished (by outfile)."))
+        elif outcome == "timeout":
+            lines.append(self.line(end, "[X]", "Calculation timed out! " + \
+                "Timeout of 15.0 minutes was exceeded."))
+            lines.append(self.line(end, "[#]", "Killing job 75129"))
+        elif outcome == "crashed":
+            lines.append(self.line(end, "[X]", "Calculation crashed! " + \
+                "Crash signature of aims found in main outfile: MPI_ABORT"))
+        return lines
+
+    def test_events_are_classified(self):
+
+        path = self.write("job",
+            self.run_lines(0, 60, "timeout") + \
+            [self.line(61, "[w]", "Requeueing failed, cancelling the job "
+                "instead."),
+             self.line(62, "[ ]", "An unexpected error occurred: boom"),
+             "[ ] 2019-06-07, 13:03:00: incomplete line"]
+        )
+
+        (inode, size, mtime), times, kinds, idles = parse_log(path)
+
+        self.assertEqual(
+            [START, TIMEOUT, KILLED, WARNING, ERROR], kinds
+        )
+        self.assertEqual(self.time_start, times[0])
+        self.assertEqual(self.time_start + 3600, times[1])
+        self.assertEqual(900, idles[1])
+        self.assertTrue(np.isnan(idles[0]))
+
+        # the incomplete line is parsed later
+        self.assertEqual(os.path.getsize(path) - 41, size)
+
+    def test_index_is_updated_incrementally(self):
+
+        path_a = self.write("a", self.run_lines(0, 30, "finished"))
+        self.write("b", self.run_lines(0, 30, "timeout"))
+        self.write("c", self.run_lines(0, 30, "crashed"))
+
+        index_path = os.path.join(self.folder, "index.npz")
+        index = LogIndex()
+        index.update(find_logs([self.folder]), processes=1)
+        index.save(index_path)
+
+        self.assertEqual((3, 0, 0),
+            (index.n_parsed, index.n_appended, index.n_skipped))
+        self.assertEqual(7, len(index))
+
+        # a is requeued, b is replaced by a shorter log
+        self.write("a", self.run_lines(40, 30, "finished"))
+        self.write("b", self.run_lines(0, 2, "finished"), mode="w")
+
+        index = LogIndex.load(index_path)
+        index.update(find_logs([self.folder]), processes=1)
+
+        self.assertEqual((1, 1, 1),
+            (index.n_parsed, index.n_appended, index.n_skipped))
+        self.assertEqual(7 - 3 + 2 + 2, len(index))
+
+        # the events of a file stay in order
+        a = index.files["path"].tolist().index(path_a)
+        times = index.events["time"][index.events["file"] == a]
+        np.testing.assert_array_equal(np.sort(times), times)
+
+        rows = dict((row["outcome"], row) for row in index.summary())
+        self.assertEqual(3, rows["finished"]["runs"])
+        self.assertEqual(2, rows["finished"]["files"])
+        self.assertEqual(0, rows["timeout"]["runs"])
+        self.assertEqual(1, rows["crashed"]["runs"])
+
+    def test_summary(self):
+
+        self.write("a", self.run_lines(0, 120, "timeout"))
+        self.write("b", self.run_lines(0, 60, "timeout"))
+        self.write("c",
+            self.run_lines(0, 30, "crashed") + \
+                self.run_lines(60, 600, "finished")
+        )
+        self.write("d", self.run_lines(0, 10, None))
+
+        index = LogIndex()
+        index.update(find_logs([self.folder]), processes=1)
+
+        rows = dict((row["outcome"], row) for row in index.summary())
+        self.assertEqual(2, rows["timeout"]["runs"])
+        self.assertAlmostEqual(3.0, rows["timeout"]["walltime_hours"])
+        self.assertAlmostEqual(0.5, rows["timeout"]["idle_hours"])
+        self.assertEqual(1, rows["crashed"]["runs"])
+        self.assertAlmostEqual(10.0, rows["finished"]["walltime_hours"])
+        self.assertEqual(1, rows["running"]["runs"])
+
+        # only the runs that ended in the last 90 minutes of the first two
+        # hours
+        rows = dict((row["outcome"], row) for row in index.summary(
+            since=self.time_start + 30 * 60 + 1,
+            until=self.time_start + 120 * 60 + 1
+        ))
+        self.assertEqual(2, rows["timeout"]["runs"])
+        self.assertEqual(0, rows["crashed"]["runs"])
+        self.assertEqual(0, rows["finished"]["runs"])
+
+        self.assertEqual(2, index.count()["timeout"])
+        self.assertEqual(5, index.count()["start"])
+
+    def test_logs_are_parsed_in_parallel(self):
+
+        for i in range(20):
+            self.write(str(i), self.run_lines(i, 10 + i, "timeout"))
+
+        serial, parallel = LogIndex(), LogIndex()
+        serial.update(find_logs([self.folder]), processes=1)
+        parallel.update(find_logs([self.folder]), processes=2, chunksize=3)
+
+        for name in LogIndex.event_columns:
+            np.testing.assert_array_equal(
+                serial.events[name], parallel.events[name]
+            )
+
+    def test_parse_time(self):
+
+        self.assertEqual(1000 - 7 * 86400, parse_time("7d", time_now=1000))
+        self.assertEqual(1000 - 1800, parse_time("30m", time_now=1000))
+        self.assertEqual(self.time_start, parse_time("2019-06-07, 12:00:00"))
+        self.assertRaises(ValueError, parse_time, "last week")
+
+
+if __name__ == '__main__':
+    unittest.main()
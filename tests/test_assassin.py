@@ -6,18 +6,50 @@ import numpy as np
 import unittest
 import os
 import shutil
+import random
+import json
+import struct
+import sys
+import tempfile
+import threading
+import time
+import io
+import subprocess as sp
+import signal
 
 from collections import defaultdict
-
-from assassin import SlurmAssassin, Logger, EMailHandler
+from unittest import mock
+
+from assassin import SlurmAssassin, Logger, EMailHandler, PollProfiler
+from assassin import PollScheduler, RequeuePolicy
+from assassin import StateSnapshot, OutputGrowthGuard
+from assassin import CalculationRunawayOutput, CalculationRepeatingOutput
+from assassin import RepetitionDetector
+from assassin import DeadCalculation
+from assassin import CodeProfile, OutputMatcher, code_profiles
+from assassin import detect_code_profile, CalculationCrashFoundByOutfile
+from assassin import DiagnosticBundle, OutputPump, FileSystem
+from assassin import build_parser
+from assassin import RankProgressTracker, CalculationRanksStalled
+from assassin import SubcalculationTracker
+from assassin import MetricsExporter, StatusSegment, EventLog
 from assassin import CalculationCrashed, CalculationTimeout
 
+from simulation import Simulation, VirtualClock
+from simulation import VirtualFileSystem
+
 
 utilities_path = os.path.join(
     os.path.dirname(os.path.realpath(__file__)),
     "utilities"
 )
 
+# the tests that run real dummy processes in wall time take minutes, they can
+# be skipped by setting this environment variable.
+run_real_process_tests = \
+    not os.environ.get("SLURM_ASSASSIN_SKIP_REAL_PROCESS_TESTS")
+skip_real_process_tests_reason = "SLURM_ASSASSIN_SKIP_REAL_PROCESS_TESTS set"
+
 class LoggerMock(Logger):     
     # count logging by differt level
     log_counter = np.zeros(4)
@@ -126,9 +158,25 @@ class FakeAssassin(SlurmAssassin):
         return 75129
 
 
+class SimulationTestCase(unittest.TestCase):
+    """Base class of the tests that run the assassin in a simulation. Every
+    test gets a fresh simulation and a temporary folder, which is removed 
+    afterwards."""
+
+    def setUp(self):
+
+        LoggerMock.reset_counter()
+        self.simulation = Simulation()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
 
 
 
+@unittest.skipUnless(run_real_process_tests, skip_real_process_tests_reason)
 class TestCodeFailuresAreRecognized(unittest.TestCase):
 
     def setUp(self):
@@ -208,6 +256,7 @@ class TestCodeFailuresAreRecognized(unittest.TestCase):
 
 
 
+@unittest.skipUnless(run_real_process_tests, skip_real_process_tests_reason)
 class TestNotifyOnlyMode(unittest.TestCase):
     """Tests if the assassin works correctly in notify-only mode"""
 
@@ -282,6 +331,1914 @@ class TestNotifyOnlyMode(unittest.TestCase):
 
 
 
+class TestCodeFailuresAreRecognizedSimulated(SimulationTestCase):
+    """Same as TestCodeFailuresAreRecognized, but in virtual time"""
+
+    def test_calculation_raises_exception(self):
+
+        assassin = self.simulation.make_assassin(
+            SlurmAssassin,
+            timeout=15,
+            polling_period=5
+        )
+
+        self.simulation.launch(
+            assassin, 
+            [("sleep", random.Random(42).random() * 20), ("exit", 1)]
+        )
+
+        self.assertRaises(CalculationCrashed, assassin._lurk)
+        assassin.terminate_calculation_process()
+
+        LoggerMock.assert_expected_counts_errors(0)
+
+    def test_calculation_stops_writing(self):
+
+        assassin = self.simulation.make_assassin(
+            SlurmAssassin,
+            timeout=20 / 60,
+            polling_period=7 / 60,
+            out_file_name="dummy_stop_writing.log"
+        )
+
+        process = self.simulation.launch(
+            assassin,
+            Simulation.writes_then_stalls("dummy_stop_writing.log", 3, 5, 50)
+        )
+
+        self.assertRaises(CalculationTimeout, assassin._lurk)
+
+        # last write at 10 s, so the timeout must be found by the first 
+        # poll after 30 s.
+        time_detected = \
+            self.simulation.clock.time_now() - assassin.time_calculation_start
+        self.assertGreater(time_detected, 30)
+        self.assertLessEqual(time_detected, 30 + 7 + 0.7)
+
+        assassin.terminate_calculation_process()
+        self.assertEqual(-15, process.poll())
+
+        LoggerMock.assert_expected_counts_errors(0)
+
+    def test_hours_of_job_time_pass_in_virtual_time(self):
+
+        assassin = self.simulation.make_assassin(
+            SlurmAssassin,
+            timeout=60,
+            polling_period=5,
+            out_file_name="aims.out"
+        )
+
+        # write every 10 minutes for 10 hours, then finish
+        steps = Simulation.writes_then_stalls("aims.out", 60, 600, 0)
+        steps.insert(-1, ("write", "aims.out", "Have a nice day\n"))
+        self.simulation.launch(assassin, steps)
+
+        assassin._lurk()
+
+        self.assertGreaterEqual(
+            self.simulation.clock.time_now() - assassin.time_calculation_start,
+            10 * 3600
+        )
+
+
+class TestNotifyOnlyModeSimulated(SimulationTestCase):
+    """Same as TestNotifyOnlyMode, but in virtual time"""
+
+    def test_calculation_stops_writing(self):
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=20 / 60,
+            polling_period=10 / 60,
+            out_file_name="dummy_stop_writing.log",
+            email="test@test.test"
+        )
+
+        process = self.simulation.launch(
+            assassin,
+            Simulation.writes_then_stalls("dummy_stop_writing.log", 3, 5, 50)
+        )
+
+        try:
+            assassin.lurk_and_notify()
+            self.fail("Assassin did not trigger system exit!")
+        except SystemExit:
+            pass
+
+        # the process finishes normally
+        self.assertEqual(0, process.poll())
+
+        # first timeout at 33 s, then one every second until exit at 65 s
+        assassin._email_handler.assert_expected_counts_error_category(
+            "timeout",
+            32
+        )
+
+
+class TestShadowMode(SimulationTestCase):
+    """Tests if kill decisions are only recorded in shadow mode"""
+
+    def setUp(self):
+
+        super(TestShadowMode, self).setUp()
+        self.shadow_file = os.path.join(self.folder, "shadow.json")
+
+        self.environ = os.environ.copy()
+        os.environ["SLURM_CPUS_ON_NODE"] = "16"
+        os.environ["SLURM_NNODES"] = "2"
+
+    def tearDown(self):
+
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+        super(TestShadowMode, self).tearDown()
+
+    def run_in_shadow(self, steps):
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=10,
+            polling_period=1,
+            out_file_name="calc.out",
+            shadow_file=self.shadow_file
+        )
+        process = self.simulation.launch(assassin, steps)
+
+        self.assertRaises(SystemExit, assassin.lurk_in_shadow)
+
+        with open(self.shadow_file) as f:
+            return process, json.load(f)
+
+    def test_dead_calculation(self):
+
+        # stalls for 2 hours, then crashes
+        process, summary = self.run_in_shadow(
+            Simulation.writes_then_stalls("calc.out", 10, 60, 7200, 1)
+        )
+
+        # the calculation was not stopped by the assassin
+        self.assertEqual(1, process.poll())
+
+        self.assertTrue(summary["would_have_killed"])
+        self.assertFalse(summary["recovered"])
+        self.assertFalse(summary["succeeded"])
+        # the crash at the end is part of the same dead phase 
+        self.assertEqual(
+            ["terminate_calculation_process", "kill_job"],
+            [d["action"] for d in summary["decisions"]]
+        )
+        self.assertIn("CalculationTimeout", summary["decisions"][0]["reason"])
+
+        # 32 cores, kill after about 19 of 130 minutes
+        self.assertEqual(32, summary["cores"])
+        self.assertAlmostEqual(
+            (summary["time_end"] - summary["time_kill"]) / 3600 * 32,
+            summary["core_hours_saved"]
+        )
+        self.assertGreater(summary["core_hours_saved"], 32 * 110 / 60)
+
+    def test_recovering_calculation(self):
+
+        # stalls for 30 minutes, then finishes properly
+        steps = Simulation.writes_then_stalls("calc.out", 10, 60, 1800)[:-1]
+        steps += Simulation.writes_then_stalls("calc.out", 10, 60, 0)
+
+        process, summary = self.run_in_shadow(steps)
+
+        self.assertEqual(0, process.poll())
+
+        self.assertTrue(summary["would_have_killed"])
+        self.assertTrue(summary["recovered"])
+        self.assertTrue(summary["succeeded"])
+
+        # only one decision although the timeout was found at many polls
+        self.assertEqual(
+            ["terminate_calculation_process", "kill_job"],
+            [d["action"] for d in summary["decisions"]]
+        )
+
+
+class TestProfiling(SimulationTestCase):
+    """Tests the latency histograms of the polling cycle"""
+
+    def run_profiled(self, profiler):
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=1,
+            polling_period=0.5,
+            out_file_name=["calc.out", "*.cube"],
+            email="test@test.test",
+            profiler=profiler
+        )
+        self.simulation.launch(
+            assassin,
+            Simulation.writes_then_stalls("calc.out", 10, 20, 3600)
+        )
+
+        self.assertRaises(SystemExit, assassin.lurk_and_kill)
+
+    def test_checks_are_recorded(self):
+
+        profiler = PollProfiler()
+        self.run_profiled(profiler)
+
+        # the calculation writes for 200 s, timeout after 60 s, every 30 s
+        # a poll
+        n_polls = profiler.count("poll_cycle")
+        self.assertGreaterEqual(n_polls, 8)
+
+        for name in [
+                "is_calculation_finished", 
+                "is_calculation_crashed", 
+                "is_timeout_reached"
+            ]:
+            self.assertEqual(n_polls, profiler.count(name), msg=name)
+            self.assertEqual(n_polls, sum(profiler.histogram(name)), msg=name)
+
+        # the wildcards are resolved by finish and timeout check
+        self.assertEqual(2 * n_polls, profiler.count("glob"))
+
+        # one stat per outfile (only calc.out exists) 
+        self.assertEqual(n_polls, profiler.count("time_last_modified"))
+
+        self.assertGreater(profiler.count("process_handle"), n_polls)
+        self.assertEqual(1, profiler.count("kill_job"))
+        self.assertEqual(1, profiler.count("send_email"))
+
+    def test_summary_with_cprofile(self):
+
+        stats_file = os.path.join(self.folder, "profile.txt")
+        profiler = PollProfiler(stats_file=stats_file, profile_every=2)
+        self.run_profiled(profiler)
+
+        profiler.dump()
+
+        with open(stats_file) as f:
+            summary = f.read()
+
+        self.assertIn("is_timeout_reached", summary)
+        self.assertIn("cProfile of sampled polling cycles", summary)
+        self.assertIn("poll_outfiles", summary)
+
+
+class TestMetricsExporter(SimulationTestCase):
+    """Tests the Prometheus metrics of the assassin"""
+
+    @staticmethod
+    def parse(text):
+        """Returns a dict metric line (without value) -> value"""
+        return dict(
+            (line.rsplit(" ", 1)[0], float(line.rsplit(" ", 1)[1])) \
+                for line in text.splitlines() if not line.startswith("#")
+        )
+
+    def test_textfile(self):
+
+        textfile = os.path.join(self.folder, "assassin.prom")
+        exporter = MetricsExporter(job_id=75129, textfile=textfile)
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=5,
+            polling_period=1,
+            out_file_name="calc.out",
+            metrics_exporter=exporter
+        )
+        self.simulation.launch(
+            assassin,
+            Simulation.writes_then_stalls("calc.out", 10, 30, 3600)
+        )
+        self.assertRaises(CalculationTimeout, assassin._lurk)
+
+        with open(textfile) as f:
+            metrics = self.parse(f.read())
+
+        # the temporary file was renamed
+        self.assertEqual(["assassin.prom"], os.listdir(self.folder))
+
+        label = '{job_id="75129"}'
+        self.assertEqual(
+            1.0, 
+            metrics['slurm_assassin_verdict{job_id="75129",verdict="timeout"}']
+        )
+        self.assertEqual(
+            0.0, 
+            metrics['slurm_assassin_verdict{job_id="75129",verdict="running"}']
+        )
+        self.assertGreater(
+            metrics["slurm_assassin_seconds_since_last_outfile_update" + label],
+            300
+        )
+        self.assertEqual(
+            len("Loop 0\n") * 10, 
+            metrics["slurm_assassin_outfile_bytes" + label]
+        )
+        self.assertEqual(
+            0.0, 
+            metrics["slurm_assassin_outfile_growth_bytes_per_second" + label]
+        )
+
+    def test_http_and_unix_socket(self):
+
+        import socket
+        from urllib.request import urlopen
+
+        unix_socket = os.path.join(self.folder, "metrics.sock")
+        exporter = MetricsExporter(
+            job_id=1, 
+            port=0, 
+            unix_socket=unix_socket
+        )
+
+        try:
+            assassin = self.simulation.make_assassin(
+                FakeAssassin,
+                out_file_name="calc.out",
+                metrics_exporter=exporter
+            )
+            exporter.update(assassin)
+
+            text = urlopen(
+                "http://127.0.0.1:" + str(exporter.port) + "/metrics"
+            ).read().decode()
+            self.assertIn('slurm_assassin_verdict{job_id="1",verdict="running"} 1.0', text)
+
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(unix_socket)
+            client.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b""
+            while True:
+                chunk = client.recv(4096)
+                if not chunk:
+                    break
+                response += chunk
+            client.close()
+
+            self.assertIn(text.encode(), response)
+
+        finally:
+            exporter.close()
+
+
+class TestStatusSegment(SimulationTestCase):
+    """Tests the shared memory status segment"""
+
+    def test_state_is_published(self):
+
+        segment = StatusSegment(75129, directory=self.folder)
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=5,
+            polling_period=1,
+            out_file_name="calc.out",
+            status_segment=segment
+        )
+        self.simulation.launch(
+            assassin,
+            Simulation.writes_then_stalls("calc.out", 10, 30, 3600)
+        )
+        self.assertRaises(CalculationTimeout, assassin._lurk)
+
+        (path, state), = StatusSegment.read_all(self.folder)
+
+        self.assertEqual(segment.path, path)
+        self.assertEqual("75129", state["job_id"])
+        self.assertEqual(os.getpid(), state["pid"])
+        self.assertEqual("watching", state["phase"])
+        self.assertEqual("timeout", state["verdict"])
+        self.assertEqual(assassin.n_polls, state["n_polls"])
+        self.assertEqual(assassin.n_process_checks, state["n_process_checks"])
+        self.assertEqual(
+            assassin.time_last_update_out, 
+            state["time_last_update_out"]
+        )
+
+        segment.close()
+        self.assertEqual([], StatusSegment.read_all(self.folder))
+
+    def test_torn_state_is_not_read(self):
+
+        segment = StatusSegment(1, directory=self.folder)
+        assassin = self.simulation.make_assassin(
+            SlurmAssassin, 
+            status_segment=segment
+        )
+        assassin.publish_status("starting")
+        self.assertEqual("starting", StatusSegment.read(segment.path)["phase"])
+
+        # pretend the writer was interrupted in the middle of an update
+        segment._sequence += 1
+        struct.pack_into("<Q", segment._map, 8, segment._sequence)
+
+        self.assertIsNone(StatusSegment.read(segment.path, max_tries=10))
+
+        segment.close()
+
+    def test_segment_is_removed_when_lurking_assassin_is_terminated(self):
+
+        root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        segments = os.path.join(self.folder, "shm")
+        os.mkdir(segments)
+        open(os.path.join(self.folder, "calc.out"), "w").close()
+
+        # the calculation only ends when its stdin is closed, i.e. when the
+        # test is done with it
+        process = sp.Popen(
+            [
+                sys.executable, "-c",
+                "import sys\n"
+                "from assassin import SlurmAssassin, StatusSegment\n"
+                "segment = StatusSegment(2, directory=sys.argv[1])\n"
+                "segment.install_cleanup_handlers()\n"
+                "assassin = SlurmAssassin(\n"
+                "    timeout=10, polling_period=0.5 / 60,\n"
+                "    out_file_name='calc.out', status_segment=segment\n"
+                ")\n"
+                "assassin.start_calculation_process(\n"
+                "    [sys.executable, '-c', 'import sys; sys.stdin.read()'],\n"
+                "    stdin=sys.stdin\n"
+                ")\n"
+                "assassin.lurk_and_kill()\n",
+                segments
+            ],
+            stdin=sp.PIPE,
+            stderr=sp.PIPE,
+            cwd=self.folder,
+            env=dict(os.environ, PYTHONPATH=root)
+        )
+
+        state = None
+        time_end = time.time() + 30
+        while time.time() < time_end:
+            states = StatusSegment.read_all(segments)
+            if states and states[0][1]["n_polls"] > 0:
+                state = states[0][1]
+                break
+            time.sleep(0.1)
+        self.assertIsNotNone(state)
+
+        process.send_signal(signal.SIGTERM)
+        _, stderr = process.communicate(timeout=30)
+
+        self.assertNotIn(b"Traceback", stderr)
+        self.assertEqual(128 + signal.SIGTERM, process.returncode)
+        self.assertEqual([], os.listdir(segments))
+
+
+class TestRequeue(SimulationTestCase):
+    """Tests the requeueing of dead calculations (with stubs for scontrol
+    and scancel)"""
+
+    def setUp(self):
+
+        super(TestRequeue, self).setUp()
+        self.scontrol_log = os.path.join(self.folder, "scontrol.log")
+        self.scancel_log = os.path.join(self.folder, "scancel.log")
+        self.state_file = os.path.join(self.folder, "requeues.json")
+
+        self.environment = mock.patch.dict(os.environ, {
+            "STUB_SCONTROL_LOG": self.scontrol_log,
+            "STUB_SCANCEL_LOG": self.scancel_log
+        })
+        self.environment.start()
+
+    def tearDown(self):
+        self.environment.stop()
+        super(TestRequeue, self).tearDown()
+
+    def calls(self, log):
+        try:
+            with open(log) as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def kill_stalled_calculation(self, restart_files):
+        """Let a calculation stall, kill it and return the assassin"""
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=5,
+            polling_period=1,
+            out_file_name="calc.out",
+            requeue_policy=RequeuePolicy(
+                "restart.*",
+                max_requeues=2,
+                state_file=self.state_file,
+                scontrol_command=[
+                    sys.executable, 
+                    os.path.join(utilities_path, "stub_scontrol.py")
+                ]
+            )
+        )
+        assassin._scancel_command = [
+            sys.executable, os.path.join(utilities_path, "stub_scancel.py")
+        ]
+
+        steps = Simulation.writes_then_stalls("calc.out", 5, 60, 3600)
+        steps = [("write", f, "checkpoint") for f in restart_files] + steps
+        self.simulation.launch(assassin, steps)
+
+        self.assertRaises(CalculationTimeout, assassin._lurk)
+        assassin.kill_job()
+
+        return assassin
+
+    def test_job_with_restart_files_is_requeued(self):
+
+        self.kill_stalled_calculation(["restart.1", "restart.2"])
+
+        self.assertEqual(["requeue 75129"], self.calls(self.scontrol_log))
+        self.assertEqual([], self.calls(self.scancel_log))
+        with open(self.state_file) as f:
+            self.assertEqual({"75129": 1}, json.load(f))
+
+    def test_job_without_restart_files_is_cancelled(self):
+
+        self.kill_stalled_calculation([])
+
+        self.assertEqual([], self.calls(self.scontrol_log))
+        self.assertEqual(["75129"], self.calls(self.scancel_log))
+
+    def test_requeues_are_limited(self):
+
+        with open(self.state_file, "w") as f:
+            json.dump({"75129": 2}, f)
+
+        self.kill_stalled_calculation(["restart.1"])
+
+        self.assertEqual([], self.calls(self.scontrol_log))
+        self.assertEqual(["75129"], self.calls(self.scancel_log))
+
+    def test_failed_requeue_falls_back_to_cancel(self):
+
+        with mock.patch.dict(os.environ, {"STUB_SCONTROL_FAIL": "1"}):
+            self.kill_stalled_calculation(["restart.1"])
+
+        self.assertEqual(["75129"], self.calls(self.scancel_log))
+
+    def test_restart_count_from_slurm(self):
+
+        policy = RequeuePolicy("restart.*", max_requeues=2)
+
+        with mock.patch.dict(os.environ, {"SLURM_RESTART_COUNT": "1"}):
+            self.assertEqual(1, policy.requeue_count(75129))
+
+        with mock.patch.dict(os.environ, {"SLURM_RESTART_COUNT": "2"}):
+            self.simulation.file_system.write("restart.1", "checkpoint")
+            self.assertFalse(
+                policy.should_requeue(75129, self.simulation.file_system)
+            )
+
+
+class ReadCountingFileSystem(VirtualFileSystem):
+    """Counts the bytes read from the (virtual) files"""
+
+    def __init__(self, clock):
+        super(ReadCountingFileSystem, self).__init__(clock)
+        self.bytes_read = 0
+
+    def open(self, path, mode="r"):
+        f = super(ReadCountingFileSystem, self).open(path, mode)
+        file_system = self
+
+        class CountingFile(io.BytesIO):
+            def read(self, *args):
+                data = super(CountingFile, self).read(*args)
+                file_system.bytes_read += len(data)
+                return data
+
+        return CountingFile(f.read()) if "b" in mode else f
+
+
+class TestStateSnapshots(SimulationTestCase):
+    """Tests the incremental search of the outfile and the resumption of
+    the assassin's state"""
+
+    def setUp(self):
+
+        super(TestStateSnapshots, self).setUp()
+        self.state_file = os.path.join(self.folder, "state.json")
+
+        self.simulation.file_system = \
+            ReadCountingFileSystem(self.simulation.clock)
+        self.file_system = self.simulation.file_system
+
+    def make_assassin(self):
+        return self.simulation.make_assassin(
+            FakeAssassin,
+            out_file_name="calc.out",
+            state_file=self.state_file
+        )
+
+    def test_only_appended_output_is_searched(self):
+
+        assassin = self.make_assassin()
+        assassin.scan_chunk_size = 1000
+
+        self.file_system.write("calc.out", "x" * 100000)
+        self.assertFalse(assassin.is_calculation_finished())
+        self.assertEqual(100000, self.file_system.bytes_read)
+
+        # the end of calculation string is split between two searches
+        self.file_system.write("calc.out", "Have a ni")
+        self.assertFalse(assassin.is_calculation_finished())
+        self.assertLess(self.file_system.bytes_read, 100000 + 100)
+
+        self.file_system.write("calc.out", "ce day\n")
+        self.assertTrue(assassin.is_calculation_finished())
+
+    def test_state_is_resumed(self):
+
+        self.file_system.write("calc.out", "x" * 100000)
+
+        assassin = self.make_assassin()
+        assassin.is_calculation_finished()
+        assassin.save_state(force=True)
+
+        self.file_system.bytes_read = 0
+        resumed = self.make_assassin()
+
+        self.assertEqual(assassin.scan_offsets, resumed.scan_offsets)
+        self.assertEqual(1, resumed.n_resumes)
+
+        self.file_system.write("calc.out", "Have a nice day\n")
+        self.assertTrue(resumed.is_calculation_finished())
+        self.assertLess(self.file_system.bytes_read, 100)
+
+        # nothing to resume after the calculation has finished
+        resumed.verdict = "finished"
+        resumed._close()
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_state_of_another_job_is_discarded(self):
+
+        self.file_system.write("calc.out", "x" * 1000)
+
+        with mock.patch.dict(os.environ, {"SLURM_JOB_ID": "1"}):
+            assassin = self.make_assassin()
+            assassin.n_polls = 5
+            assassin.save_state(force=True)
+
+        # the requeued job resumes
+        with mock.patch.dict(os.environ, 
+            {"SLURM_JOB_ID": "1", "SLURM_RESTART_COUNT": "1"}):
+            self.assertEqual(1, self.make_assassin().n_resumes)
+
+        # a later (even a requeued) job in the same folder starts afresh
+        with mock.patch.dict(os.environ, 
+            {"SLURM_JOB_ID": "2", "SLURM_RESTART_COUNT": "1"}):
+            assassin = self.make_assassin()
+
+        self.assertEqual((0, 0), (assassin.n_resumes, assassin.n_polls))
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_state_of_replaced_or_truncated_files_is_dropped(self):
+
+        self.file_system.write("calc.out", "x" * 1000)
+
+        assassin = self.make_assassin()
+        assassin.is_calculation_finished()
+        assassin.save_state(force=True)
+
+        # new file (inode changes)
+        self.file_system.remove("calc.out")
+        self.file_system.write("calc.out", "x" * 2000)
+        self.assertEqual({}, self.make_assassin().scan_offsets)
+
+        assassin = self.make_assassin()
+        assassin.is_calculation_finished()
+        assassin.save_state(force=True)
+
+        # truncated file (same inode, but smaller)
+        self.file_system._files["calc.out"][0] = b"Have a nice day\n"
+        resumed = self.make_assassin()
+        self.assertEqual({}, resumed.scan_offsets)
+        self.assertTrue(resumed.is_calculation_finished())
+
+    def test_snapshots_are_written_while_lurking(self):
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=5,
+            polling_period=1,
+            out_file_name="calc.out",
+            state_file=self.state_file
+        )
+        self.simulation.launch(
+            assassin, 
+            Simulation.writes_then_stalls("calc.out", 10, 30, 3600)
+        )
+        self.assertRaises(CalculationTimeout, assassin._lurk)
+
+        state = StateSnapshot(self.state_file).load()
+        self.assertEqual(StateSnapshot.version, state["version"])
+        self.assertGreater(state["n_polls"], 0)
+        self.assertEqual(
+            assassin.scan_offsets["calc.out"][1], 
+            state["scan_offsets"]["calc.out"][1]
+        )
+
+
+class TestBackwardSearch(SimulationTestCase):
+    """Tests the backward search of large outfiles on disk for the end of 
+    calculation string"""
+
+    def setUp(self):
+
+        super(TestBackwardSearch, self).setUp()
+        self.outfile = os.path.join(self.folder, "calc.out")
+
+    def write(self, data, size=None):
+        """Append data to the outfile, if size is given the file is first
+        extended to size bytes (sparse, i.e. without writing them)"""
+        with open(self.outfile, "ab") as f:
+            if not size is None:
+                f.truncate(size)
+                f.seek(size)
+            f.write(data)
+
+    def make_assassin(self):
+        assassin = FakeAssassin(
+            out_file_name=self.outfile,
+            repetition_detector=RepetitionDetector(60)
+        )
+        assassin.scan_chunk_size = 64 * 1024
+        assassin.backward_search_window = 1024**2
+        return assassin
+
+    def test_string_at_the_end_is_found(self):
+
+        self.write(b"Have a nice day\n", size=2 * 1024**3)
+
+        assassin = self.make_assassin()
+        self.assertTrue(assassin.is_calculation_finished())
+
+    def test_string_outside_of_the_window_is_found(self):
+
+        self.write(b"Have a nice day\n")
+        self.write(b"\n", size=20 * 1024**2)
+        
+        assassin = self.make_assassin()
+        self.assertTrue(assassin.is_calculation_finished())
+
+    def test_string_across_the_window_is_found(self):
+
+        self.write(b"Have a nice day\n", size=8 * 1024**2 - 5)
+        self.write(b"\n", size=9 * 1024**2 - 1)
+
+        assassin = self.make_assassin()
+        self.assertTrue(assassin.is_calculation_finished())
+
+    def test_search_continues_after_unfinished_file(self):
+
+        self.write(b"\nstep 1\nstep 2\n", size=9 * 1024**2)
+
+        assassin = self.make_assassin()
+        self.assertFalse(assassin.is_calculation_finished())
+        self.assertEqual(
+            os.path.getsize(self.outfile), 
+            assassin.scan_offsets[self.outfile][1]
+        )
+
+        # only the last complete lines are passed to the repetition detector
+        self.assertEqual(2, assassin._repetition_detector.n_lines)
+
+        self.write(b"Have a nice day\n")
+        self.assertTrue(assassin.is_calculation_finished())
+        self.assertEqual(3, assassin._repetition_detector.n_lines)
+
+
+class TestCodeProfiles(SimulationTestCase):
+    """Tests the detection of codes and the markers of their profiles"""
+
+    def setUp(self):
+        super(TestCodeProfiles, self).setUp()
+        self.file_system = self.simulation.file_system
+
+    def make_assassin(self, code_profile, **kwargs):
+        return self.simulation.make_assassin(
+            FakeAssassin,
+            out_file_name=code_profiles[code_profile].out_files,
+            code_profile=code_profile,
+            **kwargs
+        )
+
+    def test_code_is_detected_from_command(self):
+
+        for command, name in [
+            (["mpirun", "aims.191127.scalapack.mpi.x"], "aims"),
+            (["srun", "/opt/vasp/bin/vasp_std"], "vasp"),
+            (["mpirun", "-np", "4", "cp2k.psmp", "-i", "in.inp"], "cp2k"),
+            (["mpirun", "pw.x", "-in", "scf.in"], "qe"),
+            (["/opt/orca/orca", "job.inp"], "orca")
+        ]:
+            self.assertEqual(name, detect_code_profile(command).name)
+
+        self.assertIsNone(detect_code_profile(["python", "run.py"]))
+
+    def test_finish_markers_of_all_codes(self):
+
+        for name, profile in code_profiles.items():
+            assassin = self.make_assassin(name)
+            main_outfile = profile.out_files[0]
+
+            self.file_system.write(main_outfile, "starting\n")
+            self.assertFalse(assassin.is_calculation_finished(), msg=name)
+
+            self.file_system.write(
+                main_outfile, 
+                " " + profile.finish_markers[0] + " 2019\n"
+            )
+            self.assertTrue(assassin.is_calculation_finished(), msg=name)
+
+    def test_crash_signature_is_found(self):
+
+        assassin = self.make_assassin("vasp")
+        self.file_system.write("OSZICAR", "")
+        self.file_system.write("OUTCAR", "running\n" * 100)
+        assassin.poll_outfiles()
+
+        # split between two polls
+        self.file_system.write("OUTCAR", " |     VERY BAD NEWS! inter")
+        assassin.poll_outfiles()
+        self.file_system.write("OUTCAR", "nal error in subroutine SGRCON\n")
+
+        self.assertRaises(CalculationCrashFoundByOutfile, assassin.poll_outfiles)
+        self.assertEqual("crashed", assassin.verdict)
+        self.assertEqual(
+            "|     VERY BAD NEWS! internal error in subroutine SGRCON",
+            assassin.crash_signature
+        )
+
+    def test_crash_signature_in_notify_mode(self):
+
+        assassin = self.make_assassin(
+            "vasp", timeout=15, polling_period=1, email="test@test.test"
+        )
+        steps = [("write", "OSZICAR", ""), ("write", "OUTCAR", "running\n")]
+        steps += [("sleep", 600)]
+        steps += [("write", "OUTCAR", 
+            " |     VERY BAD NEWS! internal error in subroutine SGRCON\n")]
+        steps += [("write", "OUTCAR", "waiting\n"), ("sleep", 60)] * 60
+        steps += [("exit", 0)]
+        self.simulation.launch(assassin, steps)
+
+        self.assertRaises(SystemExit, assassin.lurk_and_notify)
+
+        assassin._email_handler.assert_expected_counts_errors(
+            {"crashed": 1, "assassin_error": 0}
+        )
+
+        # kept watching until the calculation ended
+        self.assertEqual("finished", assassin.verdict)
+
+    def test_iterations_are_counted_once(self):
+
+        assassin = self.make_assassin("aims")
+        assassin.scan_chunk_size = 100
+
+        for i in range(50):
+            self.file_system.write(
+                "aims.out", 
+                "  Begin self-consistency iteration #{0:>4}\n".format(i)
+            )
+            if i % 7 == 0:
+                assassin.is_calculation_finished()
+        assassin.is_calculation_finished()
+
+        self.assertEqual(50, assassin.n_iterations)
+
+    def test_all_markers_are_found_in_one_pass(self):
+
+        matcher = OutputMatcher(
+            ["Have a nice day"], 
+            [r"forrtl: severe \(\d+\)"], 
+            [r"Begin self-consistency iteration"]
+        )
+        data = b"Begin self-consistency iteration #1\n" \
+            b"forrtl: severe (174): SIGSEGV\nHave a nice day\n"
+
+        self.assertEqual(
+            [OutputMatcher.ITERATION, OutputMatcher.CRASH, OutputMatcher.FINISH],
+            [kind for kind, match in matcher.finditer(data)]
+        )
+        self.assertTrue(matcher.find_finish(data))
+        self.assertFalse(matcher.find_finish(data, 0, 40))
+
+
+class BlockingFileSystem(VirtualFileSystem):
+    """Opening the files given in blocked hangs (like on a stuck file 
+    system) until release is set"""
+
+    def __init__(self, clock, blocked):
+        super(BlockingFileSystem, self).__init__(clock)
+        self.blocked = blocked
+        self.release = threading.Event()
+
+    def open(self, path, mode="r"):
+        if path in self.blocked:
+            self.release.wait()
+        return super(BlockingFileSystem, self).open(path, mode)
+
+
+class TestDiagnosticBundle(SimulationTestCase):
+    """Tests the collection of diagnostics before a kill"""
+
+    def setUp(self):
+        super(TestDiagnosticBundle, self).setUp()
+        self.path = os.path.join(self.folder, "diagnostics.tar.gz")
+
+    def members(self):
+        import tarfile
+        with tarfile.open(self.path) as tar:
+            return dict(
+                (m.name.split("/", 1)[1], tar.extractfile(m).read()) \
+                    for m in tar.getmembers()
+            )
+
+    @unittest.skipUnless(os.path.isdir("/proc/self"), "needs /proc")
+    def test_processes_and_outfiles_are_collected(self):
+
+        outfile = os.path.join(self.folder, "calc.out")
+        with open(outfile, "w") as f:
+            f.write("".join("line {0}\n".format(i) for i in range(10000)))
+
+        assassin = FakeAssassin(out_file_name=outfile, err_file_name=None)
+        assassin.start_calculation_process(["sleep", "30"])
+        pid = assassin._calculation_process.pid
+        try:
+            summary = DiagnosticBundle(self.path, tail_size=1000).collect(
+                assassin, reason="Timeout of 15 minutes was exceeded."
+            )
+        finally:
+            assassin.terminate_calculation_process()
+            assassin._calculation_process.wait()
+
+        self.assertIn("Reason: Timeout of 15 minutes", summary)
+        self.assertIn("  {0} S".format(pid), summary)
+        self.assertIn("line 9999", summary)
+        self.assertIn("Full bundle: " + self.path, summary)
+
+        members = self.members()
+        self.assertEqual(summary.encode(), members["summary.txt"] + \
+            ("Full bundle: " + self.path + "\n").encode())
+        for name in ["stat", "status", "wchan", "fds"]:
+            self.assertIn("proc/{0}/{1}".format(pid, name), members)
+        self.assertEqual(1000, len(members["tails/" + outfile.lstrip("/")]))
+
+    def test_hanging_files_do_not_delay_the_kill(self):
+
+        simulation = Simulation()
+        simulation.file_system = BlockingFileSystem(
+            simulation.clock, blocked=["hanging.out"]
+        )
+        simulation.file_system.write("calc.out", "still fine\n")
+        simulation.file_system.write("hanging.out", "never read\n")
+
+        assassin = simulation.make_assassin(
+            FakeAssassin, 
+            out_file_name=["calc.out", "hanging.out"],
+            err_file_name=None
+        )
+
+        time_start = time.monotonic()
+        try:
+            summary = DiagnosticBundle(self.path, deadline=0.5).collect(
+                assassin
+            )
+        finally:
+            simulation.file_system.release.set()
+
+        self.assertLess(time.monotonic() - time_start, 2)
+        self.assertIn("Left out (deadline or size): tails/hanging.out", summary)
+        self.assertIn("still fine", self.members()["tails/calc.out"].decode())
+
+    def test_bundle_is_capped(self):
+
+        simulation = Simulation()
+        for i in range(5):
+            simulation.file_system.write("calc_{0}.out".format(i), "x" * 50000)
+
+        assassin = simulation.make_assassin(
+            FakeAssassin, 
+            out_file_name=["calc_*.out"],
+            err_file_name=None
+        )
+        DiagnosticBundle(self.path, max_size=64 * 1024 + 120000).collect(
+            assassin
+        )
+
+        sizes = [len(data) for name, data in self.members().items() \
+            if name.startswith("tails/")]
+        self.assertEqual([50000, 50000, 20000], sorted(sizes)[::-1][:3])
+
+    def test_summary_is_mailed(self):
+
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            FakeAssassin, 
+            timeout=5,
+            polling_period=1,
+            out_file_name="calc.out",
+            email="user@dummy.lol",
+            diagnostic_bundle=DiagnosticBundle(self.path)
+        )
+        simulation.launch(
+            assassin, Simulation.writes_then_stalls("calc.out", 3, 60, 3600)
+        )
+
+        try:
+            assassin._lurk()
+        except CalculationTimeout as ex:
+            assassin.collect_diagnostics(ex)
+
+        with mock.patch.object(assassin, "send_email") as send_email:
+            assassin.send_email_notification_timeout()
+
+        message = send_email.call_args[1]["message"]
+        self.assertIn("Diagnostics collected before the job", message)
+        self.assertIn("Verdict: timeout", message)
+        self.assertIn("Loop 2", message)
+        self.assertTrue(os.path.exists(self.path))
+
+
+class StatRecordingFileSystem(FileSystem):
+    """Records the paths that were stat'ed"""
+
+    def __init__(self):
+        self.stated = []
+
+    def stat(self, path):
+        self.stated.append(path)
+        return super(StatRecordingFileSystem, self).stat(path)
+
+
+class TestPipeCapture(SimulationTestCase):
+    """Tests capturing the output of the calculation through pipes"""
+
+    def setUp(self):
+        super(TestPipeCapture, self).setUp()
+        self.outfile = os.path.join(self.folder, "calc.out")
+        self.errfile = os.path.join(self.folder, "calc.err")
+
+    def writer(self, n_lines):
+        """Command of a child that writes n_lines lines (and the end of 
+        calculation string) to stdout and a warning to stderr"""
+        return [
+            sys.executable, "-c",
+            "import sys\n"
+            "for i in range({0}):\n"
+            "    sys.stdout.write('step {{0}}\\n'.format(i))\n"
+            "sys.stdout.write('Have a nice day\\n')\n"
+            "sys.stderr.write('warning\\n')\n".format(n_lines)
+        ]
+
+    def test_output_is_copied_and_checked_without_stat(self):
+
+        file_system = StatRecordingFileSystem()
+        assassin = FakeAssassin(
+            out_file_name=self.outfile,
+            err_file_name=self.errfile,
+            capture_output=True,
+            file_system=file_system
+        )
+        assassin.start_calculation_process(self.writer(300000))
+
+        self.assertEqual(0, assassin._calculation_process.wait())
+        for pump in assassin._pumps.values():
+            self.assertTrue(pump.wait(timeout=30))
+
+        self.assertTrue(assassin.is_calculation_finished())
+        self.assertGreater(assassin.time_last_modified(self.outfile), 0)
+        self.assertEqual([], file_system.stated)
+
+        with open(self.outfile) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(300001, len(lines))
+        self.assertEqual("step 299999", lines[-2])
+        self.assertEqual(os.path.getsize(self.outfile), 
+            assassin.outfile_sizes[self.outfile])
+
+        with open(self.errfile) as f:
+            self.assertEqual("warning\n", f.read())
+
+    def test_marker_split_across_reads_is_found(self):
+
+        assassin = FakeAssassin(
+            out_file_name=self.outfile, 
+            err_file_name=None,
+            capture_output=True
+        )
+        read, write = os.pipe()
+        with open(read, "rb", buffering=0) as pipe:
+            pump = assassin._pumps[self.outfile] = \
+                OutputPump(pipe, self.outfile)
+
+            os.write(write, b"step 1\nHave a ")
+            time.sleep(0.2)
+            self.assertFalse(assassin.is_calculation_finished())
+
+            os.write(write, b"nice day\n")
+            os.close(write)
+            self.assertTrue(pump.wait(timeout=30))
+            self.assertTrue(assassin.is_calculation_finished())
+
+    def test_output_the_checks_can_not_keep_up_with_is_dropped(self):
+
+        assassin = FakeAssassin(
+            out_file_name=self.outfile, 
+            err_file_name=None,
+            capture_output=True
+        )
+        read, write = os.pipe()
+        with open(read, "rb", buffering=0) as pipe:
+            pump = OutputPump(pipe, self.outfile)
+            pump.max_pending = 1000
+            assassin._pumps[self.outfile] = pump
+
+            for i in range(100):
+                os.write(write, b"x" * 99 + b"\n")
+            os.write(write, b"Have a nice day\n")
+            os.close(write)
+            self.assertTrue(pump.wait(timeout=30))
+
+        # the file is complete, only the checks missed some output
+        self.assertEqual(10016, os.path.getsize(self.outfile))
+        self.assertEqual(10016, pump.n_bytes)
+        self.assertGreater(pump.n_skipped, 0)
+
+        self.assertTrue(assassin.is_calculation_finished())
+        LoggerMock.assert_expected_counts([0, 0, 1, 0])
+
+    def test_wild_cards_can_not_be_captured(self):
+
+        assassin = FakeAssassin(
+            out_file_name=os.path.join(self.folder, "*.out"),
+            capture_output=True
+        )
+        self.assertRaises(
+            ValueError, assassin.start_calculation_process, ["true"]
+        )
+
+    def test_outfiles_the_code_writes_itself_are_not_captured(self):
+
+        # vasp writes OUTCAR itself, its stdout must not end up in there
+        assassin = FakeAssassin(
+            out_file_name=os.path.join(self.folder, "OUTCAR"),
+            code_profile="vasp",
+            capture_output=True
+        )
+        self.assertRaises(
+            ValueError, assassin.start_calculation_process, ["true"]
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "OUTCAR")))
+
+
+class TestRankProgressTracker(unittest.TestCase):
+    """Tests tracking the outfiles of the ranks one by one"""
+
+    def setUp(self):
+        LoggerMock.reset_counter()
+
+    def steps(self, n_ranks, n_dead, n_writes):
+        """Steps of a calculation whose ranks write to rank_<i>.out every
+        minute, but the last n_dead stop after their first line"""
+        steps = []
+        for step in range(n_writes):
+            steps.append(("write", "calc.out", "step\n"))
+            for rank in range(n_ranks if step == 0 else n_ranks - n_dead):
+                steps.append(("write", "rank_{0}.out".format(rank), "step\n"))
+            steps.append(("sleep", 60))
+        steps.append(("exit", 0))
+        return steps
+
+    def lurk(self, rank_tracker):
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            FakeAssassin,
+            timeout=15,
+            polling_period=1,
+            out_file_name=["calc.out", "rank_*.out"],
+            rank_tracker=rank_tracker
+        )
+        simulation.launch(assassin, self.steps(8, 2, 120))
+        return assassin, simulation.clock
+
+    def test_live_ranks_do_not_hide_stalled_ones(self):
+
+        assassin, clock = self.lurk(None)
+        assassin._lurk()
+        self.assertEqual("finished", assassin.verdict)
+
+        tracker = RankProgressTracker(15 * 60, max_stalled=2)
+        assassin, clock = self.lurk(tracker)
+        with self.assertRaises(CalculationRanksStalled) as context:
+            assassin._lurk()
+
+        self.assertEqual("timeout", assassin.verdict)
+        self.assertIn("2 of 9 ranks", str(context.exception))
+        self.assertIn("rank_6.out, rank_7.out", str(context.exception))
+        self.assertLess(clock.time_now() - 1.5e9, 18 * 60)
+
+        # they were reported as lagging behind before
+        self.assertEqual(1, LoggerMock.log_counter[2])
+
+    def test_fraction_of_ranks(self):
+
+        tracker = RankProgressTracker(15 * 60, max_stalled=0.25)
+        assassin, _ = self.lurk(tracker)
+        assassin._lurk()
+        self.assertEqual("finished", assassin.verdict)
+
+        tracker = RankProgressTracker(15 * 60, max_stalled=0.2)
+        self.assertRaises(CalculationRanksStalled, self.lurk(tracker)[0]._lurk)
+
+    def test_ranks_that_are_no_longer_matched_are_dropped(self):
+
+        tracker = RankProgressTracker(100)
+        tracker.update(["a", "b", "c"], [10, 20, 30], [1, 2, 3], 0)
+        tracker.update(["c", "a"], [30, 40], [3, 4], 0)
+
+        self.assertEqual(["a", "c"], tracker.paths)
+        self.assertEqual([40, 30], list(tracker.times_last_update))
+        self.assertEqual([4, 3], list(tracker.sizes))
+
+        tracker.update(["a", "c", "d"], [40, 30, 5], [4, 3, 0], 10)
+        self.assertEqual(["a", "c", "d"], tracker.paths)
+        self.assertEqual(10, tracker.times_last_update[2])
+
+    def test_ten_thousand_ranks(self):
+
+        n = 10000
+        paths = ["rank_{0}.out".format(i) for i in range(n)]
+        tracker = RankProgressTracker(900, max_stalled=20, min_lag=60)
+
+        time_start = time.perf_counter()
+        for poll in range(10):
+            time_now = 1000.0 + 60 * poll
+            times = [time_now - (i % 50) for i in range(n)]
+
+            # 10 ranks stop writing, 10 write less often
+            for i in range(10):
+                times[i] = 1000.0
+                times[10 + i] = time_now - 500
+            tracker.update(paths, times, [poll] * n, 0)
+
+            if poll < 9:
+                tracker.check(time_now)
+
+        self.assertLess((time.perf_counter() - time_start) / 10, 0.2)
+        # the stopped ranks lag behind until they are stalled
+        self.assertEqual(list(range(20)), tracker.lagging)
+        self.assertEqual([], tracker.stalled)
+
+        tracker.update(paths, times, [10] * n, 0)
+        with self.assertRaises(CalculationRanksStalled) as context:
+            tracker.max_stalled = 10
+            tracker.check(1000.0 + 930)
+        self.assertIn("10 of 10000 ranks", str(context.exception))
+
+
+class TestSubcalculations(SimulationTestCase):
+    """Tests tracking the outfiles matched by wild cards as
+    sub-calculations of their own"""
+
+    @staticmethod
+    def steps(durations):
+        """Steps of a driver whose sub-calculation i writes to
+        sub_<i>/aims.out every minute and finishes after durations[i]
+        minutes (or stalls if the duration is negative)"""
+        steps = []
+        for minute in range(max(abs(d) for d in durations) + 60):
+            for i, duration in enumerate(durations):
+                path = "sub_{0}/aims.out".format(i)
+                if minute < abs(duration):
+                    steps.append(("write", path, "step\n"))
+                elif minute == duration:
+                    steps.append(("write", path, "Have a nice day.\n"))
+            steps.append(("sleep", 60))
+        steps.append(("exit", 0))
+        return steps
+
+    def lurk(self, durations, tracker, file_system=None):
+        if not file_system is None:
+            self.simulation.file_system = file_system
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=15,
+            polling_period=1,
+            out_file_name="sub_*/aims.out",
+            subcalculation_tracker=tracker
+        )
+        self.simulation.launch(assassin, self.steps(durations))
+        return assassin
+
+    def test_first_finished_subcalculation_does_not_end_the_watch(self):
+
+        # without the tracker the first outfile is the main one
+        assassin = self.lurk([5, 30, 60], None)
+        assassin._lurk()
+        self.assertLess(
+            self.simulation.clock.time_now() - assassin.time_calculation_start,
+            10 * 60
+        )
+
+        self.simulation = Simulation()
+        tracker = SubcalculationTracker(15 * 60, n_expected=3, n_threads=2)
+        assassin = self.lurk([5, 30, 60], tracker)
+        assassin._lurk()
+        assassin._close()
+
+        time_finished = \
+            self.simulation.clock.time_now() - assassin.time_calculation_start
+        self.assertGreaterEqual(time_finished, 60 * 60)
+        self.assertLessEqual(time_finished, 62 * 60)
+        self.assertEqual(
+            {"finished": 3, "running": 0, "stalled": 0}, tracker.count()
+        )
+
+        metrics = MetricsExporter(job_id=1).render(assassin)
+        self.assertIn(
+            'slurm_assassin_subcalculations{job_id="1",state="finished"} 3.0',
+            metrics
+        )
+
+    def test_timeout_only_applies_to_running_subcalculations(self):
+
+        # sub_1 stalls after 10 minutes, sub_2 keeps running for an hour
+        tracker = SubcalculationTracker(15 * 60)
+        assassin = self.lurk([5, -10, 60], tracker)
+
+        with self.assertRaises(CalculationTimeout) as context:
+            assassin._lurk()
+
+        # the stall is reported right away, the job only times out when
+        # the last running sub-calculation has finished
+        self.assertEqual(1, LoggerMock.log_counter[2])
+        time_detected = \
+            self.simulation.clock.time_now() - assassin.time_calculation_start
+        self.assertGreaterEqual(time_detected, 60 * 60)
+        self.assertLessEqual(time_detected, 62 * 60)
+        self.assertIn("sub_1/aims.out", str(context.exception))
+        self.assertEqual(["sub_1/aims.out"], tracker.paths(tracker.STALLED))
+
+    def test_ranks_can_not_be_tracked_as_well(self):
+
+        self.assertRaises(
+            ValueError,
+            self.simulation.make_assassin,
+            SlurmAssassin,
+            out_file_name="sub_*/aims.out",
+            rank_tracker=RankProgressTracker(15 * 60),
+            subcalculation_tracker=SubcalculationTracker(15 * 60)
+        )
+
+    def test_only_appended_output_is_read(self):
+
+        file_system = ReadCountingFileSystem(self.simulation.clock)
+        tracker = SubcalculationTracker(15 * 60, n_expected=2)
+        assassin = self.lurk([20, 30], tracker, file_system)
+        assassin._lurk()
+
+        size = sum(
+            file_system.stat("sub_{0}/aims.out".format(i)).st_size \
+                for i in range(2)
+        )
+        self.assertEqual(size, file_system.bytes_read)
+
+
+class TestEventLog(SimulationTestCase):
+    """Tests the structured (json lines) event log"""
+
+    def setUp(self):
+        super(TestEventLog, self).setUp()
+        self.path = os.path.join(self.folder, "events.jsonl")
+
+    def read(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_events_of_a_killed_job(self):
+
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            FakeAssassin,
+            timeout=5,
+            polling_period=1,
+            out_file_name="calc.out",
+            event_log=EventLog(self.path, job_id=75129)
+        )
+        assassin._scancel_command = ["true"]
+        simulation.launch(
+            assassin, Simulation.writes_then_stalls("calc.out", 3, 60, 3600)
+        )
+
+        # the start is written right away, the polls are buffered
+        self.assertEqual(["start"], [e["type"] for e in self.read()])
+
+        self.assertRaises(CalculationTimeout, assassin._lurk)
+        assassin.kill_job()
+        assassin._close()
+
+        events = self.read()
+        types = [e["type"] for e in events]
+        self.assertEqual(["start"], types[:1])
+        self.assertEqual(["verdict", "kill", "end"], types[-3:])
+        self.assertEqual(set(["poll"]), set(types[1:-3]))
+
+        for event in events:
+            self.assertEqual(
+                ["v", "type", "job_id", "detector", "time", "monotonic",
+                    "values"],
+                list(event)
+            )
+            self.assertEqual(EventLog.schema_version, event["v"])
+            self.assertEqual("75129", event["job_id"])
+
+        verdict = events[-3]
+        self.assertEqual("outfiles", verdict["detector"])
+        self.assertEqual("timeout", verdict["values"]["verdict"])
+        self.assertEqual("CalculationTimeout", verdict["values"]["exception"])
+        self.assertEqual(
+            simulation.clock.time_now(), events[-1]["time"]
+        )
+        self.assertGreater(
+            events[-4]["values"]["seconds_since_last_update"], 300
+        )
+        self.assertEqual("cancel", events[-2]["values"]["action"])
+
+        times = [e["monotonic"] for e in events]
+        self.assertEqual(sorted(times), times)
+
+    def test_volume_is_capped(self):
+
+        log = EventLog(self.path, job_id=1, max_bytes=2000)
+        for i in range(100):
+            log.write("poll", float(i), "outfiles", {"outfile_bytes": i})
+        log.write("verdict", 100.0, "outfiles", {"verdict": "timeout"})
+        log.close()
+
+        events = self.read()
+        self.assertEqual("verdict", events[-1]["type"])
+        self.assertEqual(100, log.n_written + log.n_dropped - 1)
+        self.assertGreater(log.n_dropped, 0)
+        self.assertLessEqual(
+            os.path.getsize(self.path) - len(json.dumps(events[-1])), 2000
+        )
+
+        # the cap holds for appended logs as well
+        log = EventLog(self.path, job_id=1, max_bytes=2000)
+        log.write("poll", 101.0, "outfiles", {})
+        log.close()
+        self.assertEqual(1, log.n_dropped)
+
+        self.assertRaises(ValueError, log.write, "unknown", 0.0)
+
+
+class TestOutputGrowthGuard(SimulationTestCase):
+    """Tests the detection of runaway output"""
+
+    def lurk(self, output_guard, line, n_lines=1000):
+        """Run a calculation that writes line every 10 s"""
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=60,
+            polling_period=1,
+            out_file_name="calc.out",
+            output_guard=output_guard
+        )
+        steps = [("write", "calc.out", line), ("sleep", 10)] * n_lines
+        steps += [("write", "calc.out", "Have a nice day\n"), ("exit", 0)]
+        self.simulation.launch(assassin, steps)
+
+        assassin._lurk()
+
+        return assassin
+
+    def test_runaway_output_is_detected(self):
+
+        guard = OutputGrowthGuard(max_growth_rate=50e3)
+
+        with self.assertRaises(CalculationRunawayOutput) as context:
+            self.lurk(guard, "x" * 1000000)
+
+        self.assertIn("MB/s", str(context.exception))
+        self.assertIsInstance(context.exception, CalculationCrashed)
+
+        # no verdict before the ring buffer is filled
+        self.assertEqual(5, len(guard.samples))
+        self.assertAlmostEqual(100e3, guard.growth_rate, delta=10e3)
+
+    def test_normal_output_is_tolerated(self):
+
+        assassin = self.lurk(
+            OutputGrowthGuard(max_growth_rate=50e3, quota=1e9), 
+            "x" * 100,
+            n_lines=100
+        )
+        self.assertEqual("finished", assassin.verdict)
+
+    def test_disk_that_would_fill_up_before_the_job_ends(self):
+
+        self.simulation.file_system.capacity = 10e6
+        guard = OutputGrowthGuard(
+            time_end=self.simulation.clock.time_now() + 24 * 3600
+        )
+
+        with self.assertRaises(CalculationRunawayOutput) as context:
+            self.lurk(guard, "x" * 100000)
+        self.assertIn("before the job ends", str(context.exception))
+
+        # without a known end of the job only a full disk counts
+        guard = OutputGrowthGuard()
+        with self.assertRaises(CalculationRunawayOutput) as context:
+            self.lurk(guard, "x" * 100000)
+        self.assertIn("No space left", str(context.exception))
+
+    def test_runaway_output_in_notify_mode(self):
+
+        assassin = self.simulation.make_assassin(
+            FakeAssassin,
+            timeout=60,
+            polling_period=1,
+            out_file_name="calc.out",
+            email="test@test.test",
+            output_guard=OutputGrowthGuard(max_growth_rate=50e3)
+        )
+        self.simulation.launch(
+            assassin, 
+            [("write", "calc.out", "x" * 1000000), ("sleep", 10)] * 100 + \
+                [("exit", 0)]
+        )
+
+        self.assertRaises(SystemExit, assassin.lurk_and_notify)
+
+        # reported once as a crash, not as an error of the assassin
+        assassin._email_handler.assert_expected_counts_errors(
+            {"crashed": 1, "assassin_error": 0}
+        )
+
+        # kept watching until the calculation ended
+        self.assertEqual("finished", assassin.verdict)
+
+    def test_job_end_time(self):
+
+        self.assertEqual(
+            1.5e9, 
+            OutputGrowthGuard.job_end_time({"SLURM_JOB_END_TIME": "1500000000"})
+        )
+        self.assertIsNone(OutputGrowthGuard.job_end_time({}))
+
+
+class TestRepetitionDetector(SimulationTestCase):
+    """Tests the detection of output that only repeats itself"""
+
+    def test_period_is_found(self):
+
+        detector = RepetitionDetector(60)
+
+        detector.feed(b"".join(
+            "Step {0}\n".format(i).encode() for i in range(100)
+        ))
+        self.assertIsNone(detector.period)
+
+        # lines may be split between two feeds
+        block = b"Warning: A\nWarning: B\nWarning: C\n" * 10
+        detector.feed(block[:50])
+        detector.feed(block[50:])
+        self.assertEqual(3, detector.period)
+
+        detector.feed(b"Something new\n")
+        self.assertIsNone(detector.period)
+
+    def test_numbers_can_be_ignored(self):
+
+        lines = b"".join(
+            "iteration {0}: not converged\n".format(i).encode() 
+                for i in range(20)
+        )
+
+        detector = RepetitionDetector(60)
+        detector.feed(lines)
+        self.assertIsNone(detector.period)
+
+        detector = RepetitionDetector(60, ignore_numbers=True)
+        detector.feed(lines)
+        self.assertEqual(1, detector.period)
+
+    def test_cycle_is_kept_across_skipped_output(self):
+
+        block = b"Warning: A\nWarning: B\nWarning: C\n"
+
+        detector = RepetitionDetector(60)
+        detector.feed(block * 10)
+        self.assertFalse(detector.is_stuck(0))
+
+        # continues in the middle of the cycle
+        detector.skip()
+        detector.feed(b"Warning: C\n" + block * 5)
+        self.assertEqual(3, detector.period)
+        self.assertTrue(detector.is_stuck(61))
+
+        # something else after the gap is a new start
+        detector.skip()
+        detector.feed(b"Step 1\n" + block * 5)
+        self.assertFalse(detector.is_stuck(122))
+
+    def test_memory_is_bounded(self):
+
+        detector = RepetitionDetector(60, max_period=16)
+        for i in range(1000):
+            detector.feed("".join(
+                "line {0}\n".format(j % 7 + i) for j in range(100)
+            ).encode())
+
+        self.assertEqual(100000, detector.n_lines)
+        self.assertEqual(16, len(detector._hashes))
+        self.assertLessEqual(len(detector._positions), 16)
+        self.assertLessEqual(len(detector._runs), 16)
+
+    def lurk(self, steps, email=None):
+
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            FakeAssassin,
+            timeout=15,
+            polling_period=1,
+            out_file_name="calc.out",
+            email=email,
+            repetition_detector=RepetitionDetector(30 * 60)
+        )
+        simulation.launch(assassin, steps)
+        
+        return assassin, simulation.clock
+
+    def test_looping_calculation_is_detected(self):
+
+        steps = Simulation.writes_then_stalls("calc.out", 10, 60, 0)[:-2]
+        steps += [
+            ("write", "calc.out", "SCF not converged\nretrying\n"), 
+            ("sleep", 10)
+        ] * 10000
+
+        assassin, clock = self.lurk(steps)
+
+        self.assertRaises(CalculationRepeatingOutput, assassin._lurk)
+        self.assertEqual("crashed", assassin.verdict)
+
+        # repetition noticed within a poll after the loop started (10 min),
+        # killed 30 min later
+        time_loop = 1.5e9 + 10 * 60
+        self.assertGreater(clock.time_now() - time_loop, 30 * 60)
+        self.assertLess(clock.time_now() - time_loop, 33 * 60)
+
+    def test_looping_calculation_in_notify_mode(self):
+
+        steps = Simulation.writes_then_stalls("calc.out", 10, 60, 0)[:-2]
+        steps += [
+            ("write", "calc.out", "SCF not converged\nretrying\n"), 
+            ("sleep", 10)
+        ] * 1000
+        steps += [("exit", 0)]
+
+        assassin, clock = self.lurk(steps, email="test@test.test")
+        self.assertRaises(SystemExit, assassin.lurk_and_notify)
+
+        # one mail about the crash, none about an error of the assassin
+        assassin._email_handler.assert_expected_counts_errors(
+            {"crashed": 1, "assassin_error": 0}
+        )
+        self.assertEqual(1, assassin._email_handler.counter_overall)
+
+    def test_fast_looping_calculation_is_detected(self):
+
+        # the outfile grows by more than a chunk per poll, so most of the 
+        # output is skipped (see SlurmAssassin._search_backwards)
+        path = os.path.join(self.folder, "calc.out")
+        clock = VirtualClock()
+        detector = RepetitionDetector(10 * 60)
+        assassin = SlurmAssassin(
+            timeout=15,
+            polling_period=1,
+            out_file_name=path,
+            clock=clock,
+            repetition_detector=detector
+        )
+        assassin.scan_chunk_size = 4096
+
+        block = b"SCF not converged\nretrying\nmixing 0.2\n"
+        with open(path, "wb") as f:
+            for poll in range(30):
+                f.write(block * 500)
+                f.flush()
+
+                assassin.is_calculation_finished()
+                if detector.is_stuck(clock.time_now()):
+                    break
+                clock.sleep(60)
+
+        self.assertEqual(3, detector.period)
+        self.assertEqual(11, poll)
+
+    def test_progressing_calculation_is_not_killed(self):
+
+        steps = Simulation.writes_then_stalls("calc.out", 300, 10, 0)[:-1]
+        steps += [("write", "calc.out", "Have a nice day\n"), ("exit", 0)]
+
+        assassin, clock = self.lurk(steps)
+        assassin._lurk()
+
+        self.assertEqual("finished", assassin.verdict)
+
+
+class TestStartup(unittest.TestCase):
+    """Tests that the watchdog starts with a few standard library modules"""
+
+    def test_heavy_modules_are_not_imported(self):
+
+        root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        output = sp.check_output(
+            [sys.executable, "-c", 
+                "import sys, assassin; print(' '.join(sys.modules))"],
+            cwd=root,
+            env=dict(os.environ, PYTHONPATH=root)
+        ).decode()
+        modules = set(m.split(".")[0] for m in output.split())
+
+        for module in ["numpy", "scipy", "smtplib", "email", "argparse"]:
+            self.assertNotIn(module, modules)
+
+    def test_command_line_is_parsed_without_argparse(self):
+
+        root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        output = sp.check_output(
+            [sys.executable, "-c", 
+                "import sys, assassin\n"
+                "args = assassin.build_parser().parse_args(\n"
+                "    ['-c', 'mpirun', 'aims.x', '-T', '30', '--notify-only']\n"
+                ")\n"
+                "print(args.timeout, 'argparse' in sys.modules)"],
+            cwd=root,
+            env=dict(os.environ, PYTHONPATH=root)
+        ).decode()
+
+        self.assertEqual("30.0 False", output.strip())
+
+    def test_command_line_is_parsed_as_by_argparse(self):
+
+        parser = build_parser()
+        for argv in [
+            [],
+            ["-c", "mpirun", "-np", "4", "aims.x"],
+            ["-c", "srun", "vasp_std", "-o", "OUTCAR", "OSZICAR", "-p", "2"],
+            ["--notify-only", "-e", "me@test.test", "--shadow"],
+            ["--shadow", "shadow.json", "--time-out=-1.5"],
+            ["--detector", "idle", "--detector", "nodes:timeout=5"],
+            ["--code-profile", "vasp", "--subcalculations", "--state-file",
+                "-"],
+            ["--daemon-socket", "--kill-batching", "--requeue-if", "*.chk"],
+            ["--diagnostics", "--status-segment", "--poll-jitter", "0.1"]
+        ]:
+            try:
+                expected = vars(parser.argparse_parser().parse_args(argv))
+            except SystemExit:
+                expected = None
+
+            with mock.patch.object(parser, "argparse_parser") as fallback:
+                fallback.return_value.parse_args.return_value = None
+                args = parser.parse_args(argv)
+
+            self.assertEqual(expected, None if args is None else vars(args))
+
+    def test_help_is_left_to_argparse(self):
+
+        with mock.patch("sys.stdout", new=io.StringIO()) as stdout:
+            self.assertRaises(SystemExit, build_parser().parse_args, ["-h"])
+        self.assertIn("--time-out", stdout.getvalue())
+
+
+class TestRandomizedScenarios(unittest.TestCase):
+    """Runs many random calculations that stall at some point in virtual 
+    time and checks that the timeout is detected neither too early nor 
+    too late."""
+
+    n_scenarios = int(os.environ.get("SLURM_ASSASSIN_N_SCENARIOS", 1000))
+
+    def setUp(self):
+        LoggerMock.reset_counter()
+
+    def run_scenarios(self, rng, jitter=None):
+        """Run n_scenarios random stalls and check the detection latency. 
+        If jitter is given, the polls are staggered with a random phase 
+        and this jitter."""
+
+        for i in range(self.n_scenarios):
+
+            timeout = rng.uniform(1, 30)
+            polling_period = rng.uniform(0.5, timeout)
+            n_writes = rng.randint(1, 20)
+            write_period = rng.uniform(1, timeout * 60)
+
+            if jitter is None:
+                poll_scheduler, max_interval = None, polling_period * 60
+            else:
+                poll_scheduler = PollScheduler(
+                    polling_period * 60, 
+                    phase=rng.random(), 
+                    jitter=jitter, 
+                    seed=i
+                )
+                max_interval = polling_period * 60 * (1 + jitter)
+
+            simulation = Simulation()
+            assassin = simulation.make_assassin(
+                SlurmAssassin,
+                timeout=timeout,
+                polling_period=polling_period,
+                out_file_name="calc.out",
+                poll_scheduler=poll_scheduler
+            )
+            simulation.launch(
+                assassin, 
+                Simulation.writes_then_stalls(
+                    "calc.out", n_writes, write_period, 10 * timeout * 60
+                )
+            )
+
+            self.assertRaises(CalculationTimeout, assassin._lurk)
+
+            time_stall = assassin.time_calculation_start + \
+                (n_writes - 1) * write_period
+            time_detected = simulation.clock.time_now()
+
+            # never earlier than the timeout, at most one polling period 
+            # (plus the process handle granularity) later.
+            latency = time_detected - time_stall
+            self.assertGreater(latency, assassin.timeout, msg="Scenario " + str(i))
+            self.assertLessEqual(
+                latency,
+                assassin.timeout + max_interval + \
+                    2 * assassin.polling_period_process_handle,
+                msg="Scenario " + str(i)
+            )
+
+        LoggerMock.assert_expected_counts_errors(0)
+
+    def test_timeout_is_detected_within_bounds(self):
+        self.run_scenarios(random.Random(1234))
+
+    def test_staggered_timeout_is_detected_within_bounds(self):
+        self.run_scenarios(random.Random(4321), jitter=0.3)
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def test_phases_are_deterministic(self):
+
+        self.assertEqual(
+            PollScheduler.job_phase(75129), 
+            PollScheduler.job_phase("75129")
+        )
+        self.assertNotEqual(
+            PollScheduler.job_phase(75129), 
+            PollScheduler.job_phase(75130)
+        )
+
+        scheduler = PollScheduler.from_environment(
+            300, 
+            environ={"SLURM_JOB_ID": "75129"}
+        )
+        self.assertEqual(PollScheduler.job_phase(75129), scheduler.phase)
+        self.assertFalse(PollScheduler.from_environment(300, environ={}).staggered)
+
+    def test_array_tasks_are_spread_over_the_period(self):
+
+        phases = sorted(
+            PollScheduler.job_phase(75129, task) for task in range(100)
+        )
+        gaps = np.diff(phases + [phases[0] + 1])
+
+        self.assertLess(gaps.max(), 3.0 / 100)
+
+    def test_jitter_is_bounded(self):
+
+        scheduler = PollScheduler(100, jitter=0.2, seed=1)
+        intervals = []
+        for i in range(1000):
+            scheduler.polled()
+            intervals.append(scheduler.interval)
+
+        self.assertGreaterEqual(min(intervals), 80)
+        self.assertLessEqual(max(intervals), 120)
+        self.assertGreater(np.std(intervals), 5)
+
+
 class TestOutfileParsing(unittest.TestCase):
 
     def setUp(self):
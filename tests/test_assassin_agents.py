@@ -0,0 +1,278 @@
+"""This file contains tests for the node agents, which report the ranks of 
+multi-node calculations to the assassin.
+"""
+import unittest
+import os
+import threading
+import time
+import subprocess as sp
+
+from assassin import CalculationNodeLost, CalculationNodeStalled
+from assassin_agents import NodeAgent, NodeMonitor, NodeAgentDetector
+from assassin_agents import expand_nodelist
+
+from simulation import Simulation
+from test_assassin import LoggerMock, FakeAssassin, SimulationTestCase
+
+
+class FakeRankSampler(object):
+    """Stands in for the ResourceSampler of a NodeAgent, the ranks are set 
+    by the test as dict pid -> (state, cpu time, rss)"""
+
+    def __init__(self, ranks=None):
+        self.ranks = {} if ranks is None else ranks
+
+    def find(self, executables):
+        return dict(self.ranks)
+
+
+class TestNodeAgents(SimulationTestCase):
+    """Tests watching the nodes of a calculation through node agents"""
+
+    def setUp(self):
+        super(TestNodeAgents, self).setUp()
+        self.monitor = NodeMonitor(os.path.join(self.folder, "agents.sock"))
+        self.clock = self.simulation.clock
+        self.agents = {}
+
+    def tearDown(self):
+        self.monitor.close()
+        for agent, step, thread in self.agents.values():
+            agent.stop()
+            step.release()
+            thread.join(10)
+        super(TestNodeAgents, self).tearDown()
+
+    def start_agent(self, node, ranks, token=None):
+        """Start an agent in a thread that reports whenever report is 
+        called"""
+
+        sampler = FakeRankSampler(ranks)
+        step = threading.Semaphore(0)
+        agent = NodeAgent(
+            self.monitor.address, 
+            ["aims"], 
+            node=node, 
+            sampler=sampler,
+            sleep=lambda period: not step.acquire(timeout=10),
+            token=self.monitor.token if token is None else token
+        )
+        thread = threading.Thread(target=agent.run)
+        thread.daemon = True
+        thread.start()
+        self.agents[node] = (agent, step, thread)
+        return sampler
+
+    def receive(self, nodes, n_reports):
+        """Receive until all nodes have sent n_reports reports"""
+        time_end = time.time() + 10
+        while time.time() < time_end:
+            self.monitor.receive(self.clock.time_now())
+            if all(node in self.monitor.nodes and \
+                self.monitor.nodes[node].n_reports >= n_reports \
+                    for node in nodes):
+                return
+            time.sleep(0.01)
+        self.fail("Agents did not report.")
+
+    def report(self, nodes, n_reports, seconds):
+        """Let time pass and the nodes report once more"""
+        self.clock.sleep(seconds)
+        for node in nodes:
+            self.agents[node][1].release()
+        self.receive(nodes, n_reports)
+
+    def test_reports_only_contain_changes(self):
+
+        sampler = FakeRankSampler({
+            1: ("R", 10.0, 1000), 
+            2: ("R", 10.0, 1000)
+        })
+        agent = NodeAgent("unused", ["aims"], node="n1", sampler=sampler)
+
+        self.assertEqual(
+            {"type": "sample", "cpu": 20.0, "ranks": 2, "states": {"R": 2}, 
+                "rss": 2000}, 
+            agent.report()
+        )
+
+        sampler.ranks = {1: ("R", 15.0, 1010), 2: ("R", 15.0, 1000)}
+        self.assertEqual({"type": "sample", "cpu": 10.0}, agent.report())
+
+        # the cpu time of an ended rank is not taken back
+        sampler.ranks = {1: ("D", 15.5, 1010)}
+        self.assertEqual(
+            {"type": "sample", "cpu": 0.5, "ranks": 1, "states": {"D": 1},
+                "rss": 1010},
+            agent.report()
+        )
+
+    def test_nodes_are_aggregated(self):
+
+        self.start_agent("n1", {1: ("R", 0.0, 1024**2)})
+        self.start_agent("n2", {2: ("R", 0.0, 1024**2), 3: ("D", 0.0, 0)})
+        self.receive(["n1", "n2"], 1)
+
+        self.assertEqual(["n1", "n2"], sorted(self.monitor.nodes))
+        self.assertEqual(2, self.monitor.nodes["n2"].ranks)
+        self.assertEqual("n2: 2 ranks (1 D, 1 R), 1 MB", 
+            self.monitor.nodes["n2"].describe())
+
+    def test_only_agents_of_the_job_are_accepted(self):
+
+        import socket
+
+        self.monitor.close()
+        self.monitor = NodeMonitor(
+            os.path.join(self.folder, "agents.sock"), 
+            nodes=expand_nodelist("n[1-2]")
+        )
+
+        self.start_agent("n1", {1: ("R", 0.0, 0)})
+        self.start_agent("n2", {2: ("R", 0.0, 0)}, token="guessed")
+        self.start_agent("n3.cluster", {3: ("R", 0.0, 0)})
+        self.receive(["n1"], 1)
+
+        # connections without hello are dropped after hello_timeout
+        silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        silent.connect(self.monitor.address)
+
+        time_end = time.time() + 10
+        while time.time() < time_end:
+            self.monitor.receive(self.clock.time_now())
+            if self.monitor.n_rejected == 2 and \
+                len(self.monitor._connections) == 2:
+                break
+            time.sleep(0.01)
+
+        self.clock.sleep(self.monitor.hello_timeout + 1)
+        self.monitor.receive(self.clock.time_now())
+        silent.close()
+
+        self.assertEqual(["n1"], list(self.monitor.nodes))
+        self.assertEqual(3, self.monitor.n_rejected)
+        self.assertEqual(1, len(self.monitor._connections))
+        self.assertEqual(4, self.monitor.max_connections)
+
+    def test_nodelist(self):
+
+        self.assertEqual(
+            ["n01", "n02", "n07", "gpu1", "a1b3", "a1b4", "a2b3", "a2b4"],
+            expand_nodelist("n[01-02,07],gpu1,a[1-2]b[3-4]")
+        )
+
+    def test_stalled_node_is_detected(self):
+
+        assassin = FakeAssassin(out_file_name="calc.out", clock=self.clock)
+        detector = NodeAgentDetector(
+            self.monitor, node_timeout=300, duration=600
+        )
+
+        busy = self.start_agent("n1", {1: ("R", 0.0, 0)})
+        stalled = self.start_agent("n2", {2: ("R", 0.0, 0)})
+        self.receive(["n1", "n2"], 1)
+
+        for i in range(1, 8):
+            busy.ranks = {1: ("R", 100.0 * i, 0)}
+            stalled.ranks = {2: ("D", 1.0, 0)}
+            self.report(["n1", "n2"], 1 + i, 100)
+
+            verdict = detector.check(assassin)
+            if i < 6:
+                self.assertIsNone(verdict)
+
+        self.assertEqual("dead", verdict.state)
+        self.assertIsInstance(verdict.exception, CalculationNodeStalled)
+        self.assertIn("node n2", str(verdict.exception))
+
+    def test_silent_node_is_lost(self):
+
+        assassin = FakeAssassin(out_file_name="calc.out", clock=self.clock)
+        detector = NodeAgentDetector(
+            self.monitor, node_timeout=300, duration=3600
+        )
+
+        self.start_agent("n1", {1: ("R", 0.0, 0)})
+        self.start_agent("n2", {})
+        self.receive(["n1", "n2"], 1)
+
+        for i in range(1, 5):
+            self.report(["n1", "n2"], 1 + i, 100)
+            self.assertIsNone(detector.check(assassin))
+
+        # node n2 has no ranks, it is only warned about
+        self.assertEqual(1, LoggerMock.log_counter[2])
+
+        # node n1 stops reporting
+        for i in range(5, 8):
+            self.report(["n2"], 1 + i, 100)
+            self.assertIsNone(detector.check(assassin))
+
+        self.report(["n2"], 9, 100)
+        verdict = detector.check(assassin)
+
+        self.assertEqual("dead", verdict.state)
+        self.assertIsInstance(verdict.exception, CalculationNodeLost)
+        self.assertIn("Node n1 has not reported for 7 minutes", 
+            str(verdict.exception))
+
+    def test_lost_node_in_notify_mode(self):
+
+        simulation = Simulation()
+        self.clock = simulation.clock
+
+        self.start_agent("n1", {1: ("R", 0.0, 0)})
+        self.receive(["n1"], 1)
+
+        # the agent does not report again
+        assassin = simulation.make_assassin(
+            FakeAssassin,
+            timeout=60,
+            polling_period=1,
+            out_file_name="calc.out",
+            email="test@test.test",
+            detectors=[NodeAgentDetector(self.monitor, node_timeout=300)]
+        )
+        simulation.launch(
+            assassin, Simulation.writes_then_stalls("calc.out", 60, 60, 0)
+        )
+
+        self.assertRaises(SystemExit, assassin.lurk_and_notify)
+
+        assassin._email_handler.assert_expected_counts_errors(
+            {"crashed": 1, "assassin_error": 0}
+        )
+
+        # kept watching until the calculation ended
+        self.assertEqual("finished", assassin.verdict)
+
+    @unittest.skipUnless(os.path.isdir("/proc/self"), "needs /proc")
+    def test_local_agent_finds_ranks(self):
+
+        process = sp.Popen(["sleep", "30"])
+        try:
+            self.monitor.launch_agents(["sleep"], period=0.1, launcher=[])
+
+            time_end = time.time() + 30
+            while time.time() < time_end:
+                self.monitor.receive(self.clock.time_now())
+                nodes = list(self.monitor.nodes.values())
+                if nodes and nodes[0].ranks > 0:
+                    break
+                time.sleep(0.05)
+
+            self.assertEqual(1, len(nodes))
+            self.assertGreaterEqual(nodes[0].ranks, 1)
+            self.assertIn("S", nodes[0].states)
+
+        finally:
+            process.kill()
+            process.wait()
+
+        # the agent ends when the assassin is done
+        self.monitor.close()
+        self.assertEqual(0, self.monitor._launcher.wait(timeout=30))
+
+
+if __name__ == '__main__':
+    unittest.main()
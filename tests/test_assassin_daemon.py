@@ -0,0 +1,131 @@
+"""This file contains tests for the assassin daemon, which watches the 
+calculations of many jobs on a node at once.
+"""
+import unittest
+import os
+import sys
+import threading
+import subprocess as sp
+
+from collections import defaultdict
+
+from assassin_daemon import AssassinDaemon, DaemonJobAssassin, DaemonClient
+
+from simulation import Simulation, SimulatedProcess
+from test_assassin import SimulationTestCase
+
+
+class TestAssassinDaemon(SimulationTestCase):
+    """Tests the node-level daemon that watches many jobs at once"""
+
+    class JobAssassin(DaemonJobAssassin):
+        """Records the kills instead of calling scancel"""
+
+        killed_jobs = []
+
+        def kill_job(self):
+            self.killed_jobs.append(self.get_job_id())
+
+    def setUp(self):
+
+        super(TestAssassinDaemon, self).setUp()
+        self.JobAssassin.killed_jobs = []
+
+    def test_jobs_are_watched_in_one_loop(self):
+
+        clock = self.simulation.clock
+        daemon = AssassinDaemon(
+            clock=clock, 
+            file_system=self.simulation.file_system
+        )
+        daemon._job_assassin = self.JobAssassin
+
+        steps = {
+            "1001": Simulation.writes_then_stalls("a.out", 10, 60, 7200),
+            "1002": Simulation.writes_then_stalls("b.out", 30, 60, 0)[:-1] + \
+                [("write", "b.out", "Have a nice day\n"), ("exit", 0)]
+        }
+
+        processes, messages = {}, defaultdict(list)
+        for job_id, out_file in [("1001", "a.out"), ("1002", "b.out")]:
+
+            processes[job_id] = SimulatedProcess(
+                clock, self.simulation.file_system, steps[job_id]
+            )
+
+            def send(message, job_id=job_id):
+                messages[job_id].append(message["type"])
+                if message["type"] == "terminate":
+                    processes[job_id].terminate()
+
+            daemon.register(
+                {
+                    "job_id": job_id, 
+                    "out_file_name": out_file,
+                    "timeout": 5,
+                    "polling_period": 1
+                }, 
+                send
+            )
+
+        # the clients report the exits of their calculations
+        while daemon.jobs:
+            clock.sleep(daemon.time_until_next_check())
+            for job_id, process in processes.items():
+                if not process.poll() is None:
+                    daemon.report_exit(job_id, process.poll())
+            daemon.run_due_checks()
+
+        self.assertEqual(["1001"], self.JobAssassin.killed_jobs)
+        self.assertEqual(["registered", "terminate", "done"], messages["1001"])
+        self.assertEqual(["registered", "done"], messages["1002"])
+        self.assertEqual(-15, processes["1001"].poll())
+        self.assertEqual(0, processes["1002"].poll())
+
+        # the stall (after 10 min) is detected after 5 min plus a poll
+        self.assertLess(clock.time_now() - 1.5e9, 30 * 60 + 2 * 60)
+
+    def test_client_round_trip(self):
+
+        socket_path = os.path.join(self.folder, "daemon.sock")
+        out_file = os.path.join(self.folder, "calc.out")
+        with open(out_file, "w") as f:
+            f.write("Loop 0\n")
+
+        daemon = AssassinDaemon(socket_path)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+
+        try:
+            client = DaemonClient(socket_path)
+            for i in range(100):
+                try:
+                    client.connect()
+                    break
+                except OSError:
+                    threading.Event().wait(0.02)
+
+            process = sp.Popen([sys.executable, "-c", "pass"])
+            verdict = client.watch(
+                process,
+                {
+                    "job_id": 75129,
+                    "out_file_name": out_file,
+                    "timeout": 1,
+                    "polling_period": 0.05
+                },
+                check_period=0.05
+            )
+            client.close()
+
+        finally:
+            daemon.stop()
+            thread.join(5)
+
+        self.assertEqual("finished", verdict)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
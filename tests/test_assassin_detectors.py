@@ -0,0 +1,143 @@
+"""This file contains tests for the detectors, i.e. the checks the 
+assassin runs while it lurks.
+"""
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from assassin import ResourceSample, CalculationCrashed, CalculationIdle
+from assassin_detectors import Detector, Verdict, IdleCpuDetector
+from assassin_detectors import register_detector, detector_registry
+from assassin_detectors import load_detector
+
+from simulation import Simulation
+from test_assassin import LoggerMock, FakeAssassin
+
+
+class CountingDetector(Detector):
+    """Notes the times of its runs"""
+
+    name = "counting"
+
+    def __init__(self, **kwargs):
+        super(CountingDetector, self).__init__(**kwargs)
+        self.run_times = []
+
+    def check(self, assassin):
+        self.run_times.append(assassin.time_now())
+
+
+class TestDetectors(unittest.TestCase):
+    """Tests the scheduling of detectors and their verdicts"""
+
+    def setUp(self):
+        LoggerMock.reset_counter()
+
+    def lurk(self, detectors, steps):
+
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            FakeAssassin,
+            timeout=1000,
+            polling_period=1,
+            out_file_name="calc.out",
+            detectors=detectors
+        )
+        simulation.launch(assassin, steps)
+
+        return assassin, simulation.clock
+
+    def test_detectors_run_at_their_cadence(self):
+
+        every_tick = CountingDetector()
+        every_20_s = CountingDetector(period=20)
+
+        steps = Simulation.writes_then_stalls("calc.out", 10, 60, 0)
+        assassin, clock = self.lurk([every_tick, every_20_s], steps)
+        assassin._lurk()
+
+        self.assertEqual("finished", assassin.verdict)
+
+        # the assassin wakes up at least every 6 s
+        self.assertLessEqual(np.diff(every_tick.run_times).max(), 6 + 1e-6)
+        self.assertGreater(len(every_tick.run_times), len(every_20_s.run_times))
+        np.testing.assert_allclose(20, np.diff(every_20_s.run_times))
+
+    def test_expensive_detectors_keep_their_budget(self):
+
+        detector = CountingDetector(period=20, cpu_budget=0.01)
+
+        steps = Simulation.writes_then_stalls("calc.out", 10, 60, 0)
+        assassin, clock = self.lurk([detector], steps)
+
+        # every run costs 0.5 s of cpu time
+        cpu_times = iter(np.arange(0, 1e4, 0.5))
+        with mock.patch(
+            "assassin.time.process_time", 
+            side_effect=lambda: next(cpu_times)
+        ):
+            assassin._lurk()
+
+        self.assertEqual(0.5, detector.mean_cost)
+        self.assertEqual(50, detector.effective_period)
+        np.testing.assert_allclose(50, np.diff(detector.run_times[1:]))
+
+    def test_dead_verdicts_map_onto_exceptions(self):
+
+        @register_detector
+        class FailingDetector(Detector):
+            name = "failing_test"
+            period = 120
+
+            def check(self, assassin):
+                return Verdict.dead(CalculationCrashed, "broken")
+
+        try:
+            steps = Simulation.writes_then_stalls("calc.out", 10, 60, 0)
+            assassin, clock = self.lurk([load_detector("failing_test")], steps)
+
+            self.assertRaises(CalculationCrashed, assassin._lurk)
+            self.assertEqual("crashed", assassin.verdict)
+            self.assertEqual(1.5e9 + 120, clock.time_now())
+        finally:
+            del detector_registry["failing_test"]
+
+        self.assertEqual("timeout", Verdict.dead(CalculationIdle).name)
+        self.assertRaises(TypeError, Verdict.dead, ValueError)
+
+    def test_detectors_are_loaded_from_specs(self):
+
+        detector = load_detector("cpu_idle,duration=600,min_cpu_fraction=0.1")
+        self.assertIsInstance(detector, IdleCpuDetector)
+        self.assertEqual(600, detector.duration)
+        self.assertEqual(0.1, detector.min_cpu_fraction)
+
+        detector = load_detector("test_assassin_detectors:CountingDetector,period=5")
+        self.assertIsInstance(detector, CountingDetector)
+        self.assertEqual(5, detector.period)
+
+        self.assertRaises(ValueError, load_detector, "no_such_detector")
+
+    def test_idle_calculation_is_detected(self):
+
+        detector = IdleCpuDetector(duration=600, period=60)
+
+        steps = Simulation.writes_then_stalls("calc.out", 1, 60, 1e5)
+        assassin, clock = self.lurk([detector], steps)
+
+        # the calculation computes for 10 minutes, then idles
+        time_start = assassin.time_calculation_start
+        assassin.sample_resources = lambda: ResourceSample(
+            min(clock.time_now() - time_start, 600), 0, 1
+        )
+
+        self.assertRaises(CalculationIdle, assassin._lurk)
+        self.assertEqual("timeout", assassin.verdict)
+        self.assertGreaterEqual(clock.time_now() - time_start, 1200)
+        self.assertLessEqual(clock.time_now() - time_start, 1200 + 2 * 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
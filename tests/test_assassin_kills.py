@@ -0,0 +1,177 @@
+"""This file contains tests for the coordination of the kills of many 
+assassins.
+"""
+import unittest
+import os
+import sys
+import threading
+
+from unittest import mock
+
+from assassin_kills import KillCoordinator
+
+from simulation import Simulation, VirtualClock
+from test_assassin import LoggerMock, FakeAssassin, SimulationTestCase
+from test_assassin import utilities_path
+
+
+class TestKillCoordinator(SimulationTestCase):
+    """Tests the batching of kills (with a stub scancel)"""
+
+    def setUp(self):
+
+        super(TestKillCoordinator, self).setUp()
+        KillCoordinator._logger = LoggerMock
+
+        self.scancel_log = os.path.join(self.folder, "scancel.log")
+        self.failures_file = os.path.join(self.folder, "failures")
+
+        self.environment = mock.patch.dict(os.environ, {
+            "STUB_SCANCEL_LOG": self.scancel_log,
+            "STUB_SCANCEL_FAILURES": self.failures_file
+        })
+        self.environment.start()
+
+        self.scancel_command = [
+            sys.executable, os.path.join(utilities_path, "stub_scancel.py")
+        ]
+
+    def tearDown(self):
+        self.environment.stop()
+        super(TestKillCoordinator, self).tearDown()
+
+    def make_coordinator(self, **kwargs):
+        return KillCoordinator(
+            os.path.join(self.folder, "spool"),
+            scancel_command=self.scancel_command,
+            **kwargs
+        )
+
+    def scancel_calls(self):
+        with open(self.scancel_log) as f:
+            return f.read().splitlines()
+
+    def test_array_tasks_are_collapsed(self):
+
+        self.assertEqual(
+            ["4242", "75129_[1-3,7]", "75130_2"],
+            KillCoordinator.collapse(
+                ["75129_3", "75129_1", "4242", "75129_2", "75130_2", "75129_7"]
+            )
+        )
+
+    def test_pending_requests_are_batched(self):
+
+        coordinator = self.make_coordinator(clock=VirtualClock())
+
+        # requests of other assassins
+        for target in ["75129_1", "75129_2", "75129_3", "75129_7", "4242"]:
+            coordinator.enqueue(target)
+
+        coordinator.request("75129_5")
+
+        # the own job is cancelled last
+        self.assertEqual(
+            ["4242 75129_[1-3,7]", "75129_5"], 
+            self.scancel_calls()
+        )
+        self.assertEqual([], coordinator.pending())
+
+    def test_controller_timeouts_are_retried(self):
+
+        with open(self.failures_file, "w") as f:
+            f.write("2")
+
+        clock = VirtualClock()
+        coordinator = self.make_coordinator(
+            clock=clock, 
+            batch_window=0, 
+            min_interval=1, 
+            backoff=2
+        )
+        coordinator.request("75129")
+
+        self.assertEqual(["75129"], self.scancel_calls())
+        self.assertEqual(3, coordinator.n_calls)
+
+        # backed off 2 s and 4 s
+        self.assertEqual(6, clock.time_now() - 1.5e9)
+
+    def test_concurrent_assassins(self):
+
+        targets = ["9000_" + str(i) for i in range(20)]
+
+        threads = [
+            threading.Thread(
+                target=self.make_coordinator(
+                    batch_window=0.3, 
+                    min_interval=0.01
+                ).request, 
+                args=(target,)
+            ) for target in targets
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        calls = self.scancel_calls()
+        self.assertLessEqual(len(calls), 4)
+
+        # every task is cancelled exactly once
+        cancelled = []
+        for argument in " ".join(calls).split():
+            job, _, tasks = argument.partition("_")
+            for task_range in tasks.strip("[]").split(","):
+                first, _, last = task_range.partition("-")
+                cancelled += [
+                    job + "_" + str(task) for task in 
+                        range(int(first), int(last or first) + 1)
+                ]
+        self.assertEqual(sorted(targets), sorted(cancelled))
+
+    def test_spool_of_others_is_refused(self):
+
+        spool = os.path.join(self.folder, "open_spool")
+        os.mkdir(spool)
+        os.chmod(spool, 0o777)
+
+        self.assertRaises(
+            PermissionError, 
+            KillCoordinator, 
+            spool, 
+            scancel_command=self.scancel_command
+        )
+
+    @unittest.skipUnless(os.getuid() == 0, "requires root to chown")
+    def test_requests_of_other_users_are_ignored(self):
+
+        coordinator = self.make_coordinator(clock=VirtualClock())
+
+        # a request planted by somebody else
+        coordinator.enqueue("424242")
+        os.chown(coordinator._request_path("424242"), 4242, 4242)
+
+        coordinator.request("75129")
+
+        self.assertEqual(["75129"], self.scancel_calls())
+
+    def test_assassin_kills_array_task(self):
+
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            FakeAssassin, 
+            kill_coordinator=self.make_coordinator(clock=simulation.clock)
+        )
+
+        with mock.patch.dict(os.environ, {
+            "SLURM_ARRAY_JOB_ID": "75100", 
+            "SLURM_ARRAY_TASK_ID": "29"
+        }):
+            assassin.kill_job()
+
+        self.assertEqual(["75100_29"], self.scancel_calls())
+
+
+if __name__ == '__main__':
+    unittest.main()
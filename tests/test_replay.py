@@ -0,0 +1,127 @@
+"""This file contains tests for the recording of traces by the assassin and
+their offline replay.
+"""
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from assassin import SlurmAssassin, CalculationCrashed
+from replay import Trace, evaluate, poll_times
+
+from simulation import Simulation
+from test_assassin import LoggerMock
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+
+        LoggerMock.reset_counter()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def record(self, name, steps):
+        """Run the assassin on a simulated calculation (with a timeout so
+        long that it is never reached) and return the recorded trace."""
+
+        trace_file = os.path.join(self.folder, name + ".trace")
+
+        simulation = Simulation()
+        assassin = simulation.make_assassin(
+            SlurmAssassin,
+            timeout=10000,
+            polling_period=1,
+            out_file_name=["calc.out", "calc_*.cube"],
+            trace_file=trace_file
+        )
+        simulation.launch(assassin, steps)
+
+        try:
+            assassin._lurk()
+        except CalculationCrashed:
+            pass
+        assassin._trace_recorder.close()
+
+        return Trace.load(trace_file)
+
+    def dead_calculation(self):
+        """writes every minute for 20 min, hangs for an hour, then crashes"""
+        return self.record(
+            "dead",
+            Simulation.writes_then_stalls("calc.out", 20, 60, 3600, 1)
+        )
+
+    def recovering_calculation(self):
+        """writes, hangs for 20 min, writes again and finishes"""
+        steps = Simulation.writes_then_stalls("calc.out", 5, 60, 1200)[:-1]
+        steps += [("write", "calc_1.cube", "data"), ("sleep", 60)]
+        steps += Simulation.writes_then_stalls("calc.out", 5, 60, 0)[:-1]
+        steps += [("write", "calc.out", "Have a nice day\n"), ("exit", 0)]
+        return self.record("recovering", steps)
+
+    def test_trace_contains_observations(self):
+
+        trace = self.recovering_calculation()
+
+        self.assertEqual(trace.header["timeout"], 10000 * 60)
+        self.assertEqual(
+            {"calc.out", "calc_1.cube"},
+            set(trace.file_names.values())
+        )
+        self.assertEqual(0, trace.return_code)
+        self.assertTrue(trace.succeeded)
+
+        # only the modification times seen at the polls are known
+        write_times = trace.time_start + \
+            np.array([0, 60, 120, 180, 240, 1500, 1560, 1620, 1680, 1740, 1800])
+        self.assertTrue(np.all(np.isin(trace.modification_times, write_times)))
+        self.assertIn(trace.time_start + 1500, trace.modification_times)
+
+    def test_poll_times_match_assassin(self):
+
+        # process handle every 6 s, outfiles every 11th check
+        np.testing.assert_allclose(
+            [66, 132, 198],
+            poll_times(0, 200, 60)
+        )
+
+    def test_dead_calculation(self):
+
+        trace = self.dead_calculation()
+
+        results = evaluate([trace], timeouts=[5, 30, 100], polling_periods=[1])
+
+        np.testing.assert_array_equal([[1, 1, 0]], results["kills"])
+        np.testing.assert_array_equal([[0, 0, 0]], results["false_kills"])
+
+        # detected at most one polling period (+ handle period) late
+        self.assertGreater(results["latency"][0, 0], 5)
+        self.assertLess(results["latency"][0, 0], 5 + 1.2)
+
+        # last write after 19 min, crash after 80 min.
+        self.assertAlmostEqual(
+            (80 - 19 - results["latency"][0, 1]) / 60.0,
+            results["core_hours_saved"][0, 1]
+        )
+        self.assertTrue(np.isnan(results["latency"][0, 2]))
+
+    def test_recovering_calculation(self):
+
+        traces = [self.recovering_calculation(), self.dead_calculation()]
+
+        results = evaluate(traces, timeouts=[10, 30], polling_periods=[1, 5])
+
+        # a timeout of 10 min kills the recovering calculation by mistake
+        np.testing.assert_array_equal([[1, 0], [1, 0]], results["false_kills"])
+        np.testing.assert_array_equal([[2, 1], [2, 1]], results["kills"])
+        self.assertTrue(np.all(results["core_hours_lost"][:, 0] > 0))
+        self.assertTrue(np.all(results["core_hours_lost"][:, 1] == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
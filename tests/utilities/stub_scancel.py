@@ -0,0 +1,31 @@
+"""This script stands in for Slurm's scancel in the tests: it appends its
+arguments to the file given by STUB_SCANCEL_LOG. If the file given by 
+STUB_SCANCEL_FAILURES contains a number n > 0, it decrements it and fails 
+like scancel does when the controller is not reachable.
+"""
+
+import os
+import sys
+
+
+def main():
+
+    failures_file = os.environ.get("STUB_SCANCEL_FAILURES")
+    if failures_file and os.path.exists(failures_file):
+        with open(failures_file) as f:
+            failures = int(f.read() or 0)
+
+        if failures > 0:
+            with open(failures_file, "w") as f:
+                f.write(str(failures - 1))
+
+            sys.stderr.write(
+                "scancel: error: Socket timed out on send/recv operation\n"
+            )
+            sys.exit(1)
+
+    with open(os.environ["STUB_SCANCEL_LOG"], "a") as f:
+        f.write(" ".join(sys.argv[1:]) + "\n")
+
+if __name__ == '__main__':
+    main()
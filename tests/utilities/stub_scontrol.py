@@ -0,0 +1,21 @@
+"""This script stands in for Slurm's scontrol in the tests: it appends its
+arguments to the file given by STUB_SCONTROL_LOG. It fails if the 
+environment variable STUB_SCONTROL_FAIL is set.
+"""
+
+import os
+import sys
+
+
+def main():
+
+    if os.environ.get("STUB_SCONTROL_FAIL"):
+        sys.stderr.write("scontrol: error: Requested operation is presently " \
+            "disabled for job\n")
+        sys.exit(1)
+
+    with open(os.environ["STUB_SCONTROL_LOG"], "a") as f:
+        f.write(" ".join(sys.argv[1:]) + "\n")
+
+if __name__ == '__main__':
+    main()